@@ -0,0 +1,69 @@
+"""
+Token-window chunking for emails longer than the model's context.
+Splits token ids into overlapping windows and combines the per-window
+class probabilities back into one verdict per email.
+"""
+
+from typing import List, Sequence, Tuple
+
+AGGREGATIONS = ('max', 'mean')
+
+def token_windows(token_ids: Sequence[int], window_size: int, overlap: int,
+                  max_windows: int) -> List[Sequence[int]]:
+    """
+    Split token ids into overlapping windows of at most window_size tokens.
+
+    When more than max_windows windows would be needed, evenly spaced ones
+    are kept, always including the first and the last, so the cost per
+    email stays bounded while the tail of long emails is still read.
+
+    Args:
+        token_ids: Token ids of the whole email (no special tokens)
+        window_size (int): Tokens per window
+        overlap (int): Tokens shared by consecutive windows
+        max_windows (int): Cap on the number of windows returned
+
+    Returns:
+        List of token id windows (a single, possibly empty, window for short input)
+    """
+    if overlap >= window_size:
+        raise ValueError("overlap must be smaller than window_size")
+    stride = window_size - overlap
+    starts = range(0, max(len(token_ids) - overlap, 1), stride)
+    windows = [token_ids[start:start + window_size] for start in starts]
+
+    if len(windows) > max_windows:
+        if max_windows <= 1:
+            return windows[:1]
+        last = len(windows) - 1
+        windows = [windows[round(i * last / (max_windows - 1))] for i in range(max_windows)]
+    return windows
+
+def aggregate_scores(window_probs: List[Sequence[float]], positive_index: int,
+                     mode: str = 'max') -> Tuple[str, float]:
+    """
+    Combine per-window probabilities into (classification, confidence).
+
+    'max' lets the most suspicious window decide the email; 'mean' averages
+    the probabilities of all windows. With a single window both reproduce
+    the plain classifier output.
+
+    Args:
+        window_probs: Class probabilities for each window of one email
+        positive_index (int): Index of the POSITIVE (legitimate) class
+        mode (str): 'max' or 'mean'
+
+    Returns:
+        Tuple[str, float]: 'legitimate' or 'suspicious' and its confidence
+    """
+    positive = [probs[positive_index] for probs in window_probs]
+    if mode == 'max':
+        legitimate = min(positive)
+    elif mode == 'mean':
+        legitimate = sum(positive) / len(positive)
+    else:
+        raise ValueError(f"Unknown aggregation '{mode}', expected one of {AGGREGATIONS}")
+
+    if legitimate > 0.5:
+        return 'legitimate', legitimate
+    return 'suspicious', 1.0 - legitimate
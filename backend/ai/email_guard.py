@@ -1,115 +1,290 @@
 """
 AI-powered email analysis module using HuggingFace Transformers.
 Analyzes email content to detect spam, phishing, or legitimate emails.
+
+The transformer model (and torch/transformers themselves) are only imported
+on the first classification, or when warmup() is called explicitly. The
+inference backend (torch, onnx or onnx-int8) is chosen with EMAIL_GUARD_BACKEND.
+
+When the inference daemon (python -m ai.sidecar) is running, analyze_email()
+and analyze_emails() send their emails to it and no model is loaded here.
 """
 
-import re
-from typing import Dict, List, Tuple
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-import torch
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from ai.chunking import AGGREGATIONS, aggregate_scores, token_windows
+from ai.html_text import web_links
+from ai.inference_backends import BACKENDS, DEFAULT_BACKEND, create_backend
+from ai.near_duplicate import NearDuplicateIndex
+from ai.result_cache import ResultCache
+from ai.rule_engine import RuleHits, rule_engine, uppercase_ratio
+from ai.sidecar import SidecarClient, SidecarUnavailable
+
+# Number of token windows (one per short email) sent through the classifier per forward pass
+DEFAULT_BATCH_SIZE = 16
+# Long emails are read in overlapping token windows, capped per email, whose
+# scores are combined with 'max' (most suspicious window wins) or 'mean'
+DEFAULT_MAX_WINDOWS = int(os.getenv("EMAIL_GUARD_MAX_WINDOWS", "8"))
+DEFAULT_WINDOW_OVERLAP = int(os.getenv("EMAIL_GUARD_WINDOW_OVERLAP", "64"))
+DEFAULT_AGGREGATION = os.getenv("EMAIL_GUARD_AGGREGATION", "max")
+# Result cache capacity (0 disables it) and entry lifetime in seconds
+DEFAULT_CACHE_SIZE = int(os.getenv("EMAIL_GUARD_CACHE_SIZE", "1024"))
+DEFAULT_CACHE_TTL = float(os.getenv("EMAIL_GUARD_CACHE_TTL", "3600"))
+# Near-duplicate index capacity (0 disables it) and similarity needed to reuse a verdict
+DEFAULT_NEAR_DUP_SIZE = int(os.getenv("EMAIL_GUARD_NEAR_DUP_SIZE", "10000"))
+DEFAULT_NEAR_DUP_THRESHOLD = float(os.getenv("EMAIL_GUARD_NEAR_DUP_THRESHOLD", "0.75"))
 
 class EmailGuardAI:
     """AI-powered email analysis using pre-trained transformer models."""
     
-    def __init__(self):
-        """Initialize the AI model and tokenizer."""
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_windows: int = DEFAULT_MAX_WINDOWS,
+                 window_overlap: int = DEFAULT_WINDOW_OVERLAP,
+                 aggregation: str = DEFAULT_AGGREGATION,
+                 cache_size: int = DEFAULT_CACHE_SIZE,
+                 cache_ttl: Optional[float] = DEFAULT_CACHE_TTL,
+                 near_dup_size: int = DEFAULT_NEAR_DUP_SIZE,
+                 near_dup_threshold: float = DEFAULT_NEAR_DUP_THRESHOLD,
+                 backend: str = DEFAULT_BACKEND):
+        """Initialize the analyzer; the model itself is loaded on first use."""
         self.model_name = "distilbert-base-uncased-finetuned-sst-2-english"
-        self.classifier = None
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+        self.backend = backend
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{aggregation}', expected one of {AGGREGATIONS}")
+        self.batch_size = batch_size
+        self.max_windows = max_windows
+        self.window_overlap = window_overlap
+        self.aggregation = aggregation
+        self.cache = ResultCache(cache_size, cache_ttl)
+        self.near_duplicates = NearDuplicateIndex(near_dup_size, near_dup_threshold)
         self.tokenizer = None
-        self._load_model()
+        self._classifier = None
+        self._load_lock = threading.Lock()
+    
+    @property
+    def classifier(self):
+        """The inference backend running the transformer, loaded on first access."""
+        if self._classifier is None:
+            self._load_model()
+        return self._classifier
+    
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model has been loaded yet."""
+        return self._classifier is not None
         
     def _load_model(self):
         """Load the pre-trained model and tokenizer."""
-        try:
-            print("Loading AI model...")
-            self.classifier = pipeline(
-                "sentiment-analysis",
-                model=self.model_name,
-                device=-1  # CPU only
-            )
-            print("AI model loaded successfully!")
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            raise
+        with self._load_lock:
+            if self._classifier is not None:
+                return
+            try:
+                print(f"Loading AI model ({self.backend} backend)...")
+                self._classifier = create_backend(self.backend, self.model_name)
+                self.tokenizer = self._classifier.tokenizer
+                print("AI model loaded successfully!")
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                raise
     
-    def _extract_features(self, text: str) -> Dict[str, float]:
-        """Extract features from email text for analysis."""
+    def warmup(self) -> None:
+        """Load the model and run one dummy classification ahead of real traffic."""
+        self._classify_content("Warmup email content.")
+    
+    def _extract_features(self, text: str, rule_hits: Optional[RuleHits] = None,
+                          links: Optional[List[str]] = None) -> Dict[str, float]:
+        """Extract features from email text (and the href targets of its HTML, if known) for analysis."""
+        counts = (rule_hits or rule_engine.scan(text)).counts
         features = {
             'length': len(text),
             'word_count': len(text.split()),
-            'uppercase_ratio': sum(1 for c in text if c.isupper()) / len(text) if text else 0,
+            'uppercase_ratio': uppercase_ratio(text),
             'exclamation_count': text.count('!'),
             'question_count': text.count('?'),
-            'url_count': len(re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', text)),
-            'email_count': len(re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)),
-            'money_mentions': len(re.findall(r'\$[\d,]+|\d+\s*(?:dollars?|euros?|pounds?)', text, re.IGNORECASE)),
-            'urgent_words': len(re.findall(r'\b(?:urgent|immediate|action|required|account|suspended|verify|confirm|password|login|security)\b', text, re.IGNORECASE))
+            # Links of HTML bodies are gone from the extracted text
+            'url_count': max(counts['url_count'], len(web_links(links or []))),
+            'email_count': counts['email_count'],
+            'money_mentions': counts['money_mentions'],
+            'urgent_words': counts['urgent_words']
         }
         return features
     
     def _classify_content(self, text: str) -> Tuple[str, float]:
         """Classify email content using the transformer model."""
+        return self._classify_contents([text])[0]
+    
+    def _classify_contents(self, texts: List[str], batch_size: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Classify several email contents in padded mini-batches.
+        
+        Each email is tokenized in full and split into overlapping windows
+        that fit the model context; the windows of all emails are batched
+        together and their scores aggregated back into one verdict per email.
+        """
+        batch_size = batch_size or self.batch_size
+        # Load outside the try block so model loading errors still propagate
+        classifier = self.classifier
+        tokenizer = classifier.tokenizer
         try:
-            result = self.classifier(text[:512])  # Limit to 512 tokens
+            window_size = classifier.max_length - tokenizer.num_special_tokens_to_add()
+            token_ids = tokenizer(texts, add_special_tokens=False, verbose=False)['input_ids']
+            
+            windows = []  # (email index, window token ids)
+            for i, ids in enumerate(token_ids):
+                for window in token_windows(ids, window_size, self.window_overlap, self.max_windows):
+                    windows.append((i, tokenizer.build_inputs_with_special_tokens(list(window))))
+            # Sort by length so each mini-batch pads to a similar size
+            windows.sort(key=lambda item: len(item[1]))
+            
+            window_probs = [[] for _ in texts]
+            for start in range(0, len(windows), batch_size):
+                batch = windows[start:start + batch_size]
+                width = len(batch[-1][1])
+                input_ids = [ids + [tokenizer.pad_token_id] * (width - len(ids)) for _, ids in batch]
+                attention_mask = [[1] * len(ids) + [0] * (width - len(ids)) for _, ids in batch]
+                for (i, _), probs in zip(batch, classifier.predict_proba(input_ids, attention_mask)):
+                    window_probs[i].append(probs)
+            
             # Map sentiment to our categories
-            if result[0]['label'] == 'POSITIVE':
-                return 'legitimate', result[0]['score']
-            else:
-                return 'suspicious', result[0]['score']
+            return [
+                aggregate_scores(probs, classifier.positive_index, self.aggregation)
+                for probs in window_probs
+            ]
         except Exception as e:
             print(f"Error in classification: {e}")
-            return 'unknown', 0.0
+            return [('unknown', 0.0)] * len(texts)
     
-    def _detect_phishing_indicators(self, text: str) -> List[str]:
+    def _detect_phishing_indicators(self, text: str, rule_hits: Optional[RuleHits] = None) -> List[str]:
         """Detect specific phishing indicators in the text."""
-        indicators = []
-        
-        # Common phishing patterns
-        patterns = {
-            'urgent_action': r'\b(?:urgent|immediate|action required|account suspended|verify now)\b',
-            'personal_info': r'\b(?:password|login|account|verify|confirm|personal information)\b',
-            'financial': r'\b(?:bank|credit card|account|payment|transfer|money)\b',
-            'suspicious_links': r'\b(?:click here|login here|verify here|secure link)\b',
-            'grammar_errors': r'\b(?:dear sir|madam|kindly|please find|attached herewith)\b',
-            'generic_greeting': r'^(?:dear user|dear customer|dear sir|dear madam)',
-        }
-        
-        for indicator, pattern in patterns.items():
-            if re.search(pattern, text, re.IGNORECASE):
-                indicators.append(indicator)
-        
-        return indicators
+        return list((rule_hits or rule_engine.scan(text)).indicators)
     
-    def analyze_email(self, text: str) -> Dict:
+    def analyze_email(self, text: str, links: Optional[List[str]] = None) -> Dict:
         """
         Analyze email content and return classification results.
         
         Args:
             text (str): Email content to analyze
+            links (List[str]): href targets of the email's HTML body (optional)
             
         Returns:
-            Dict: Analysis results with classification, confidence, and explanation
+            Dict: Analysis results with classification, confidence, and explanation;
+            'cached' tells whether the result came from the result cache and
+            'near_duplicate' whether the model verdict was reused from a
+            similar, previously scanned email ('similarity' gives how similar)
+        """
+        return self.analyze_emails([text], links=[links] if links else None)[0]
+    
+    def analyze_emails(self, texts: List[str], batch_size: Optional[int] = None,
+                       links: Optional[List[Optional[List[str]]]] = None) -> List[Dict]:
         """
-        if not text or not text.strip():
-            return {
-                'classification': 'invalid',
-                'confidence': 0.0,
-                'explanation': 'Empty or invalid email content provided.',
-                'features': {},
-                'indicators': []
-            }
-        
-        # Clean and normalize text
-        text = text.strip()
+        Analyze several emails, running the classifier over mini-batches.
         
-        # Extract features
-        features = self._extract_features(text)
+        Args:
+            texts (List[str]): Email contents to analyze
+            batch_size (int): Token windows per forward pass (default: self.batch_size)
+            links (List[List[str]]): href targets of each email's HTML body (optional)
+            
+        Returns:
+            List[Dict]: One analysis result per email, in input order,
+            shaped exactly like the result of analyze_email
+        """
+        results = [None] * len(texts)
+        # Emails that still need the model, by cache key (duplicates run once)
+        pending: Dict[str, Tuple[str, List[int]]] = {}
+        pending_links: Dict[str, List[str]] = {}
+        for i, text in enumerate(texts):
+            if not text or not text.strip():
+                results[i] = self._invalid_result()
+                continue
+            
+            # Clean and normalize text
+            text = text.strip()
+            email_links = web_links(links[i] or []) if links else []
+            # Links change the features, so they are part of the cache key
+            key = self.cache.key_for('\0'.join([text] + email_links))
+            if key in pending:
+                pending[key][1].append(i)
+                continue
+            
+            cached = self.cache.get(key)
+            if cached is not None:
+                cached['cached'] = True
+                results[i] = cached
+            else:
+                pending[key] = (text, [i])
+                pending_links[key] = email_links
+        
+        if pending:
+            verdicts = self._near_duplicate_verdicts(pending, batch_size)
+            for key, (text, indices) in pending.items():
+                classification, confidence, similarity = verdicts[key]
+                result = self._build_result(text, classification, confidence, pending_links[key])
+                result['near_duplicate'] = similarity is not None
+                if similarity is not None:
+                    result['similarity'] = similarity
+                # Do not pin classification failures in the cache
+                if classification != 'unknown':
+                    self.cache.put(key, result)
+                for i in indices:
+                    results[i] = dict(result, cached=False)
+        
+        return results
+    
+    def _near_duplicate_verdicts(self, pending: Dict[str, Tuple[str, List[int]]],
+                                 batch_size: Optional[int]) -> Dict[str, Tuple[str, float, Optional[float]]]:
+        """
+        Model verdicts for the pending emails, reusing those of near-duplicates.
         
-        # Get AI classification
-        classification, confidence = self._classify_content(text)
+        Returns:
+            Dict: cache key -> (classification, confidence, similarity), where
+            similarity is None when the classifier actually ran
+        """
+        verdicts = {}
+        signatures = {}
+        for key, (text, _) in pending.items():
+            signature = self.near_duplicates.signature(text)
+            match = self.near_duplicates.query(signature)
+            if match is not None:
+                (classification, confidence), similarity = match
+                verdicts[key] = (classification, confidence, similarity)
+            else:
+                signatures[key] = signature
+        
+        if signatures:
+            keys = list(signatures)
+            labels = self._classify_contents([pending[key][0] for key in keys], batch_size)
+            for key, (classification, confidence) in zip(keys, labels):
+                verdicts[key] = (classification, confidence, None)
+                if classification != 'unknown':
+                    self.near_duplicates.add(signatures[key], (classification, confidence))
+        
+        return verdicts
+    
+    def _invalid_result(self) -> Dict:
+        """Result returned for empty or missing email content."""
+        return {
+            'classification': 'invalid',
+            'confidence': 0.0,
+            'explanation': 'Empty or invalid email content provided.',
+            'features': {},
+            'indicators': []
+        }
+    
+    def _build_result(self, text: str, classification: str, confidence: float,
+                      links: Optional[List[str]] = None) -> Dict:
+        """Combine the model output with rule-based features into a result."""
+        # Run every regex rule in one scan, shared by features and indicators
+        rule_hits = rule_engine.scan(text)
+        
+        # Extract features
+        features = self._extract_features(text, rule_hits, links)
         
         # Detect phishing indicators
-        indicators = self._detect_phishing_indicators(text)
+        indicators = self._detect_phishing_indicators(text, rule_hits)
         
         # Determine final classification based on multiple factors
         final_classification = self._determine_final_classification(
@@ -186,17 +361,71 @@ class EmailGuardAI:
         
         return base_explanation
 
-# Global instance for easy access
+# Global instance for easy access (cheap: the model loads lazily)
 email_guard_ai = EmailGuardAI()
+# Client of the inference daemon, used instead of email_guard_ai while it runs
+sidecar_client = SidecarClient()
+
+def warmup() -> None:
+    """Load the global model now instead of on the first analysis (not needed while the daemon runs)."""
+    if not sidecar_client.available():
+        email_guard_ai.warmup()
+
+def load_model() -> None:
+    """Load the global model without running it, e.g. in a master process before forking."""
+    email_guard_ai.classifier
+
+def is_model_loaded() -> bool:
+    """Whether the global model has been loaded in this process."""
+    return email_guard_ai.is_loaded
+
+def get_cache_stats() -> Dict:
+    """Hit/miss counters and size of the global result cache."""
+    return email_guard_ai.cache.stats()
+
+def get_near_duplicate_stats() -> Dict:
+    """Size and match counters of the global near-duplicate index."""
+    return email_guard_ai.near_duplicates.stats()
+
+def _analyze_with_sidecar(texts: List[str], links: Optional[List[Optional[List[str]]]] = None) -> Optional[List[Dict]]:
+    """Results from the inference daemon, or None when it is not running."""
+    if not sidecar_client.available():
+        return None
+    try:
+        return sidecar_client.analyze(texts, links)
+    except SidecarUnavailable:
+        return None
 
-def analyze_email(text: str) -> Dict:
+def analyze_email(text: str, links: Optional[List[str]] = None) -> Dict:
     """
     Convenience function to analyze email content.
     
     Args:
         text (str): Email content to analyze
+        links (List[str]): href targets of the email's HTML body (optional)
         
     Returns:
         Dict: Analysis results
     """
-    return email_guard_ai.analyze_email(text) 
\ No newline at end of file
+    results = _analyze_with_sidecar([text], [links] if links else None)
+    if results is not None:
+        return results[0]
+    return email_guard_ai.analyze_email(text, links)
+
+def analyze_emails(texts: List[str], batch_size: Optional[int] = None,
+                   links: Optional[List[Optional[List[str]]]] = None) -> List[Dict]:
+    """
+    Convenience function to analyze several emails in batches.
+    
+    Args:
+        texts (List[str]): Email contents to analyze
+        batch_size (int): Token windows per forward pass (optional)
+        links (List[List[str]]): href targets of each email's HTML body (optional)
+        
+    Returns:
+        List[Dict]: Analysis results, in input order
+    """
+    results = _analyze_with_sidecar(list(texts), links)
+    if results is not None:
+        return results
+    return email_guard_ai.analyze_emails(texts, batch_size, links)
@@ -0,0 +1,114 @@
+"""
+HTML-to-text extraction for email bodies.
+A single html.parser pass drops <style>/<script> contents, decodes
+entities, keeps block structure as line breaks and collects the href
+targets of links, so URL features can come from the actual links. Output
+is bounded: parsing stops once enough text has been extracted.
+"""
+
+import os
+import re
+from html.parser import HTMLParser
+from typing import List, NamedTuple
+
+# Characters of text kept per document
+DEFAULT_MAX_CHARS = int(os.getenv("EMAIL_GUARD_MAX_HTML_CHARS", "100000"))
+MAX_LINKS = 1000
+# Source characters fed to the parser per step
+FEED_CHUNK = 64 * 1024
+
+# Elements whose content is never text
+SKIP_TAGS = frozenset(('style', 'script', 'noscript', 'template', 'svg'))
+# Elements that start a new line
+BLOCK_TAGS = frozenset((
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+    'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'title', 'tr', 'ul',
+))
+_WHITESPACE = re.compile(r'[ \t\r\n\f\v\xa0]+')
+
+class HtmlText(NamedTuple):
+    """Visible text of an HTML document and the links it contains."""
+    text: str
+    links: List[str]
+    truncated: bool
+
+class HtmlTextExtractor(HTMLParser):
+    """Incremental extractor; feed() chunks, then read text() and links."""
+
+    def __init__(self, max_chars: int = DEFAULT_MAX_CHARS, max_links: int = MAX_LINKS):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.max_links = max_links
+        self.links: List[str] = []
+        self.truncated = False
+        self._chunks: List[str] = []
+        self._size = 0
+        self._skip_depth = 0
+
+    @property
+    def full(self) -> bool:
+        """Whether the text budget is used up (feeding more is pointless)."""
+        return self._size >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._chunks.append('\n')
+        if tag in ('a', 'area') and len(self.links) < self.max_links:
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value.strip())
+                    break
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._chunks.append('\n')
+
+    def handle_data(self, data):
+        if self._skip_depth or self.full:
+            return
+        data = _WHITESPACE.sub(' ', data)
+        room = self.max_chars - self._size
+        if len(data) > room:
+            data = data[:room]
+            self.truncated = True
+        self._size += len(data)
+        self._chunks.append(data)
+
+    def text(self) -> str:
+        """Extracted text, one line per block, blank lines removed."""
+        lines = (line.strip() for line in ''.join(self._chunks).split('\n'))
+        return '\n'.join(line for line in lines if line)
+
+def html_to_text(html: str, max_chars: int = DEFAULT_MAX_CHARS) -> HtmlText:
+    """
+    Extract the visible text and link targets of an HTML document.
+
+    Args:
+        html (str): HTML source
+        max_chars (int): Characters of text to keep
+
+    Returns:
+        HtmlText: Text, href targets in document order, and whether the text was cut off
+    """
+    extractor = HtmlTextExtractor(max_chars)
+    for start in range(0, len(html), FEED_CHUNK):
+        extractor.feed(html[start:start + FEED_CHUNK])
+        if extractor.full:
+            extractor.truncated = extractor.truncated or start + FEED_CHUNK < len(html)
+            break
+    else:
+        extractor.close()
+    return HtmlText(extractor.text(), extractor.links, extractor.truncated)
+
+def web_links(links: List[str]) -> List[str]:
+    """Distinct http(s) link targets, in order of first appearance."""
+    seen = {}
+    for link in links:
+        if link.lower().startswith(('http://', 'https://')):
+            seen.setdefault(link, None)
+    return list(seen)
@@ -0,0 +1,248 @@
+"""
+Pluggable inference backends for the EmailGuardAI classifier.
+
+- torch:     the HuggingFace model in fp32 PyTorch (reference implementation)
+- onnx:      the same model exported to ONNX and run with ONNX Runtime
+- onnx-int8: the ONNX export with dynamic int8 weight quantization
+
+The backend is picked with the EMAIL_GUARD_BACKEND environment variable.
+ONNX exports are written once to EMAIL_GUARD_ONNX_DIR and reused; running an
+existing export needs onnxruntime but not torch.
+
+Check agreement with the PyTorch reference before switching in production:
+
+    python -m ai.inference_backends onnx-int8 --file samples.txt
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+DEFAULT_BACKEND = os.getenv("EMAIL_GUARD_BACKEND", "torch")
+DEFAULT_ONNX_DIR = os.getenv(
+    "EMAIL_GUARD_ONNX_DIR",
+    str(Path.home() / ".cache" / "email_guard" / "onnx")
+)
+# Intra-op threads per inference call (0 keeps the library default)
+INFERENCE_THREADS = int(os.getenv("EMAIL_GUARD_INFERENCE_THREADS", "0"))
+
+# Used by the parity check when no sample file is given
+PARITY_SAMPLES = [
+    "Hi John, I wanted to follow up on our meeting from last week regarding the project timeline.",
+    "Dear Customer, your account has been suspended. Verify your password immediately at http://secure-bank-verify.com/login",
+    "LIMITED TIME OFFER! Claim your FREE iPhone now, this offer expires in 2 hours!",
+    "Please find attached herewith the invoice for your recent payment. Kindly confirm receipt.",
+    "The team lunch moved to Friday at noon. Let me know if you have any dietary restrictions.",
+    "URGENT: unusual sign-in activity detected. Click here to secure your account or it will be closed.",
+    "Thanks for your order! Your package will arrive on Tuesday.",
+    "Your password will expire today. Login here to keep your access to company email.",
+]
+
+class InferenceBackend:
+    """Tokenizer, model config and a predict_proba() over padded token ids."""
+
+    name = 'base'
+
+    def __init__(self, model_name: str):
+        """Load the tokenizer and model config shared by every backend."""
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.config = AutoConfig.from_pretrained(model_name)
+        self.max_length = min(self.tokenizer.model_max_length, self.config.max_position_embeddings)
+        self.positive_index = self.config.label2id['POSITIVE']
+
+    def predict_proba(self, input_ids: List[List[int]], attention_mask: List[List[int]]) -> List[List[float]]:
+        """Class probabilities for a padded batch of token ids."""
+        raise NotImplementedError
+
+class TorchBackend(InferenceBackend):
+    """fp32 PyTorch inference on CPU."""
+
+    name = 'torch'
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        if INFERENCE_THREADS:
+            torch.set_num_threads(INFERENCE_THREADS)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        self.model.eval()
+
+    def predict_proba(self, input_ids, attention_mask):
+        import torch
+
+        with torch.no_grad():
+            logits = self.model(
+                input_ids=torch.tensor(input_ids),
+                attention_mask=torch.tensor(attention_mask)
+            ).logits
+        return logits.softmax(dim=-1).tolist()
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime inference over an fp32 export of the model."""
+
+    name = 'onnx'
+
+    def __init__(self, model_name: str, onnx_dir: str = DEFAULT_ONNX_DIR):
+        super().__init__(model_name)
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(
+                f"The '{self.name}' backend requires onnxruntime (pip install onnxruntime)"
+            ) from e
+
+        self.model_dir = Path(onnx_dir) / model_name.replace('/', '--')
+        model_path = self._model_path()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if INFERENCE_THREADS:
+            options.intra_op_num_threads = INFERENCE_THREADS
+        self.session = onnxruntime.InferenceSession(
+            str(model_path), options, providers=['CPUExecutionProvider']
+        )
+
+    def _model_path(self) -> Path:
+        """Path of the fp32 export, exporting it first if needed."""
+        path = self.model_dir / "model.onnx"
+        if not path.exists():
+            self._export(path)
+        return path
+
+    def _export(self, path: Path) -> None:
+        """Export the PyTorch model to ONNX with dynamic batch and sequence axes."""
+        import torch
+        from transformers import AutoModelForSequenceClassification
+
+        print(f"Exporting {self.model_name} to {path}...")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        model.eval()
+        sample = self.tokenizer(["Export sample email."], return_tensors='pt')
+        token_axes = {0: 'batch', 1: 'sequence'}
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample['input_ids'], sample['attention_mask']),
+                str(path),
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['logits'],
+                dynamic_axes={
+                    'input_ids': token_axes,
+                    'attention_mask': token_axes,
+                    'logits': {0: 'batch'},
+                },
+                opset_version=14
+            )
+
+    def predict_proba(self, input_ids, attention_mask):
+        import numpy as np
+
+        logits = self.session.run(['logits'], {
+            'input_ids': np.asarray(input_ids, dtype=np.int64),
+            'attention_mask': np.asarray(attention_mask, dtype=np.int64),
+        })[0]
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return (exp / exp.sum(axis=-1, keepdims=True)).tolist()
+
+class QuantizedOnnxBackend(OnnxBackend):
+    """ONNX Runtime inference with dynamically int8-quantized weights."""
+
+    name = 'onnx-int8'
+
+    def _model_path(self) -> Path:
+        """Path of the int8 model, quantizing the fp32 export first if needed."""
+        path = self.model_dir / "model.int8.onnx"
+        if not path.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            fp32_path = super()._model_path()
+            print(f"Quantizing {fp32_path} to {path}...")
+            quantize_dynamic(str(fp32_path), str(path), weight_type=QuantType.QInt8)
+        return path
+
+_BACKEND_CLASSES = {
+    'torch': TorchBackend,
+    'onnx': OnnxBackend,
+    'onnx-int8': QuantizedOnnxBackend,
+}
+
+def create_backend(name: str, model_name: str) -> InferenceBackend:
+    """
+    Instantiate an inference backend by name.
+
+    Args:
+        name (str): One of BACKENDS
+        model_name (str): HuggingFace model identifier
+
+    Returns:
+        InferenceBackend: Loaded backend
+    """
+    if name not in _BACKEND_CLASSES:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {BACKENDS}")
+    return _BACKEND_CLASSES[name](model_name)
+
+def _classify(backend: InferenceBackend, texts: Sequence[str]) -> List[List[float]]:
+    """Single-window probabilities per text, used to compare backends."""
+    encoded = backend.tokenizer(list(texts), truncation=True, max_length=backend.max_length, padding=True)
+    return backend.predict_proba(encoded['input_ids'], encoded['attention_mask'])
+
+def parity_report(candidate: InferenceBackend, texts: Sequence[str],
+                  reference: Optional[InferenceBackend] = None) -> Dict:
+    """
+    Compare a backend's outputs with the PyTorch reference.
+
+    Args:
+        candidate: Backend under test
+        texts: Sample email texts
+        reference: Reference backend (default: a fresh TorchBackend)
+
+    Returns:
+        Dict: label agreement rate and absolute differences in the
+        POSITIVE-class probability
+    """
+    reference = reference or TorchBackend(candidate.model_name)
+    expected = _classify(reference, texts)
+    actual = _classify(candidate, texts)
+
+    index = reference.positive_index
+    diffs = [abs(e[index] - a[index]) for e, a in zip(expected, actual)]
+    agreements = [(e[index] > 0.5) == (a[index] > 0.5) for e, a in zip(expected, actual)]
+    return {
+        'backend': candidate.name,
+        'samples': len(texts),
+        'agreement': sum(agreements) / len(texts),
+        'max_abs_diff': max(diffs),
+        'mean_abs_diff': sum(diffs) / len(diffs),
+    }
+
+def main():
+    """Print a parity report for one backend against PyTorch."""
+    parser = argparse.ArgumentParser(description="Check an inference backend against the PyTorch reference")
+    parser.add_argument('backend', choices=[name for name in BACKENDS if name != 'torch'])
+    parser.add_argument('-f', '--file', help='Sample emails, one per line (default: built-in samples)')
+    parser.add_argument('--model', default="distilbert-base-uncased-finetuned-sst-2-english")
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help='Exit with code 1 below this label agreement (default: 0.99)')
+    args = parser.parse_args()
+
+    texts = PARITY_SAMPLES
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    report = parity_report(create_backend(args.backend, args.model), texts)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    sys.exit(0 if report['agreement'] >= args.min_agreement else 1)
+
+if __name__ == "__main__":
+    main()
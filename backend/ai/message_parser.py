@@ -0,0 +1,331 @@
+"""
+Streaming parser for raw RFC 822 / MIME messages.
+Only the text/plain and text/html parts are decoded, line by line (HTML
+straight into ai.html_text's extractor), and attachments are skipped
+without being buffered. Extracted text is capped at a byte budget, so
+memory stays bounded however large the message is.
+
+Header blocks (of the message and of every part) are parsed with
+email.parser.BytesFeedParser; part bodies are walked by their multipart
+boundaries directly so their payloads never reach the email package.
+"""
+
+import binascii
+import codecs
+import os
+import re
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesFeedParser
+from typing import BinaryIO, List, NamedTuple, Optional
+
+from ai.html_text import HtmlTextExtractor
+
+# Decoded bytes kept per text kind (plain, html)
+DEFAULT_MAX_BYTES = int(os.getenv("EMAIL_GUARD_MAX_MESSAGE_BYTES", str(128 * 1024)))
+# Longer physical lines are read in pieces
+MAX_LINE = 64 * 1024
+# Header bytes parsed per header block; the rest are skipped
+MAX_HEADER_BYTES = 64 * 1024
+# Multiparts nested deeper than this are skipped
+MAX_DEPTH = 32
+
+_HEADER_LINE = re.compile(rb'^[\x21-\x39\x3b-\x7e]+:')
+# Input without any of these fields is taken as bare text, not a header block
+_KNOWN_HEADER = re.compile(
+    rb'^(from|to|cc|subject|date|received|return-path|message-id|mime-version|'
+    rb'content-type|reply-to|sender|delivered-to|x-[\w-]+):', re.IGNORECASE
+)
+_BLANK = (b'\r\n', b'\n', b'')
+# mbox separator: "From <envelope sender> <asctime date>", e.g. "From a@b.c Mon Jan  1 00:00:00 2024"
+_MBOX_FROM = re.compile(
+    rb'^From \S+ +(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) (?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) '
+    rb'+\d{1,2} \d{1,2}:\d{2}(?::\d{2})? (?:\S+ )?\d{4}\s*$'
+)
+
+def is_mbox_separator(line: bytes) -> bool:
+    """Whether a line is an mbox message separator ("From <sender> <asctime date>")."""
+    return _MBOX_FROM.match(line) is not None
+
+class ParsedMessage(NamedTuple):
+    """Text extracted from a message."""
+    subject: str
+    text: str
+    html_text: str
+    links: List[str]
+    truncated: bool
+
+class _Done(Exception):
+    """Stops reading once enough plain text has been extracted."""
+
+class _Lines:
+    """Physical lines of a binary stream, with push-back."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.pushed: List[bytes] = []
+
+    def next(self) -> bytes:
+        if self.pushed:
+            return self.pushed.pop()
+        return self.stream.readline(MAX_LINE)
+
+    def push(self, line: bytes) -> None:
+        self.pushed.append(line)
+
+def _incremental_decoder(encoding: str):
+    return codecs.getincrementaldecoder(encoding)(errors='replace')
+
+class _SafeDecoder:
+    """Incremental decoder for a charset named by the message, which never raises."""
+
+    def __init__(self, charset: str):
+        try:
+            info = codecs.lookup(charset)
+            # Not rot13, base64, zlib and other bytes/str transforms
+            name = info.name if info._is_text_encoding else 'utf-8'
+        except (LookupError, ValueError):
+            name = 'utf-8'
+        # UTF-16/32 without a byte order mark
+        self.fallback = {'utf-16': 'utf-16-le', 'utf-32': 'utf-32-le'}.get(name, 'utf-8')
+        try:
+            self.decoder = _incremental_decoder(name)
+        except Exception:
+            self.decoder = _incremental_decoder(self.fallback)
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        try:
+            return self.decoder.decode(data, final)
+        except Exception:
+            # e.g. a missing BOM, or a codec refusing errors='replace' (idna);
+            # utf-8 with errors='replace' cannot fail
+            self.decoder = _incremental_decoder(self.fallback)
+            self.fallback = 'utf-8'
+            return self.decode(data, final)
+
+class _TextSink:
+    """Charset-decoded text of one kind, up to a byte budget, optionally fed to an HTML extractor."""
+
+    def __init__(self, max_bytes: int, extractor: Optional[HtmlTextExtractor] = None):
+        self.max_bytes = max_bytes
+        self.extractor = extractor
+        self.size = 0
+        self.chunks: List[str] = []
+        self.truncated = False
+
+    @property
+    def full(self) -> bool:
+        return self.size >= self.max_bytes or (self.extractor is not None and self.extractor.full)
+
+    def add(self, data: bytes, decoder) -> None:
+        room = self.max_bytes - self.size
+        if len(data) > room:
+            data = data[:room]
+            self.truncated = True
+        self.size += len(data)
+        self.append(decoder.decode(data))
+
+    def append(self, text: str) -> None:
+        if self.extractor is not None:
+            self.extractor.feed(text)
+        else:
+            self.chunks.append(text)
+
+    def text(self) -> str:
+        if self.extractor is not None:
+            self.extractor.close()
+            return self.extractor.text()
+        return ''.join(self.chunks)
+
+class _MessageReader:
+    """State of one streaming parse."""
+
+    def __init__(self, stream: BinaryIO, max_bytes: int):
+        self.lines = _Lines(stream)
+        self.plain = _TextSink(max_bytes)
+        self.html = _TextSink(max_bytes, HtmlTextExtractor())
+        self.subject = ''
+
+    def read_headers(self) -> EmailMessage:
+        """Parse a header block, consuming its terminating blank line."""
+        parser = BytesFeedParser(policy=policy.default)
+        size = 0
+        while True:
+            line = self.lines.next()
+            if line in _BLANK:
+                break
+            size += len(line)
+            if size <= MAX_HEADER_BYTES:
+                parser.feed(line)
+        parser.feed(b'\r\n')
+        return parser.close()
+
+    def boundary_of(self, line: bytes, boundaries: List[bytes]):
+        """(boundary, closing) if the line is a delimiter of an enclosing multipart."""
+        if not boundaries or not line.startswith(b'--'):
+            return None
+        stripped = line.rstrip()
+        # Innermost first; a closing outer boundary also ends the inner parts
+        for boundary in reversed(boundaries):
+            if stripped == b'--' + boundary:
+                return boundary, False
+            if stripped == b'--' + boundary + b'--':
+                return boundary, True
+        return None
+
+    def skip_body(self, boundaries: List[bytes]) -> None:
+        """Discard lines up to (not including) the next enclosing boundary."""
+        while True:
+            line = self.lines.next()
+            if not line:
+                return
+            if self.boundary_of(line, boundaries):
+                self.lines.push(line)
+                return
+
+    def walk(self, headers: EmailMessage, boundaries: List[bytes]) -> None:
+        """Handle the body of a part whose headers have just been read."""
+        boundary = headers.get_boundary() if headers.get_content_maintype() == 'multipart' else None
+        if boundary:
+            if len(boundaries) < MAX_DEPTH:
+                self.multipart(boundary.encode('ascii', errors='replace'), boundaries)
+            else:
+                self.skip_body(boundaries)
+            return
+        content_type = headers.get_content_type()
+        try:
+            attachment = headers.is_attachment()
+        except Exception:
+            attachment = False
+        sink = {'text/plain': self.plain, 'text/html': self.html}.get(content_type)
+        if sink is None or attachment or sink.full:
+            self.skip_body(boundaries)
+        else:
+            self.text_body(headers, sink, boundaries)
+
+    def multipart(self, boundary: bytes, outer: List[bytes]) -> None:
+        """Walk every part of a multipart body."""
+        boundaries = outer + [boundary]
+        self.skip_body(boundaries)  # preamble
+        while True:
+            line = self.lines.next()
+            if not line:
+                return
+            match = self.boundary_of(line, boundaries)
+            if match is None:
+                continue
+            found, closing = match
+            if found != boundary:
+                # An enclosing multipart ends here
+                self.lines.push(line)
+                return
+            if closing:
+                self.skip_body(outer)  # epilogue
+                return
+            self.walk(self.read_headers(), boundaries)
+
+    def text_body(self, headers: EmailMessage, sink: _TextSink, boundaries: List[bytes]) -> None:
+        """Transfer- and charset-decode a text part into its sink, line by line."""
+        encoding = str(headers.get('content-transfer-encoding', '')).strip().lower()
+        decoder = _SafeDecoder(headers.get_content_charset() or 'utf-8')
+
+        carry = b''
+        while True:
+            line = self.lines.next()
+            if not line:
+                break
+            if self.boundary_of(line, boundaries):
+                self.lines.push(line)
+                break
+            if sink.full:
+                continue
+            if encoding == 'base64':
+                data = carry + b''.join(line.split())
+                usable = len(data) // 4 * 4
+                carry = data[usable:]
+                try:
+                    data = binascii.a2b_base64(data[:usable])
+                except binascii.Error:
+                    data = b''
+            elif encoding == 'quoted-printable':
+                data = binascii.a2b_qp(line)
+            else:
+                data = line
+            sink.add(data, decoder)
+            if sink is self.plain and sink.full:
+                raise _Done()
+        sink.append(decoder.decode(b'', final=True))
+
+    def looks_like_headers(self) -> bool:
+        """Peek at the first block of lines: is it an RFC 822 header block?"""
+        block, size = [], 0
+        while size < MAX_HEADER_BYTES:
+            line = self.lines.next()
+            block.append(line)
+            size += len(line)
+            if line in _BLANK:
+                break
+        for line in reversed(block):
+            self.lines.push(line)
+
+        fields = [line for line in block if line not in _BLANK and line[:1] not in (b' ', b'\t')]
+        return (bool(fields) and all(_HEADER_LINE.match(line) for line in fields)
+                and any(_KNOWN_HEADER.match(line) for line in fields))
+
+    def run(self) -> None:
+        """Parse the whole message."""
+        # A message saved from an mbox may still start with its separator
+        # line; text that merely begins with "From " is kept
+        first = self.lines.next()
+        if not (is_mbox_separator(first) and self.looks_like_headers()):
+            self.lines.push(first)
+
+        if not self.looks_like_headers():
+            # No header block: the whole input is the text
+            self.text_body(EmailMessage(policy=policy.default), self.plain, [])
+            return
+
+        headers = self.read_headers()
+        try:
+            self.subject = str(headers.get('subject', '') or '')
+        except Exception:
+            pass
+        self.walk(headers, [])
+
+def parse_message(stream: BinaryIO, max_bytes: int = DEFAULT_MAX_BYTES) -> ParsedMessage:
+    """
+    Extract the subject and the text/plain and text/html parts of a message.
+
+    Args:
+        stream: Binary stream positioned at the start of the message
+        max_bytes (int): Decoded bytes kept per text kind; reading stops once
+            the plain text budget is used up
+
+    Returns:
+        ParsedMessage: Subject, plain text, text of the HTML part, its link
+        targets and whether anything was cut off
+    """
+    reader = _MessageReader(stream, max_bytes)
+    try:
+        reader.run()
+    except _Done:
+        pass
+    except (ValueError, TypeError, LookupError, AssertionError, UnicodeError):
+        # Malformed content: keep what was extracted before it
+        pass
+    return ParsedMessage(
+        subject=reader.subject,
+        text=reader.plain.text(),
+        html_text=reader.html.text(),
+        links=reader.html.extractor.links,
+        truncated=reader.plain.truncated or reader.html.truncated or reader.html.extractor.truncated
+    )
+
+def decode_text(data: bytes, charset: Optional[str] = None) -> str:
+    """Decode bytes in the charset a message names (utf-8 when unusable), replacing bad bytes; never raises."""
+    return _SafeDecoder(charset or 'utf-8').decode(data, final=True)
+
+def message_text(message: ParsedMessage) -> str:
+    """Text to analyze: the subject followed by the plain text (or the HTML's text when there is none)."""
+    body = message.text if message.text.strip() else message.html_text
+    return f"{message.subject}\n\n{body}" if message.subject else body
@@ -0,0 +1,134 @@
+"""
+MinHash LSH index for reusing model verdicts across near-duplicate emails.
+Campaign variants that differ only in a recipient name, tracking token or
+URL parameter share most word shingles, so they land in the same LSH bucket
+and can reuse the classifier output of an earlier scan.
+"""
+
+import random
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+_TOKEN = re.compile(r'\w+')
+_MASK64 = (1 << 64) - 1
+# Fixed seeds so signatures are comparable across index instances
+_rng = random.Random(1729)
+_SEEDS = tuple(_rng.getrandbits(64) for _ in range(256))
+del _rng
+
+# (classification, confidence) as returned by the model
+Verdict = Tuple[str, float]
+
+class NearDuplicateIndex:
+    """Bounded MinHash LSH index mapping email signatures to model verdicts."""
+
+    def __init__(self, max_entries: int = 10000, threshold: float = 0.75,
+                 num_perm: int = 64, bands: int = 16, shingle_size: int = 2,
+                 min_shingles: int = 8):
+        """
+        Create the index.
+
+        Args:
+            max_entries (int): Signatures kept before the least recently used is dropped (0 disables)
+            threshold (float): Minimum estimated Jaccard similarity to reuse a verdict
+            num_perm (int): MinHash signature length (at most 256)
+            bands (int): LSH bands; num_perm must be divisible by it
+            shingle_size (int): Words per shingle
+            min_shingles (int): Shorter emails are never matched (too little evidence)
+        """
+        if num_perm > len(_SEEDS) or num_perm % bands:
+            raise ValueError("num_perm must be at most 256 and divisible by bands")
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+        self._seeds = _SEEDS[:num_perm]
+        self._entries: "OrderedDict[int, Tuple[Tuple[int, ...], Verdict]]" = OrderedDict()
+        self._buckets: List[Dict[Tuple[int, ...], Set[int]]] = [{} for _ in range(bands)]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+
+    def signature(self, text: str) -> Optional[Tuple[int, ...]]:
+        """MinHash signature of the text's word shingles, or None if it is too short."""
+        if not self.max_entries:
+            return None
+        tokens = _TOKEN.findall(text.lower())
+        size = self.shingle_size
+        shingles = {' '.join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))}
+        if len(shingles) < self.min_shingles:
+            return None
+        hashes = [hash(shingle) & _MASK64 for shingle in shingles]
+        # XOR with a random seed permutes the 64-bit hash space, one seed per slot
+        return tuple(min(map(seed.__xor__, hashes)) for seed in self._seeds)
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        rows = self.rows
+        return [signature[band * rows:(band + 1) * rows] for band in range(self.bands)]
+
+    def query(self, signature: Optional[Tuple[int, ...]]) -> Optional[Tuple[Verdict, float]]:
+        """
+        Find the most similar indexed email above the threshold.
+
+        Returns:
+            Tuple of (verdict, estimated similarity), or None when nothing is close enough
+        """
+        if signature is None or not self.max_entries:
+            return None
+        with self._lock:
+            self.lookups += 1
+            candidates = set()
+            for buckets, key in zip(self._buckets, self._band_keys(signature)):
+                candidates.update(buckets.get(key, ()))
+
+            best = None
+            for entry_id in candidates:
+                other, verdict = self._entries[entry_id]
+                similarity = sum(a == b for a, b in zip(signature, other)) / self.num_perm
+                if similarity >= self.threshold and (best is None or similarity > best[2]):
+                    best = (entry_id, verdict, similarity)
+            if best is None:
+                return None
+
+            self._entries.move_to_end(best[0])
+            self.matches += 1
+            return best[1], best[2]
+
+    def add(self, signature: Optional[Tuple[int, ...]], verdict: Verdict) -> None:
+        """Index a signature with the verdict the model produced for it."""
+        if signature is None or not self.max_entries:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, verdict)
+            for buckets, key in zip(self._buckets, self._band_keys(signature)):
+                buckets.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                old_id, (old_signature, _) = self._entries.popitem(last=False)
+                for buckets, key in zip(self._buckets, self._band_keys(old_signature)):
+                    bucket = buckets[key]
+                    bucket.discard(old_id)
+                    if not bucket:
+                        del buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Index size and how often lookups found a near-duplicate."""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'lookups': self.lookups,
+                'matches': self.matches,
+            }
@@ -0,0 +1,92 @@
+"""
+Bounded LRU/TTL cache for email analysis results.
+Results are keyed on a BLAKE2 hash of the stripped email text, so repeated
+newsletters, campaign mails and notifications skip the transformer pass.
+"""
+
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+class ResultCache:
+    """Thread-safe LRU cache with optional per-entry time-to-live."""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: Optional[float] = 3600.0):
+        """
+        Create the cache.
+
+        Args:
+            max_size (int): Maximum number of entries (0 disables caching)
+            ttl_seconds (float): Entry lifetime in seconds (None or 0: no expiry)
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds or None
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        """Content hash used as the cache key for an email."""
+        return hashlib.blake2b(text.strip().encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a copy of the cached result, or None on a miss."""
+        if not self.max_size:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, result = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def put(self, key: str, result: Dict) -> None:
+        """Store a result, evicting the least recently used entries when full."""
+        if not self.max_size:
+            return
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Size, capacity and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,134 @@
+"""
+Precompiled rule engine for email feature extraction and phishing indicators.
+All keyword rules (urgent words and every phishing indicator) are answered by
+one pass of a single trie-factored pattern over the lowercased text; the URL,
+email and money patterns only run when their literal trigger is present.
+"""
+
+import re
+import string
+from typing import Dict, FrozenSet, List, NamedTuple, Tuple
+
+# Building blocks (kept identical to the original per-rule patterns)
+URL_PATTERN = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+EMAIL_PATTERN = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+MONEY_PATTERN = r'\$[\d,]+|\d+\s*(?:dollars?|euros?|pounds?)'  # matched on lowercased text
+MONEY_UNITS = ('dollar', 'euro', 'pound')
+
+URGENT_WORDS = (
+    'urgent', 'immediate', 'action', 'required', 'account', 'suspended',
+    'verify', 'confirm', 'password', 'login', 'security',
+)
+
+# Common phishing patterns, in the order indicators are reported
+INDICATOR_TERMS = {
+    'urgent_action': ('urgent', 'immediate', 'action required', 'account suspended', 'verify now'),
+    'personal_info': ('password', 'login', 'account', 'verify', 'confirm', 'personal information'),
+    'financial': ('bank', 'credit card', 'account', 'payment', 'transfer', 'money'),
+    'suspicious_links': ('click here', 'login here', 'verify here', 'secure link'),
+    'grammar_errors': ('dear sir', 'madam', 'kindly', 'please find', 'attached herewith'),
+}
+GREETINGS = ('dear user', 'dear customer', 'dear sir', 'dear madam')
+INDICATOR_ORDER = tuple(INDICATOR_TERMS) + ('generic_greeting',)
+
+_ASCII_UPPERCASE = string.ascii_uppercase.encode('ascii')
+
+def _trie_pattern(terms) -> str:
+    """
+    Build a prefix-factored alternation matching any of the terms.
+
+    Optional suffixes are greedy, so a phrase such as "account suspended"
+    wins over its first word "account" whenever both would match.
+    """
+    tree = {}
+    for term in terms:
+        node = tree
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(tree)
+
+def uppercase_ratio(text: str) -> float:
+    """Share of uppercase characters in the text, without a per-character Python loop."""
+    if not text:
+        return 0
+    if text.isascii():
+        data = text.encode('ascii')
+        return (len(data) - len(data.translate(None, _ASCII_UPPERCASE))) / len(text)
+    return sum(map(str.isupper, text)) / len(text)
+
+class RuleHits(NamedTuple):
+    """Raw counts and indicator names found by one scan."""
+    counts: Dict[str, int]
+    indicators: List[str]
+
+class RuleEngine:
+    """Precompiled matcher for all regex-based email rules."""
+
+    def __init__(self):
+        """Compile the patterns and the per-term lookup table."""
+        all_terms = set(URGENT_WORDS)
+        for terms in INDICATOR_TERMS.values():
+            all_terms.update(terms)
+
+        self._url = re.compile(URL_PATTERN)
+        self._email = re.compile(EMAIL_PATTERN)
+        self._money = re.compile(MONEY_PATTERN)
+        self._terms_pattern = re.compile(r'\b' + _trie_pattern(all_terms) + r'\b')
+        self._greeting = re.compile(_trie_pattern(GREETINGS))
+
+        # Per-rule patterns, only used to precompute what each matched term contributes
+        self._urgent = re.compile(r'\b(?:' + '|'.join(URGENT_WORDS) + r')\b')
+        self._indicators = [
+            (name, re.compile(r'\b(?:' + '|'.join(terms) + r')\b'))
+            for name, terms in INDICATOR_TERMS.items()
+        ]
+        self._terms = {term: self._term_info(term) for term in all_terms}
+
+    def _term_info(self, term: str) -> Tuple[int, FrozenSet[str]]:
+        """Urgent-word count and indicator names contributed by one matched term."""
+        return (
+            len(self._urgent.findall(term)),
+            frozenset(name for name, pattern in self._indicators if pattern.search(term))
+        )
+
+    def scan(self, text: str) -> RuleHits:
+        """
+        Collect all rule counts and indicator hits from the text.
+
+        Args:
+            text (str): Email content to scan
+
+        Returns:
+            RuleHits: Feature counts and indicator names (in report order)
+        """
+        lowered = text.lower()
+
+        urgent_words = 0
+        hits = set()
+        for term in self._terms_pattern.findall(lowered):
+            urgent, indicators = self._terms.get(term) or self._term_info(term)
+            urgent_words += urgent
+            hits.update(indicators)
+        if self._greeting.match(lowered):
+            hits.add('generic_greeting')
+
+        has_money = '$' in text or any(unit in lowered for unit in MONEY_UNITS)
+        counts = {
+            'url_count': len(self._url.findall(text)) if 'http' in text else 0,
+            'email_count': len(self._email.findall(text)) if '@' in text else 0,
+            'money_mentions': len(self._money.findall(lowered)) if has_money else 0,
+            'urgent_words': urgent_words,
+        }
+        return RuleHits(counts, [name for name in INDICATOR_ORDER if name in hits])
+
+# Shared engine; compiling the patterns once at import is cheap
+rule_engine = RuleEngine()
@@ -0,0 +1,250 @@
+"""
+Inference sidecar: a long-lived daemon that owns the model and serves
+classifications over a Unix domain socket.
+
+Start it once:
+
+    python -m ai.sidecar
+
+While it runs, analyze_email()/analyze_emails() in every process that uses
+the same EMAIL_GUARD_SOCKET (the API, the CLI, the Gmail reader) send their
+emails to it instead of loading their own copy of the model. When the socket
+is missing or the daemon does not answer they analyze locally as before.
+
+By default the socket lives in $XDG_RUNTIME_DIR (or a 0700 directory of
+the current user under the temp directory), and clients only talk to a
+socket owned by the current user, so other local users can neither read
+the emails nor answer with forged results.
+
+Framing: every message is a 4-byte big-endian length followed by its body.
+A request body is a 4-byte email count followed by, for each email, its
+text and its newline-joined link targets, each as a 4-byte length and UTF-8
+bytes. A response body is one status byte (0 ok, 1 error) followed by the
+JSON list of results or the error message.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+def default_socket_path() -> str:
+    """Socket path in a directory only the current user can use."""
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return str(Path(runtime_dir) / "email_guard.sock")
+    return str(Path(tempfile.gettempdir()) / f"email_guard-{os.getuid()}" / "email_guard.sock")
+
+DEFAULT_SOCKET = os.getenv("EMAIL_GUARD_SOCKET", default_socket_path())
+# Seconds a client waits for the daemon before analyzing locally
+CLIENT_TIMEOUT = float(os.getenv("EMAIL_GUARD_SOCKET_TIMEOUT", "60"))
+
+_LENGTH = struct.Struct('!I')
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+class SidecarUnavailable(Exception):
+    """Raised when the daemon cannot be reached or fails a request."""
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("connection closed mid-message")
+        buffer += chunk
+    return bytes(buffer)
+
+def is_own_socket(path: str) -> bool:
+    """Whether path is a Unix socket owned by the current user (anyone else's could be an impostor)."""
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+def send_frame(sock: socket.socket, body: bytes) -> None:
+    """Send one length-prefixed message."""
+    sock.sendall(_LENGTH.pack(len(body)) + body)
+
+def recv_frame(sock: socket.socket) -> bytes:
+    """Receive one length-prefixed message."""
+    (size,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, size)
+
+def encode_request(texts: List[str], links: Optional[List[Optional[List[str]]]] = None) -> bytes:
+    """Request body for a list of emails and their (optional) link targets."""
+    parts = [_LENGTH.pack(len(texts))]
+    for i, text in enumerate(texts):
+        email_links = links[i] if links and links[i] else []
+        for field in (text, '\n'.join(email_links)):
+            data = field.encode('utf-8', errors='replace')
+            parts.append(_LENGTH.pack(len(data)))
+            parts.append(data)
+    return b''.join(parts)
+
+def decode_request(body: bytes) -> Tuple[List[str], List[List[str]]]:
+    """Emails and their link targets from a request body."""
+    (count,) = _LENGTH.unpack_from(body, 0)
+    offset = _LENGTH.size
+    fields = []
+    for _ in range(count * 2):
+        (size,) = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        fields.append(body[offset:offset + size].decode('utf-8'))
+        offset += size
+    texts = fields[0::2]
+    links = [joined.split('\n') if joined else [] for joined in fields[1::2]]
+    return texts, links
+
+class SidecarClient:
+    """Connection to the inference daemon, reused across calls."""
+
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: float = CLIENT_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether a daemon socket of the current user exists at the configured path."""
+        return is_own_socket(self.path)
+
+    def analyze(self, texts: List[str], links: Optional[List[Optional[List[str]]]] = None) -> List[Dict]:
+        """
+        Analyze emails (with the link targets of their HTML bodies, if given) in the daemon.
+
+        Raises:
+            SidecarUnavailable: When the daemon cannot be reached or reports an error
+        """
+        with self._lock:
+            try:
+                if self._sock is None:
+                    if not is_own_socket(self.path):
+                        raise SidecarUnavailable(f"No inference daemon socket of the current user at {self.path}")
+                    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self._sock.settimeout(self.timeout)
+                    self._sock.connect(self.path)
+                send_frame(self._sock, encode_request(texts, links))
+                response = recv_frame(self._sock)
+                status = response[0]
+                payload = json.loads(response[1:].decode('utf-8'))
+            except (OSError, IndexError, ValueError) as e:
+                self._close_locked()
+                raise SidecarUnavailable(f"Inference daemon at {self.path} unavailable: {e}") from e
+
+        if status != STATUS_OK:
+            raise SidecarUnavailable(f"Inference daemon error: {payload}")
+        if not isinstance(payload, list) or len(payload) != len(texts):
+            raise SidecarUnavailable("Inference daemon sent a malformed response")
+        return payload
+
+    def _close_locked(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def close(self) -> None:
+        """Drop the connection."""
+        with self._lock:
+            self._close_locked()
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Serves framed requests on one client connection until it closes."""
+
+    def handle(self):
+        while True:
+            try:
+                texts, links = decode_request(recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+            try:
+                with self.server.model_lock:
+                    results = self.server.analyze_fn(texts, links=links)
+                body = bytes([STATUS_OK]) + json.dumps(results).encode('utf-8')
+            except Exception as e:
+                body = bytes([STATUS_ERROR]) + json.dumps(str(e)).encode('utf-8')
+            try:
+                send_frame(self.request, body)
+            except OSError:
+                return
+
+def _is_served(path: str) -> bool:
+    """Whether something accepts connections on a socket path (a stale socket refuses them)."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(1)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+class SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server running analyze_fn for every request, one at a time."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, analyze_fn: Callable[..., List[Dict]]):
+        """
+        Bind the socket (replacing a stale one) readable by the current user only.
+
+        Args:
+            path: Socket path
+            analyze_fn: Function mapping a list of emails (and links=, their link
+                targets) to a list of results
+
+        Raises:
+            RuntimeError: When another daemon is still serving the path
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if os.path.exists(path):
+            if _is_served(path):
+                raise RuntimeError(f"An inference daemon is already serving {path}")
+            os.unlink(path)
+        self.analyze_fn = analyze_fn
+        # Batches from different clients take turns on the model
+        self.model_lock = threading.Lock()
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self.path = path
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+def main():
+    """Load the model and serve it until interrupted."""
+    parser = argparse.ArgumentParser(description="Serve the email classifier over a Unix domain socket")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f'Socket path (default: {DEFAULT_SOCKET})')
+    args = parser.parse_args()
+
+    from ai.email_guard import email_guard_ai
+
+    # The daemon analyzes with its own model, never through a client
+    email_guard_ai.warmup()
+    server = SidecarServer(args.socket, email_guard_ai.analyze_emails)
+    print(f"Inference daemon listening on {args.socket}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
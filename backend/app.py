@@ -5,16 +5,18 @@ Provides REST API endpoints for email analysis and history with HTTPS support.
 
 import os
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, List, Dict, Optional
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 # Remove SSL Configuration and HTTPSRedirectMiddleware
 # from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 import uvicorn
 
 # Add the ai directory to the path
@@ -22,14 +24,49 @@ import sys
 # sys.path.append(str(Path(__file__).parent.parent / "ai"))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from ai.email_guard import analyze_email
+from ai.email_guard import analyze_emails, get_cache_stats, get_near_duplicate_stats, is_model_loaded, warmup
+from services.history_store import UnknownCursor, create_history_store
+from services.inference_pool import InferencePool, InferenceQueueFull
+from services.memory_report import memory_report
+from services.micro_batcher import MicroBatcher
+from services.scan_ids import generate_scan_id
+from services.scan_stats import ScanStats
 
 # Configuration
 API_KEY = os.getenv("EMAIL_GUARD_API_KEY", "salmas_email_guard")
 MAX_EMAIL_LENGTH = 10000  # Maximum email content length
+# Load the AI model at startup instead of on the first scan
+WARMUP_ON_STARTUP = os.getenv("EMAIL_GUARD_WARMUP", "0") == "1"
+# Concurrent inference calls and how many more may queue before /scan returns 503
+INFERENCE_WORKERS = int(os.getenv("EMAIL_GUARD_INFERENCE_WORKERS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("EMAIL_GUARD_INFERENCE_QUEUE", "32"))
+# Concurrent /scan requests are grouped into batched model calls
+BATCH_MAX_SIZE = int(os.getenv("EMAIL_GUARD_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("EMAIL_GUARD_BATCH_MAX_WAIT_MS", "10"))
+BATCH_MAX_PENDING = int(os.getenv("EMAIL_GUARD_BATCH_MAX_PENDING", "256"))
+# Maximum number of emails accepted by one /scan/batch request
+MAX_BATCH_ITEMS = int(os.getenv("EMAIL_GUARD_MAX_BATCH_ITEMS", "1000"))
+# Scan history: 'memory' (ring buffer of HISTORY_SIZE scans) or 'sqlite' (persistent)
+HISTORY_BACKEND = os.getenv("EMAIL_GUARD_HISTORY_BACKEND", "memory")
+HISTORY_SIZE = int(os.getenv("EMAIL_GUARD_HISTORY_SIZE", "100"))
+HISTORY_DB = os.getenv("EMAIL_GUARD_HISTORY_DB", str(Path(__file__).parent / "scan_history.db"))
+# Keep /stats counters per user_id as well
+STATS_PER_USER = os.getenv("EMAIL_GUARD_STATS_PER_USER", "1") == "1"
 
-# In-memory storage for scan history (in production, use a database)
-scan_history: List[Dict] = []
+# Model calls run here so they never block the event loop
+inference_pool = InferencePool(INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE)
+micro_batcher = MicroBatcher(
+    analyze_emails, inference_pool,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    max_pending=BATCH_MAX_PENDING
+)
+
+# Scan history store, filtered and limited by the store itself
+history_store = create_history_store(HISTORY_BACKEND, max_size=HISTORY_SIZE, path=HISTORY_DB)
+# Running /stats aggregates, seeded once from a persistent history's aggregates
+scan_stats = ScanStats(track_users=STATS_PER_USER)
+scan_stats.load(history_store)
 
 app = FastAPI(
     title="Smart Email Guardian API",
@@ -54,6 +91,20 @@ app.add_middleware(
 
 # Do not add HTTPS redirect middleware
 
+@app.on_event("startup")
+async def warm_up_model():
+    """Optionally load the AI model before serving requests."""
+    if WARMUP_ON_STARTUP:
+        await inference_pool.run(warmup)
+    micro_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_inference_pool():
+    """Flush pending batches, stop the inference worker threads and close the history store."""
+    await micro_batcher.stop()
+    inference_pool.shutdown()
+    history_store.close()
+
 # Pydantic models
 class EmailScanRequest(BaseModel):
     content: str = Field(..., min_length=1, max_length=MAX_EMAIL_LENGTH, description="Email content to analyze")
@@ -68,10 +119,13 @@ class EmailScanResponse(BaseModel):
     features: Dict
     indicators: List[str]
     user_id: Optional[str] = None
+    cached: bool = Field(False, description="Whether the result was served from the result cache")
+    near_duplicate: bool = Field(False, description="Whether the verdict was reused from a near-duplicate email")
 
 class ScanHistoryResponse(BaseModel):
     scans: List[EmailScanResponse]
     total_count: int
+    next_cursor: Optional[str] = Field(None, description="Pass as `after` to fetch the next (older) page")
 
 # Authentication dependency
 async def verify_api_key(x_api_key: str = Header(..., alias="x-api-key")):
@@ -84,16 +138,25 @@ async def verify_api_key(x_api_key: str = Header(..., alias="x-api-key")):
     return x_api_key
 
 # Utility functions
-def generate_scan_id() -> str:
-    """Generate a unique scan ID."""
-    return f"scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(scan_history)}"
+def build_scan_data(result: Dict, user_id: Optional[str]) -> Dict:
+    """Turn an analysis result into a stored/returned scan record."""
+    return {
+        "id": generate_scan_id(),
+        "timestamp": datetime.now().isoformat(),
+        "classification": result["classification"],
+        "confidence": result["confidence"],
+        "explanation": result["explanation"],
+        "features": result.get("features", {}),
+        "indicators": result.get("indicators", []),
+        "user_id": user_id,
+        "cached": result.get("cached", False),
+        "near_duplicate": result.get("near_duplicate", False)
+    }
 
 def store_scan_result(scan_data: Dict) -> None:
     """Store scan result in history."""
-    scan_history.append(scan_data)
-    # Keep only last 100 scans in memory
-    if len(scan_history) > 100:
-        scan_history.pop(0)
+    history_store.add(scan_data)
+    scan_stats.record(scan_data)
 
 # API Endpoints
 @app.get("/")
@@ -104,7 +167,9 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "POST /scan": "Analyze email content",
+            "POST /scan/batch": "Analyze many emails, streaming NDJSON results",
             "GET /history": "Get scan history",
+            "GET /memory": "Memory usage of the serving worker",
             "GET /health": "Health check"
         }
     }
@@ -135,64 +200,146 @@ async def scan_email(
         EmailScanResponse: Analysis results
     """
     try:
-        # Analyze email using AI model
-        result = analyze_email(request.content)
+        # Analyze email using AI model, batched with concurrent requests
+        result = await micro_batcher.submit(request.content)
         
         # Create scan response
-        scan_data = {
-            "id": generate_scan_id(),
-            "timestamp": datetime.now().isoformat(),
-            "classification": result["classification"],
-            "confidence": result["confidence"],
-            "explanation": result["explanation"],
-            "features": result.get("features", {}),
-            "indicators": result.get("indicators", []),
-            "user_id": request.user_id
-        }
+        scan_data = build_scan_data(result, request.user_id)
         
         # Store scan result
         store_scan_result(scan_data)
         
         return EmailScanResponse(**scan_data)
         
+    except InferenceQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many emails are being analyzed, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error analyzing email: {str(e)}"
         )
 
+async def read_batch_items(request: Request) -> List[EmailScanRequest]:
+    """
+    Parse a /scan/batch body: a JSON array, or NDJSON (one object per line)
+    when sent as application/x-ndjson. NDJSON is read incrementally so an
+    oversized batch is refused without buffering all of it.
+    """
+    def parse_item(index: int, data) -> EmailScanRequest:
+        if index >= MAX_BATCH_ITEMS:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch exceeds the limit of {MAX_BATCH_ITEMS} emails"
+            )
+        try:
+            return EmailScanRequest(**data)
+        except (TypeError, ValidationError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid item {index}: {e}")
+    
+    items = []
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            buffer = b""
+            async for chunk in request.stream():
+                *lines, buffer = (buffer + chunk).split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        items.append(parse_item(len(items), json.loads(line)))
+            if buffer.strip():
+                items.append(parse_item(len(items), json.loads(buffer)))
+        else:
+            body = await request.json()
+            if not isinstance(body, list):
+                raise HTTPException(status_code=422, detail="Expected a JSON array of emails")
+            items = [parse_item(index, data) for index, data in enumerate(body)]
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed JSON: {e}")
+    return items
+
+async def stream_batch_results(items: List[EmailScanRequest]) -> AsyncIterator[str]:
+    """Analyze items in batched model calls, yielding one NDJSON line per email."""
+    for start in range(0, len(items), BATCH_MAX_SIZE):
+        chunk = items[start:start + BATCH_MAX_SIZE]
+        while True:
+            try:
+                results = await inference_pool.run(analyze_emails, [item.content for item in chunk])
+                break
+            except InferenceQueueFull:
+                # The response is already streaming, so wait for capacity instead of failing
+                await asyncio.sleep(0.05)
+            except Exception as e:
+                results = None
+                for offset in range(len(chunk)):
+                    yield json.dumps({"index": start + offset, "error": f"Error analyzing email: {e}"}) + "\n"
+                break
+        
+        if results is None:
+            continue
+        for item, result in zip(chunk, results):
+            scan_data = build_scan_data(result, item.user_id)
+            store_scan_result(scan_data)
+            yield json.dumps(scan_data) + "\n"
+
+@app.post("/scan/batch")
+async def scan_batch(
+    request: Request,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Analyze many emails in one request.
+    
+    The body is a JSON array of EmailScanRequest objects, or NDJSON with one
+    object per line (Content-Type: application/x-ndjson). Results stream back
+    as NDJSON, one EmailScanResponse per line in input order; an email that
+    could not be analyzed yields {"index": ..., "error": ...} instead.
+    
+    Args:
+        request: Raw request carrying the batch
+        api_key: API key for authentication
+        
+    Returns:
+        StreamingResponse: application/x-ndjson scan results
+    """
+    items = await read_batch_items(request)
+    return StreamingResponse(stream_batch_results(items), media_type="application/x-ndjson")
+
 @app.get("/history", response_model=ScanHistoryResponse)
 async def get_scan_history(
     limit: int = 10,
     user_id: Optional[str] = None,
+    after: Optional[str] = None,
     api_key: str = Depends(verify_api_key)
 ):
     """
-    Get scan history with optional filtering.
+    Get scan history with optional filtering, newest page first.
     
     Args:
         limit: Maximum number of scans to return (default: 10)
         user_id: Filter by user ID (optional)
+        after: next_cursor of the previous page, to fetch older scans (optional)
         api_key: API key for authentication
         
     Returns:
-        ScanHistoryResponse: List of scan results
+        ScanHistoryResponse: List of scan results and the cursor of the next page
     """
     try:
-        # Filter scans
-        filtered_scans = scan_history
+        # Filtering, the limit and the cursor seek are applied by the store
+        user_filter = user_id or None
+        page = history_store.query(user_id=user_filter, limit=limit, after=after)
         
-        if user_id:
-            filtered_scans = [scan for scan in scan_history if scan.get("user_id") == user_id]
-        
-        # Apply limit
-        limited_scans = filtered_scans[-limit:] if limit > 0 else filtered_scans
-        
-        return ScanHistoryResponse(
-            scans=[EmailScanResponse(**scan) for scan in limited_scans],
-            total_count=len(filtered_scans)
-        )
+        # Stored records already have the response shape; skip re-validating them
+        return JSONResponse({
+            "scans": page.scans,
+            "total_count": history_store.count(user_filter),
+            "next_cursor": page.next_cursor
+        })
         
+    except UnknownCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -200,45 +347,27 @@ async def get_scan_history(
         )
 
 @app.get("/stats")
-async def get_stats(api_key: str = Depends(verify_api_key)):
+async def get_stats(user_id: Optional[str] = None, api_key: str = Depends(verify_api_key)):
     """
     Get statistics about scan history.
     
     Args:
+        user_id: Statistics of a single user (optional)
         api_key: API key for authentication
         
     Returns:
         Dict: Statistics about scans
     """
     try:
-        if not scan_history:
-            return {
-                "total_scans": 0,
-                "classifications": {},
-                "recent_activity": []
-            }
-        
-        # Calculate statistics
-        classifications = {}
-        for scan in scan_history:
-            classification = scan["classification"]
-            classifications[classification] = classifications.get(classification, 0) + 1
-        
-        # Recent activity (last 24 hours)
-        cutoff_time = datetime.now() - timedelta(hours=24)
-        recent_scans = [
-            scan for scan in scan_history
-            if datetime.fromisoformat(scan["timestamp"]) > cutoff_time
-        ]
-        
-        return {
-            "total_scans": len(scan_history),
-            "classifications": classifications,
-            "recent_activity": {
-                "last_24_hours": len(recent_scans),
-                "average_confidence": sum(scan["confidence"] for scan in scan_history) / len(scan_history)
-            }
-        }
+        # Maintained incrementally by store_scan_result
+        stats = scan_stats.snapshot(user_id or None)
+        stats.update({
+            "cache": get_cache_stats(),
+            "near_duplicates": get_near_duplicate_stats(),
+            "inference": inference_pool.stats(),
+            "batching": micro_batcher.stats()
+        })
+        return stats
         
     except Exception as e:
         raise HTTPException(
@@ -246,6 +375,19 @@ async def get_stats(api_key: str = Depends(verify_api_key)):
             detail=f"Error calculating statistics: {str(e)}"
         )
 
+@app.get("/memory")
+async def get_memory(api_key: str = Depends(verify_api_key)):
+    """
+    Get the memory usage of the worker process serving this request.
+    
+    Args:
+        api_key: API key for authentication
+        
+    Returns:
+        Dict: RSS/PSS and shared/private memory in kB
+    """
+    return dict(memory_report(), model_loaded=is_model_loaded())
+
 if __name__ == "__main__":
     # Run the server (HTTP only, no SSL)
     print("🚀 Starting HTTP server on http://localhost:8000")
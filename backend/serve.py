@@ -0,0 +1,129 @@
+"""
+Pre-fork multi-worker server for the Smart Email Guardian API.
+
+Plain `uvicorn --workers N` loads a separate copy of the model and torch in
+every worker. Here the master process loads the model once, then forks the
+workers, which share the weights copy-on-write:
+
+    python serve.py --workers 4 --threads 2
+
+The master never runs inference: starting the OpenMP/torch thread pools
+before fork() can deadlock the children. It also freezes the garbage
+collector so collections in the workers do not write to (and so un-share)
+the inherited objects. Compare /memory across workers: Pss is each worker's
+fair share, most of the model shows up as Shared_Clean.
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+WORKERS = int(os.getenv("EMAIL_GUARD_WORKERS", "2"))
+HOST = os.getenv("EMAIL_GUARD_HOST", "0.0.0.0")
+PORT = int(os.getenv("EMAIL_GUARD_PORT", "8000"))
+# Intra-op threads per worker; keep workers * threads at or below the core count
+THREADS = int(os.getenv("EMAIL_GUARD_INFERENCE_THREADS", "1"))
+
+def parse_args() -> argparse.Namespace:
+    """Command line options, defaulting to the environment configuration."""
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing one model")
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f'Worker processes (default: {WORKERS})')
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help=f'Inference threads per worker (default: {THREADS})')
+    parser.add_argument('--host', default=HOST, help=f'Bind address (default: {HOST})')
+    parser.add_argument('--port', type=int, default=PORT, help=f'Port (default: {PORT})')
+    parser.add_argument('--log-level', default='info')
+    return parser.parse_args()
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket created in the master and inherited by every worker."""
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(index: int, sock: socket.socket, app, log_level: str) -> None:
+    """Body of a forked worker: serve requests from the shared socket until stopped."""
+    import uvicorn
+    from services.scan_ids import set_worker_id
+
+    # uvicorn installs its own graceful shutdown handlers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Without an explicit base, each worker claims a free id on its first scan
+    if os.getenv("EMAIL_GUARD_WORKER_ID"):
+        set_worker_id(int(os.environ["EMAIL_GUARD_WORKER_ID"]) + index)
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+def spawn(index: int, sock: socket.socket, app, log_level: str) -> int:
+    """Fork one worker and return its pid."""
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(index, sock, app, log_level)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        # Never fall back into the master's loop
+        os._exit(code)
+    return pid
+
+def main():
+    """Load the model, fork the workers and keep them running until stopped."""
+    args = parse_args()
+
+    # Thread budgets are read when torch and the backends are imported
+    os.environ["EMAIL_GUARD_INFERENCE_THREADS"] = str(args.threads)
+    os.environ["OMP_NUM_THREADS"] = str(args.threads)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    import app as app_module
+    from ai.email_guard import load_model
+
+    # Load (but never run) the model, then keep the GC off the shared objects
+    load_model()
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port)
+    print(f"🚀 Starting {args.workers} workers on http://{args.host}:{args.port} "
+          f"({args.threads} inference threads each)")
+    workers = {spawn(i, sock, app_module.app, args.log_level): i for i in range(args.workers)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} (pid {pid}) exited with status {status}, restarting", file=sys.stderr)
+            time.sleep(1)
+            workers[spawn(index, sock, app_module.app, args.log_level)] = index
+
+if __name__ == "__main__":
+    main()
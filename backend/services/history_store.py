@@ -0,0 +1,314 @@
+"""
+Scan history storage for the backend.
+
+- memory: a bounded ring buffer with a per-user index, lost on restart
+- sqlite: a persistent SQLite database in WAL mode, indexed on user_id and timestamp,
+  with per-user scan counts kept up to date by triggers
+
+Filtering, limits and cursor pagination are pushed down to the store, so a
+/history page costs O(page size) instead of a walk over the whole history.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+HISTORY_BACKENDS = ('memory', 'sqlite')
+
+class UnknownCursor(ValueError):
+    """Raised when a pagination cursor names a scan the store does not hold."""
+
+class HistoryPage(NamedTuple):
+    """One page of scans, oldest first, and the cursor of the page before it."""
+    scans: List[Dict]
+    next_cursor: Optional[str]
+
+class HistoryStore:
+    """Interface shared by the history backends."""
+
+    def add(self, scan: Dict) -> None:
+        """Append one scan record."""
+        raise NotImplementedError
+
+    def query(self, user_id: Optional[str] = None, limit: int = 10,
+              after: Optional[str] = None) -> HistoryPage:
+        """
+        A page of scans, newest pages first and oldest first within a page.
+
+        Args:
+            user_id: Only return scans of this user (optional)
+            limit: Maximum number of scans (0 or less: all of them)
+            after: Cursor from a previous page; returns the scans stored before it
+
+        Returns:
+            HistoryPage: The scans and the cursor of the next (older) page,
+            None when there are no older scans
+
+        Raises:
+            UnknownCursor: When the cursor's scan is not (or no longer) stored
+        """
+        raise NotImplementedError
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        """Number of stored scans, optionally for one user."""
+        raise NotImplementedError
+
+    def scans(self) -> Iterator[Dict]:
+        """Iterate over every stored scan, oldest first."""
+        raise NotImplementedError
+
+    def class_totals(self) -> List[Tuple[Optional[str], str, int, float]]:
+        """(user_id, classification, scans, confidence sum) over every stored scan."""
+        totals = {}
+        for scan in self.scans():
+            key = (scan.get("user_id"), scan["classification"])
+            count, confidence_sum = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, confidence_sum + scan["confidence"])
+        return [key + value for key, value in totals.items()]
+
+    def recent(self, since: str) -> Iterator[Tuple[Optional[str], str, str]]:
+        """(user_id, timestamp, classification) of the scans with a timestamp after since (ISO format)."""
+        for scan in self.scans():
+            if scan["timestamp"] > since:
+                yield scan.get("user_id"), scan["timestamp"], scan["classification"]
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def close(self) -> None:
+        """Release any resources held by the store."""
+
+class _SeqList:
+    """Increasing sequence numbers with O(1) removal from the front."""
+
+    __slots__ = ('seqs', 'head')
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.head = 0
+
+    def __len__(self) -> int:
+        return len(self.seqs) - self.head
+
+    def popleft(self) -> None:
+        self.head += 1
+        # Compact once the dead prefix dominates, keeping pops amortized O(1)
+        if self.head > 64 and self.head * 2 > len(self.seqs):
+            del self.seqs[:self.head]
+            self.head = 0
+
+class InMemoryHistoryStore(HistoryStore):
+    """Ring buffer keeping the most recent max_size scans, indexed per user."""
+
+    def __init__(self, max_size: int = 100):
+        self.max_size = max_size
+        # Every scan gets the next sequence number; the global index is one
+        # _SeqList like the per-user ones, plus the scan of each live seq
+        self._next_seq = 0
+        self._all = _SeqList()
+        self._by_seq: Dict[int, Dict] = {}
+        self._seq_by_id: Dict[str, int] = {}
+        self._users: Dict[Optional[str], _SeqList] = {}
+
+    def add(self, scan: Dict) -> None:
+        seq = self._next_seq
+        self._next_seq += 1
+        self._by_seq[seq] = scan
+        self._seq_by_id[scan["id"]] = seq
+        self._all.seqs.append(seq)
+        self._users.setdefault(scan["user_id"], _SeqList()).seqs.append(seq)
+
+        while len(self._all) > self.max_size:
+            evicted = self._by_seq.pop(self._all.seqs[self._all.head])
+            self._all.popleft()
+            self._seq_by_id.pop(evicted["id"], None)
+            user_seqs = self._users[evicted["user_id"]]
+            user_seqs.popleft()
+            if not user_seqs:
+                del self._users[evicted["user_id"]]
+
+    def query(self, user_id: Optional[str] = None, limit: int = 10,
+              after: Optional[str] = None) -> HistoryPage:
+        index = self._all if user_id is None else self._users.get(user_id, _SeqList())
+        seqs, lo, hi = index.seqs, index.head, len(index.seqs)
+
+        if after is not None:
+            if after not in self._seq_by_id:
+                raise UnknownCursor(f"Unknown cursor '{after}'")
+            hi = bisect_left(seqs, self._seq_by_id[after], lo, hi)
+
+        start = max(hi - limit, lo) if limit > 0 else lo
+        page = [self._by_seq[seq] for seq in seqs[start:hi]]
+        return HistoryPage(page, page[0]["id"] if page and start > lo else None)
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        index = self._all if user_id is None else self._users.get(user_id)
+        return len(index) if index is not None else 0
+
+    def scans(self) -> Iterator[Dict]:
+        return iter([self._by_seq[seq] for seq in self._all.seqs[self._all.head:]])
+
+class SQLiteHistoryStore(HistoryStore):
+    """Persistent history in SQLite (WAL mode), indexed for /history queries."""
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS scans (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            user_id TEXT,
+            timestamp TEXT NOT NULL,
+            classification TEXT NOT NULL,
+            confidence REAL NOT NULL,
+            data TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scans_user_id ON scans (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_scans_timestamp ON scans (timestamp)",
+    )
+    # Running counts for /history's total_count, so it never needs COUNT(*)
+    # over the table: key '' counts every scan, 'u:<user_id>' one user's scans
+    COUNTS_SCHEMA = (
+        "CREATE TABLE scan_counts (key TEXT PRIMARY KEY, count INTEGER NOT NULL)",
+        "INSERT INTO scan_counts (key, count) SELECT '', COUNT(*) FROM scans",
+        "INSERT INTO scan_counts (key, count) "
+        "SELECT 'u:' || user_id, COUNT(*) FROM scans WHERE user_id IS NOT NULL GROUP BY user_id",
+        """
+        CREATE TRIGGER scans_counted_insert AFTER INSERT ON scans BEGIN
+            INSERT INTO scan_counts (key, count) VALUES ('', 1)
+                ON CONFLICT (key) DO UPDATE SET count = count + 1;
+            INSERT INTO scan_counts (key, count) SELECT 'u:' || NEW.user_id, 1 WHERE NEW.user_id IS NOT NULL
+                ON CONFLICT (key) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER scans_counted_delete AFTER DELETE ON scans BEGIN
+            UPDATE scan_counts SET count = count - 1 WHERE key = '' OR key = 'u:' || OLD.user_id;
+        END
+        """,
+    )
+
+    def __init__(self, path: str = "scan_history.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        with self._lock:
+            # Serializes workers creating (and backfilling) the schema at once
+            self._conn.execute("BEGIN IMMEDIATE")
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+            counted = self._conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scan_counts'"
+            ).fetchone()
+            if counted is None:
+                for statement in self.COUNTS_SCHEMA:
+                    self._conn.execute(statement)
+            self._conn.commit()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """This process's connection; a forked worker opens its own instead of sharing the parent's."""
+        if self._pid != os.getpid():
+            # One connection per process; writes are serialized by the lock
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def add(self, scan: Dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO scans (id, user_id, timestamp, classification, confidence, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scan["id"], scan["user_id"], scan["timestamp"], scan["classification"],
+                 scan["confidence"], json.dumps(scan))
+            )
+            self._conn.commit()
+
+    def query(self, user_id: Optional[str] = None, limit: int = 10,
+              after: Optional[str] = None) -> HistoryPage:
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        sql = "SELECT id, data FROM scans"
+        with self._lock:
+            if after is not None:
+                if self._conn.execute("SELECT 1 FROM scans WHERE id = ?", (after,)).fetchone() is None:
+                    raise UnknownCursor(f"Unknown cursor '{after}'")
+                # Scan IDs sort by creation time, so this is a seek on the
+                # (user_id, id) index instead of an OFFSET scan
+                conditions.append("id < ?")
+                params.append(after)
+            if conditions:
+                sql += " WHERE " + " AND ".join(conditions)
+            sql += " ORDER BY id DESC"
+            if limit > 0:
+                # One extra row tells whether an older page exists
+                sql += " LIMIT ?"
+                params.append(limit + 1)
+            rows = self._conn.execute(sql, params).fetchall()
+
+        more = limit > 0 and len(rows) > limit
+        rows = rows[:limit] if more else rows
+        page = [json.loads(data) for (_, data) in reversed(rows)]
+        return HistoryPage(page, rows[-1][0] if more else None)
+
+    def count(self, user_id: Optional[str] = None) -> int:
+        key = '' if user_id is None else 'u:' + user_id
+        with self._lock:
+            row = self._conn.execute("SELECT count FROM scan_counts WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def scans(self) -> Iterator[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM scans ORDER BY id").fetchall()
+        return (json.loads(data) for (data,) in rows)
+
+    def class_totals(self) -> List[Tuple[Optional[str], str, int, float]]:
+        # Aggregated in SQLite: no scan record is loaded or decoded
+        with self._lock:
+            return self._conn.execute(
+                "SELECT user_id, classification, COUNT(*), SUM(confidence) FROM scans "
+                "GROUP BY user_id, classification"
+            ).fetchall()
+
+    def recent(self, since: str) -> Iterator[Tuple[Optional[str], str, str]]:
+        # A range on the timestamp index, read in batches
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT user_id, timestamp, classification FROM scans WHERE timestamp > ? ORDER BY timestamp",
+                (since,)
+            )
+            rows = cursor.fetchmany(1000)
+        while rows:
+            yield from rows
+            with self._lock:
+                rows = cursor.fetchmany(1000)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                self._connection.close()
+                self._pid = None
+
+def create_history_store(backend: str = "memory", max_size: int = 100,
+                         path: str = "scan_history.db") -> HistoryStore:
+    """
+    Create the configured history store.
+
+    Args:
+        backend (str): 'memory' or 'sqlite'
+        max_size (int): Ring buffer size of the memory backend
+        path (str): Database file of the sqlite backend
+    """
+    if backend == "memory":
+        return InMemoryHistoryStore(max_size)
+    if backend == "sqlite":
+        return SQLiteHistoryStore(path)
+    raise ValueError(f"Unknown history backend '{backend}', expected one of {HISTORY_BACKENDS}")
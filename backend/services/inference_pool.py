@@ -0,0 +1,73 @@
+"""
+Bounded executor that keeps CPU-heavy inference off the asyncio event loop.
+Requests beyond the worker count wait in a bounded queue; once that is full
+new work is rejected immediately so the API can answer 503 instead of
+stalling every other endpoint.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+class InferenceQueueFull(Exception):
+    """Raised when the inference queue is already at capacity."""
+
+class InferencePool:
+    """Thread pool for model calls with a cap on queued work."""
+
+    def __init__(self, max_workers: int = 1, max_queue: int = 32):
+        """
+        Create the pool.
+
+        Args:
+            max_workers (int): Concurrent inference calls; torch and ONNX
+                Runtime release the GIL, so each runs on its own intra-op threads
+            max_queue (int): Calls allowed to wait for a free worker
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        # Only touched from the event loop thread, so no lock is needed
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def capacity(self) -> int:
+        """Running plus queued calls accepted before rejecting."""
+        return self.max_workers + self.max_queue
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run fn(*args) on the pool without blocking the event loop.
+
+        Raises:
+            InferenceQueueFull: When the queue is at capacity
+        """
+        if self._in_flight >= self.capacity:
+            self.rejected += 1
+            raise InferenceQueueFull(
+                f"{self._in_flight} inference calls in flight (capacity {self.capacity})"
+            )
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        finally:
+            self._in_flight -= 1
+            self.completed += 1
+
+    def shutdown(self) -> None:
+        """Stop accepting work; running calls finish in the background."""
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict:
+        """Worker/queue configuration and load counters."""
+        return {
+            'workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'in_flight': self._in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
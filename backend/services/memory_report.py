@@ -0,0 +1,44 @@
+"""
+Process memory report for the /memory endpoint.
+On Linux, /proc/self/smaps_rollup separates pages shared with other workers
+(e.g. model weights inherited from the pre-fork master) from private ones;
+PSS divides shared pages between the processes mapping them, so summing PSS
+over all workers gives the real footprint of a deployment.
+"""
+
+import os
+import resource
+from typing import Dict
+
+SMAPS_ROLLUP = "/proc/self/smaps_rollup"
+# smaps_rollup fields reported, in kB
+FIELDS = {
+    'Rss': 'rss_kb',
+    'Pss': 'pss_kb',
+    'Shared_Clean': 'shared_clean_kb',
+    'Shared_Dirty': 'shared_dirty_kb',
+    'Private_Clean': 'private_clean_kb',
+    'Private_Dirty': 'private_dirty_kb',
+    'Swap': 'swap_kb',
+}
+
+def memory_report() -> Dict:
+    """
+    Memory usage of the current process.
+
+    Returns:
+        Dict: pid and RSS/PSS/shared/private sizes in kB; only the peak RSS
+        where smaps_rollup is unavailable
+    """
+    report = {'pid': os.getpid()}
+    try:
+        with open(SMAPS_ROLLUP, 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in FIELDS:
+                    report[FIELDS[name]] = int(value.split()[0])
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux
+    report['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
@@ -0,0 +1,144 @@
+"""
+Dynamic micro-batching for concurrent scan requests.
+Requests arriving within a short window are collected into one batch and
+sent through a single batched model call on the inference pool; each
+caller's future is then resolved with its own result.
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.inference_pool import InferencePool, InferenceQueueFull
+
+class MicroBatcher:
+    """Collects single items into batches for a batched inference function."""
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], pool: InferencePool,
+                 max_batch_size: int = 16, max_wait_ms: float = 10.0, max_pending: int = 256):
+        """
+        Create the batcher.
+
+        Args:
+            batch_fn: Function mapping a list of items to a list of results, in order
+            pool: Inference pool the batches run on
+            max_batch_size (int): Most items per batch
+            max_wait_ms (float): How long the first item of a batch waits for company
+            max_pending (int): Items allowed to wait for a batch before rejecting
+        """
+        self.batch_fn = batch_fn
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._dispatches = set()
+        # Futures of submitted items not resolved yet
+        self._waiting = set()
+        self.batches = 0
+        self.items = 0
+
+    def start(self) -> None:
+        """Start the collector task on the running event loop."""
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._collector = asyncio.ensure_future(self._collect())
+
+    async def stop(self) -> None:
+        """
+        Stop collecting, flush every queued item and wait for all batches.
+
+        The batch being formed and the items still queued are dispatched
+        too; any caller left without a result after that gets an exception
+        rather than waiting forever.
+        """
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        while self._queue is not None and not self._queue.empty():
+            count = min(self._queue.qsize(), self.max_batch_size)
+            self._dispatch_soon([self._queue.get_nowait() for _ in range(count)])
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+        for future in list(self._waiting):
+            if not future.done():
+                future.set_exception(RuntimeError("Micro-batcher stopped before the item was analyzed"))
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queue one item and wait for its result.
+
+        Raises:
+            InferenceQueueFull: When too many items are already waiting
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise InferenceQueueFull(f"{self.max_pending} items already waiting for a batch")
+        self._waiting.add(future)
+        future.add_done_callback(self._waiting.discard)
+        return await future
+
+    async def _collect(self) -> None:
+        """Form batches: wait for a first item, then up to max_wait for more."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    try:
+                        if timeout <= 0:
+                            batch.append(self._queue.get_nowait())
+                        else:
+                            batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                        break
+            except asyncio.CancelledError:
+                # Stopping: the partly formed batch still gets its results
+                if batch:
+                    self._dispatch_soon(batch)
+                raise
+
+            self._dispatch_soon(batch)
+
+    def _dispatch_soon(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Dispatch a batch without waiting, so the next batch can form meanwhile."""
+        task = asyncio.ensure_future(self._dispatch(batch))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Run one batch on the pool and resolve every caller's future."""
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.pool.run(self.batch_fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            # The caller may have gone away (client disconnect)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict:
+        """Batching configuration and achieved batch sizes."""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+            'batches': self.batches,
+            'items': self.items,
+            'average_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,197 @@
+"""
+Sortable, collision-free scan IDs (Snowflake-style).
+
+An ID packs 48 bits of Unix time in milliseconds, a 10-bit worker id and a
+12-bit sequence (restarting every millisecond) into 70 bits, written as 14
+Crockford base32 characters after a "scan_" prefix. IDs sort by creation
+time, so an index on them doubles as a time index, and they stay unique
+across uvicorn workers as long as each worker has its own worker id.
+
+Worker ids are claimed with an exclusive lock file per id, held for the
+life of the process, so two workers on one host can never share an id:
+the default is the first free id from the process id modulo 1024 on, and
+an explicit id that another live process holds is refused. Workers on
+different hosts writing to one store need distinct EMAIL_GUARD_WORKER_ID
+ranges.
+"""
+
+import fcntl
+import os
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+PREFIX = "scan_"
+TIME_BITS = 48
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+ENCODED_LENGTH = 14  # ceil(70 / 5)
+MAX_WORKERS = 1 << WORKER_BITS
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Explicit worker id for this process (default: the first free id)
+WORKER_ID = os.getenv("EMAIL_GUARD_WORKER_ID")
+# Directory of the per-id lock files shared by the workers of this host
+WORKER_LOCK_DIR = os.getenv(
+    "EMAIL_GUARD_WORKER_LOCK_DIR",
+    os.path.join(tempfile.gettempdir(), f"email_guard-{os.getuid()}", "workers")
+)
+
+class ScanIdGenerator:
+    """Generator of time-ordered scan IDs for one worker."""
+
+    def __init__(self, worker_id: Optional[int] = None):
+        """
+        Create the generator.
+
+        Args:
+            worker_id (int): 0-1023, unique per running worker
+                (default: claim one with claim_worker_id())
+        """
+        if worker_id is None:
+            worker_id = claim_worker_id()
+        if not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f"Worker id {worker_id} is outside 0-{MAX_WORKERS - 1}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_millis = -1
+        self._sequence = 0
+
+    def _next(self) -> Tuple[int, int]:
+        """(millisecond, sequence) pair never handed out before by this generator."""
+        with self._lock:
+            # Never step back in time, even if the wall clock does
+            millis = max(time.time_ns() // 1_000_000, self._last_millis)
+            if millis == self._last_millis:
+                self._sequence += 1
+                # Sequence exhausted: wait for the next millisecond
+                while self._sequence > MAX_SEQUENCE:
+                    millis = time.time_ns() // 1_000_000
+                    if millis > self._last_millis:
+                        self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_millis = millis
+            return millis, self._sequence
+
+    def generate(self) -> str:
+        """Return a new scan ID."""
+        millis, sequence = self._next()
+        value = (
+            (millis & ((1 << TIME_BITS) - 1)) << (WORKER_BITS + SEQUENCE_BITS)
+            | self.worker_id << SEQUENCE_BITS
+            | sequence
+        )
+        chars = []
+        for _ in range(ENCODED_LENGTH):
+            chars.append(ALPHABET[value & 31])
+            value >>= 5
+        return PREFIX + ''.join(reversed(chars))
+
+def _decode(scan_id: str) -> int:
+    value = 0
+    for char in scan_id[len(PREFIX):]:
+        value = value << 5 | ALPHABET.index(char)
+    return value
+
+def scan_id_millis(scan_id: str) -> int:
+    """Creation time (Unix milliseconds) encoded in a scan ID."""
+    return _decode(scan_id) >> (WORKER_BITS + SEQUENCE_BITS)
+
+def scan_id_worker(scan_id: str) -> int:
+    """Worker id encoded in a scan ID."""
+    return _decode(scan_id) >> SEQUENCE_BITS & (MAX_WORKERS - 1)
+
+def _try_lock(worker_id: int, lock_dir: str) -> Optional[int]:
+    """Descriptor of the locked lock file of worker_id, or None when another process holds it."""
+    fd = os.open(os.path.join(lock_dir, f"{worker_id}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+# Lock file descriptor of each id claimed by this process
+_claimed = {}
+
+def claim_worker_id(worker_id: Optional[int] = None, lock_dir: str = WORKER_LOCK_DIR) -> int:
+    """
+    Reserve a worker id for this process until it exits.
+
+    Args:
+        worker_id (int): Id to reserve (default: the first free id from the
+            process id modulo 1024 on)
+        lock_dir (str): Directory of the lock files
+
+    Returns:
+        int: The reserved worker id
+
+    Raises:
+        RuntimeError: When worker_id, or every id if none is given, is held
+            by another process
+    """
+    os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+    if worker_id is not None:
+        candidates = [worker_id]
+    else:
+        start = os.getpid() % MAX_WORKERS
+        candidates = [(start + offset) % MAX_WORKERS for offset in range(MAX_WORKERS)]
+    for candidate in candidates:
+        if not 0 <= candidate < MAX_WORKERS:
+            raise ValueError(f"Worker id {candidate} is outside 0-{MAX_WORKERS - 1}")
+        key = (lock_dir, candidate)
+        if key in _claimed:
+            return candidate
+        fd = _try_lock(candidate, lock_dir)
+        if fd is not None:
+            _claimed[key] = fd
+            return candidate
+    if worker_id is not None:
+        raise RuntimeError(f"Scan-ID worker id {worker_id} is already used by another process")
+    raise RuntimeError(f"All {MAX_WORKERS} scan-ID worker ids are in use")
+
+def release_worker_id(worker_id: int, lock_dir: str = WORKER_LOCK_DIR) -> None:
+    """Give a worker id claimed by this process back."""
+    fd = _claimed.pop((lock_dir, worker_id), None)
+    if fd is not None:
+        os.close(fd)
+
+_generator: Optional[ScanIdGenerator] = None
+_generator_lock = threading.Lock()
+
+def _after_fork() -> None:
+    """Forked child: drop the parent's worker id, a new one is claimed on first use."""
+    global _generator
+    for fd in _claimed.values():
+        os.close(fd)
+    _claimed.clear()
+    _generator = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def set_worker_id(worker_id: int) -> None:
+    """
+    Give this process its own worker id (call in each forked worker).
+
+    Raises:
+        RuntimeError: When another process already uses the id
+    """
+    global _generator
+    with _generator_lock:
+        claim_worker_id(worker_id)
+        if _generator is not None and _generator.worker_id != worker_id:
+            release_worker_id(_generator.worker_id)
+        _generator = ScanIdGenerator(worker_id)
+
+def generate_scan_id() -> str:
+    """Return a new scan ID from this process's generator."""
+    global _generator
+    # Claimed on first use rather than at import, so forked workers claim their own
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = ScanIdGenerator(claim_worker_id(int(WORKER_ID) if WORKER_ID else None))
+    return _generator.generate()
@@ -0,0 +1,156 @@
+"""
+Running scan statistics for /stats.
+Counters are updated as each scan is stored, and recent activity is kept in
+a ring of time buckets, so reading the statistics never walks the history.
+"""
+
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+class _Counters:
+    """Per-class totals, confidence sum and a sliding window of time buckets."""
+
+    def __init__(self, window_buckets: int):
+        self.window_buckets = window_buckets
+        self.total = 0
+        self.confidence_sum = 0.0
+        self.classifications: Dict[str, int] = {}
+        # (bucket index, scans, per-class scans), oldest first
+        self._buckets = deque()
+        self.window_total = 0
+        self.window_classifications: Dict[str, int] = {}
+
+    def add(self, bucket: int, classification: str, confidence: float, now_bucket: int) -> None:
+        self.add_totals(classification, 1, confidence)
+        self.add_window(bucket, classification, now_bucket)
+
+    def add_totals(self, classification: str, count: int, confidence_sum: float) -> None:
+        self.total += count
+        self.confidence_sum += confidence_sum
+        self.classifications[classification] = self.classifications.get(classification, 0) + count
+
+    def add_window(self, bucket: int, classification: str, now_bucket: int) -> None:
+        self.expire(now_bucket)
+        if bucket <= now_bucket - self.window_buckets:
+            return
+        if self._buckets and self._buckets[-1][0] >= bucket:
+            # Out-of-order scan: find its bucket (rare, only near the tail)
+            position = len(self._buckets) - 1
+            while position >= 0 and self._buckets[position][0] > bucket:
+                position -= 1
+            if position < 0 or self._buckets[position][0] != bucket:
+                position += 1
+                self._buckets.insert(position, [bucket, 0, {}])
+            entry = self._buckets[position]
+        else:
+            entry = [bucket, 0, {}]
+            self._buckets.append(entry)
+        entry[1] += 1
+        entry[2][classification] = entry[2].get(classification, 0) + 1
+        self.window_total += 1
+        self.window_classifications[classification] = self.window_classifications.get(classification, 0) + 1
+
+    def expire(self, now_bucket: int) -> None:
+        """Drop buckets that slid out of the window."""
+        while self._buckets and self._buckets[0][0] <= now_bucket - self.window_buckets:
+            _, count, classes = self._buckets.popleft()
+            self.window_total -= count
+            for classification, class_count in classes.items():
+                remaining = self.window_classifications[classification] - class_count
+                if remaining:
+                    self.window_classifications[classification] = remaining
+                else:
+                    del self.window_classifications[classification]
+
+class ScanStats:
+    """Incrementally maintained statistics over every recorded scan."""
+
+    def __init__(self, window_seconds: int = 24 * 3600, bucket_seconds: int = 60,
+                 track_users: bool = True):
+        """
+        Create the aggregator.
+
+        Args:
+            window_seconds (int): Length of the recent-activity window
+            bucket_seconds (int): Resolution of the window
+            track_users (bool): Also keep counters per user_id
+        """
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = max(window_seconds // bucket_seconds, 1)
+        self.track_users = track_users
+        self._all = _Counters(self.window_buckets)
+        self._users: Dict[str, _Counters] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, moment: datetime) -> int:
+        return int(moment.timestamp()) // self.bucket_seconds
+
+    def _targets(self, user_id: Optional[str]) -> List[_Counters]:
+        """Counters a scan of this user counts towards (call with the lock held)."""
+        if not (self.track_users and user_id):
+            return [self._all]
+        counters = self._users.get(user_id)
+        if counters is None:
+            counters = self._users[user_id] = _Counters(self.window_buckets)
+        return [self._all, counters]
+
+    def record(self, scan: Dict) -> None:
+        """Add one stored scan record to the running statistics."""
+        bucket = self._bucket(datetime.fromisoformat(scan["timestamp"]))
+        now_bucket = max(self._bucket(datetime.now()), bucket)
+        with self._lock:
+            for counters in self._targets(scan.get("user_id")):
+                counters.add(bucket, scan["classification"], scan["confidence"], now_bucket)
+
+    def load(self, store) -> None:
+        """
+        Seed the statistics from a history store's aggregates.
+
+        Only per-class totals and the scans inside the recent-activity
+        window are read (HistoryStore.class_totals() and recent()), so
+        startup cost does not grow with the whole history.
+
+        Args:
+            store: History store holding the scans recorded so far
+        """
+        now = datetime.now()
+        now_bucket = self._bucket(now)
+        since = now - timedelta(seconds=self.window_buckets * self.bucket_seconds)
+        totals = store.class_totals()
+        with self._lock:
+            for user_id, classification, count, confidence_sum in totals:
+                for counters in self._targets(user_id):
+                    counters.add_totals(classification, count, confidence_sum)
+        for user_id, timestamp, classification in store.recent(since.isoformat()):
+            bucket = self._bucket(datetime.fromisoformat(timestamp))
+            with self._lock:
+                for counters in self._targets(user_id):
+                    counters.add_window(bucket, classification, max(now_bucket, bucket))
+
+    def snapshot(self, user_id: Optional[str] = None) -> Dict:
+        """
+        Current statistics, in the /stats response format.
+
+        Args:
+            user_id: Statistics of a single user instead of all scans (optional)
+        """
+        with self._lock:
+            counters = self._all if user_id is None else self._users.get(user_id)
+            if counters is None or not counters.total:
+                return {
+                    "total_scans": 0,
+                    "classifications": {},
+                    "recent_activity": []
+                }
+            counters.expire(self._bucket(datetime.now()))
+            return {
+                "total_scans": counters.total,
+                "classifications": dict(counters.classifications),
+                "recent_activity": {
+                    "last_24_hours": counters.window_total,
+                    "classifications": dict(counters.window_classifications),
+                    "average_confidence": counters.confidence_sum / counters.total
+                }
+            }
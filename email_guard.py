@@ -4,41 +4,246 @@ Smart Email Guardian CLI Tool
 Analyzes email content for spam, phishing, and security threats.
 """
 
+import os
 import sys
 import json
+import glob
+import time
+import mailbox
 import argparse
+import multiprocessing
+from collections import deque
+from itertools import islice
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-# Add the ai directory to the path
-sys.path.append(str(Path(__file__).parent / "ai"))
+# Add the backend directory (which holds the ai package) to the path
+sys.path.append(str(Path(__file__).parent / "backend"))
 
-from ai.email_guard import analyze_email
+from ai.email_guard import analyze_email, analyze_emails, warmup
+from ai.message_parser import DEFAULT_MAX_BYTES, ParsedMessage, is_mbox_separator, message_text, parse_message
 
-def read_input(input_source: Optional[str] = None) -> str:
+# Messages sent to the model per batch in bulk mode
+BULK_BATCH_SIZE = 32
+
+def read_message(input_source: Optional[str] = None) -> ParsedMessage:
     """
-    Read email content from file or stdin.
+    Read and parse an email from file or stdin.
     
     Args:
         input_source: Path to file or None for stdin
         
     Returns:
-        str: Email content
+        ParsedMessage: Subject, decoded text parts and HTML link targets
     """
     if input_source:
         try:
-            with open(input_source, 'r', encoding='utf-8') as f:
-                return f.read()
+            with open(input_source, 'rb') as f:
+                try:
+                    return parse_message(f)
+                except Exception:
+                    # Not parseable as a message: analyze the raw text
+                    f.seek(0)
+                    text = f.read(DEFAULT_MAX_BYTES).decode('utf-8', errors='replace')
+                    return ParsedMessage(subject='', text=text, html_text='', links=[], truncated=bool(f.read(1)))
         except FileNotFoundError:
             print(f"Error: File '{input_source}' not found.", file=sys.stderr)
             sys.exit(1)
-        except Exception as e:
+        except OSError as e:
             print(f"Error reading file: {e}", file=sys.stderr)
             sys.exit(1)
     else:
         # Read from stdin
         print("Enter email content (Ctrl+D or Ctrl+Z when finished):", file=sys.stderr)
-        return sys.stdin.read()
+        return parse_message(sys.stdin.buffer)
+
+def read_input(input_source: Optional[str] = None) -> str:
+    """
+    Read email content from file or stdin.
+    
+    Args:
+        input_source: Path to file or None for stdin
+        
+    Returns:
+        str: Email content (subject and decoded text of raw RFC 822 messages)
+    """
+    return message_text(read_message(input_source))
+
+def is_maildir(path: Path) -> bool:
+    """Whether a directory is a Maildir folder (has cur/ and new/)."""
+    return (path / "cur").is_dir() and (path / "new").is_dir()
+
+def is_mbox(path: Path) -> bool:
+    """Whether a file is an mbox mailbox (starts with a 'From <sender> <date>' separator line)."""
+    with open(path, 'rb') as f:
+        return is_mbox_separator(f.readline(1024))
+
+def expand_inputs(inputs: Iterable[str]) -> Iterator[Path]:
+    """
+    Expand glob patterns and directories into files and Maildir folders.
+    
+    Args:
+        inputs: Paths, directories or glob patterns
+        
+    Returns:
+        Iterator[Path]: Files and Maildir folders, directories walked in sorted order
+    """
+    for pattern in inputs:
+        if glob.has_magic(pattern):
+            paths = [Path(match) for match in sorted(glob.glob(pattern, recursive=True))]
+        else:
+            paths = [Path(pattern)]
+        for path in paths:
+            if path.is_dir() and not is_maildir(path):
+                for root, dirs, files in os.walk(path):
+                    root_path = Path(root)
+                    dirs.sort()
+                    # Maildir folders are read as mailboxes, not walked into
+                    maildirs = [name for name in dirs if is_maildir(root_path / name)]
+                    dirs[:] = [name for name in dirs if name not in maildirs]
+                    for name in maildirs:
+                        yield root_path / name
+                    for name in sorted(files):
+                        yield root_path / name
+            else:
+                yield path
+
+def parse_source(source: str, open_message: Callable[[], BinaryIO]) -> Optional[ParsedMessage]:
+    """
+    Parse one message, warning about (and skipping) one that cannot be read.
+    
+    Args:
+        source: Where the message comes from, for the warning
+        open_message: Opens the message as a binary stream
+        
+    Returns:
+        ParsedMessage, or None when the message was skipped
+    """
+    try:
+        with open_message() as f:
+            return parse_message(f)
+    except Exception as e:
+        print(f"Warning: skipping '{source}': {e}", file=sys.stderr)
+        return None
+
+def iter_messages(inputs: Iterable[str]) -> Iterator[Tuple[str, ParsedMessage]]:
+    """
+    Stream messages from files, directories, globs, mbox files and Maildir folders.
+    
+    Args:
+        inputs: Paths, directories or glob patterns
+        
+    Returns:
+        Iterator of (source, parsed message); source is the file path, plus
+        ':<key>' for messages inside a mailbox
+    """
+    for path in expand_inputs(inputs):
+        try:
+            if path.is_dir():
+                box = mailbox.Maildir(str(path), factory=None, create=False)
+            elif is_mbox(path):
+                box = mailbox.mbox(str(path), factory=None, create=False)
+            else:
+                message = parse_source(str(path), lambda: open(path, 'rb'))
+                if message is not None:
+                    yield str(path), message
+                continue
+            for key in box.iterkeys():
+                # Streamed from the mailbox file; attachments are never loaded
+                source = f"{path}:{key}"
+                message = parse_source(source, lambda: box.get_file(key))
+                if message is not None:
+                    yield source, message
+        except OSError as e:
+            print(f"Warning: skipping '{path}': {e}", file=sys.stderr)
+
+def format_record(source: str, result: dict, output_format: str = "jsonl") -> str:
+    """
+    Format one bulk-mode result as a single line.
+    
+    Args:
+        source: Where the message came from
+        result: Analysis result dictionary
+        output_format: 'jsonl' or 'tsv'
+        
+    Returns:
+        str: Output line (without newline)
+    """
+    if output_format == "tsv":
+        fields = [source, result['classification'], f"{result['confidence']:.4f}", result['explanation']]
+        return "\t".join(field.replace("\t", " ").replace("\n", " ") for field in fields)
+    return json.dumps(dict(result, source=source))
+
+def analyze_batch(batch: List[Tuple[str, ParsedMessage]]) -> List[Tuple[str, dict]]:
+    """Analyze one batch of (source, parsed message) pairs, keeping their sources."""
+    results = analyze_emails(
+        [message_text(message) for _, message in batch],
+        links=[message.links for _, message in batch]
+    )
+    return [(source, result) for (source, _), result in zip(batch, results)]
+
+def init_worker() -> None:
+    """Pool initializer: load the model once per worker process."""
+    warmup()
+
+def analyzed_batches(inputs: List[str], batch_size: int = BULK_BATCH_SIZE, workers: int = 1,
+                     threads: Optional[int] = None) -> Iterator[List[Tuple[str, dict]]]:
+    """
+    Analyze the inputs' messages in batches, in this process or a worker pool.
+    
+    Args:
+        inputs: Paths, directories or glob patterns
+        batch_size: Messages per analyze_emails() call
+        workers: Worker processes (1 analyzes in this process)
+        threads: Inference threads per worker (default: cores divided among the workers)
+        
+    Returns:
+        Iterator of analyzed batches, in input order
+    """
+    messages = iter_messages(inputs)
+    batches = iter(lambda: list(islice(messages, batch_size)), [])
+    if workers <= 1:
+        for batch in batches:
+            yield analyze_batch(batch)
+        return
+    
+    # Fresh (spawned) workers read their thread budget from the environment at import
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    os.environ["EMAIL_GUARD_INFERENCE_THREADS"] = str(threads)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=init_worker) as pool:
+        # A bounded window of batches in flight keeps memory flat on huge archives
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(analyze_batch, (batch,)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def run_bulk(inputs: List[str], output_format: str = "jsonl", batch_size: int = BULK_BATCH_SIZE,
+             workers: int = 1, threads: Optional[int] = None) -> Dict[str, int]:
+    """
+    Analyze every message of the inputs in batches, printing one line per message.
+    
+    Args:
+        inputs: Paths, directories or glob patterns
+        output_format: 'jsonl' or 'tsv'
+        batch_size: Messages per analyze_emails() call
+        workers: Worker processes, each with its own model
+        threads: Inference threads per worker (optional)
+        
+    Returns:
+        Dict[str, int]: Number of messages per classification
+    """
+    counts: Dict[str, int] = {}
+    for batch in analyzed_batches(inputs, batch_size, workers, threads):
+        for source, result in batch:
+            print(format_record(source, result, output_format))
+            counts[result['classification']] = counts.get(result['classification'], 0) + 1
+        sys.stdout.flush()
+    return counts
 
 def format_output(result: dict, output_format: str = "json") -> str:
     """
@@ -85,6 +290,32 @@ def format_output(result: dict, output_format: str = "json") -> str:
     else:
         return json.dumps(result, indent=2)
 
+def bulk_main(inputs: List[str], output_format: str, batch_size: int,
+              workers: int = 1, threads: Optional[int] = None) -> int:
+    """
+    Run bulk mode and print a summary to stderr.
+    
+    Returns:
+        int: Exit code, 2 if any message is phishing or spam
+    """
+    print("🔍 Analyzing messages...", file=sys.stderr)
+    start = time.perf_counter()
+    try:
+        counts = run_bulk(inputs, output_format, batch_size, workers, threads)
+    except KeyboardInterrupt:
+        print("\nOperation cancelled by user.", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    
+    total = sum(counts.values())
+    summary = ", ".join(f"{name}: {count}" for name, count in sorted(counts.items()))
+    print(f"📊 {total} messages in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f}/s)"
+          + (f" - {summary}" if summary else ""), file=sys.stderr)
+    
+    if counts.get('phishing') or counts.get('spam'):
+        return 2
+    return 0
+
 def main():
     """Main CLI function."""
     parser = argparse.ArgumentParser(
@@ -103,9 +334,24 @@ Examples:
   
   # Output in table format
   python email_guard.py -f email.txt -o table
+  
+  # Scan a directory, an mbox file and a Maildir, one JSON line per message
+  python email_guard.py spool/ archive.mbox ~/Maildir
+  
+  # Scan files matching a glob, tab-separated output
+  python email_guard.py "mail/**/*.eml" -o tsv
+  
+  # Scan an archive with 4 worker processes
+  python email_guard.py archive.mbox --workers 4
         """
     )
     
+    parser.add_argument(
+        'inputs',
+        nargs='*',
+        help='Bulk mode: files, directories, glob patterns, mbox files or Maildir folders'
+    )
+    
     parser.add_argument(
         '-f', '--file',
         help='Input file containing email content (default: stdin)'
@@ -113,9 +359,30 @@ Examples:
     
     parser.add_argument(
         '-o', '--output-format',
-        choices=['json', 'text', 'table'],
-        default='json',
-        help='Output format (default: json)'
+        choices=['json', 'text', 'table', 'jsonl', 'tsv'],
+        default=None,
+        help='Output format (default: json; bulk mode: jsonl or tsv, default jsonl)'
+    )
+    
+    parser.add_argument(
+        '-b', '--batch-size',
+        type=int,
+        default=BULK_BATCH_SIZE,
+        help=f'Bulk mode: messages per model batch (default: {BULK_BATCH_SIZE})'
+    )
+    
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        help='Bulk mode: worker processes, each loading the model once (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--threads',
+        type=int,
+        default=None,
+        help='Bulk mode: inference threads per worker (default: CPU cores / workers)'
     )
     
     parser.add_argument(
@@ -126,9 +393,17 @@ Examples:
     
     args = parser.parse_args()
     
+    if args.inputs:
+        output_format = args.output_format or 'jsonl'
+        if output_format not in ('jsonl', 'tsv'):
+            parser.error("bulk mode supports the jsonl and tsv output formats")
+        sys.exit(bulk_main(args.inputs, output_format, args.batch_size, args.workers, args.threads))
+    output_format = args.output_format or 'json'
+    
     try:
         # Read input
-        email_content = read_input(args.file)
+        message = read_message(args.file)
+        email_content = message_text(message)
         
         if not email_content.strip():
             print("Error: No email content provided.", file=sys.stderr)
@@ -136,10 +411,10 @@ Examples:
         
         # Analyze email
         print("🔍 Analyzing email content...", file=sys.stderr)
-        result = analyze_email(email_content)
+        result = analyze_email(email_content, message.links)
         
         # Output result
-        output = format_output(result, args.output_format)
+        output = format_output(result, output_format)
         print(output)
         
         # Exit with appropriate code based on classification
@@ -4,10 +4,16 @@ Reads emails from Gmail inbox and analyzes them for threats.
 """
 
 import os
+import re
 import base64
-import email
-from typing import List, Dict, Optional
+import queue
+import tempfile
+import threading
+from itertools import islice
+from typing import Generator, Iterable, Iterator, List, Dict, NamedTuple, Optional, Set, Tuple
 from pathlib import Path
+from email.message import Message
+from email.utils import parseaddr
 import json
 
 from google.auth.transport.requests import Request
@@ -16,23 +22,128 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-# Add the ai directory to the path
+# Add the backend directory (which holds the ai package) to the path
 import sys
-sys.path.append(str(Path(__file__).parent.parent / "ai"))
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
 
-from ai.email_guard import analyze_email
+from ai.email_guard import analyze_emails as classify_emails
+from ai.html_text import html_to_text
+from ai.message_parser import decode_text
 
 # Gmail API configuration
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 CREDENTIALS_FILE = 'credentials.json'
 TOKEN_FILE = 'token.json'
+# Messages fetched per HTTP batch request (the Gmail API allows at most 100)
+BATCH_SIZE = 100
+# Rounds in which rate-limited or failed-on-the-server messages are fetched again
+BATCH_RETRIES = 2
+# Message IDs per messages.list page (the Gmail API allows at most 500)
+LIST_PAGE_SIZE = 500
+# Scan results of the command line scanner, one JSON object per line
+OUTPUT_FILE = 'gmail_scan_results.jsonl'
+# Threads fetching message bodies while the model analyzes earlier ones
+FETCH_THREADS = int(os.getenv('GMAIL_FETCH_THREADS', '4'))
+# Fetched chunks (and listed ID chunks) buffered between the pipeline stages
+QUEUE_DEPTH = int(os.getenv('GMAIL_QUEUE_DEPTH', '4'))
+# Senders (addresses, or domains including their subdomains) whose authenticated mail skips content analysis
+SENDER_ALLOWLIST = frozenset(
+    entry.strip().lower() for entry in os.getenv('GMAIL_SENDER_ALLOWLIST', '').split(',') if entry.strip()
+)
+# Also skip authenticated mailing-list mail (List-Unsubscribe header)
+PRESCREEN_BULK = os.getenv('GMAIL_PRESCREEN_BULK', '0') == '1'
+# Screen headers before fetching bodies; pointless (and costs an extra request) without any skip rule
+PRESCREEN = os.getenv('GMAIL_PRESCREEN', '1' if SENDER_ALLOWLIST or PRESCREEN_BULK else '0') == '1'
+# Authentication-Results servers trusted by the screen (in the topmost such header only)
+AUTHSERV_IDS = frozenset(
+    entry.strip().lower() for entry in os.getenv('GMAIL_AUTHSERV_IDS', 'mx.google.com').split(',') if entry.strip()
+)
+# Headers requested by the screen
+METADATA_HEADERS = ['From', 'Subject', 'Date', 'List-Unsubscribe', 'Authentication-Results']
+# Sync checkpoint of incremental scans
+SYNC_STATE_FILE = os.getenv('GMAIL_SYNC_STATE_FILE', 'gmail_sync.json')
+# Scanned message IDs remembered by the checkpoint (oldest are forgotten first)
+MAX_SCANNED_IDS = 10000
+# Scans that try to fetch a failing message before it is given up
+MAX_FETCH_ATTEMPTS = 5
+
+class SyncCheckpoint:
+    """Where the last scan left off: the mailbox historyId, the IDs already scanned and those still to fetch."""
+    
+    def __init__(self, history_id: Optional[str] = None, scanned_ids: Iterable[str] = (),
+                 pending_ids: Optional[Dict[str, int]] = None):
+        self.history_id = history_id
+        # dict keeps insertion order, so the oldest IDs can be dropped first
+        self.scanned_ids = dict.fromkeys(scanned_ids)
+        # Messages behind the historyId whose fetch failed -> failed attempts so far
+        self.pending_ids = dict(pending_ids or {})
+    
+    @classmethod
+    def load(cls, path: str) -> 'SyncCheckpoint':
+        """Read a checkpoint; a missing or unreadable file gives an empty one (full sync)."""
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            return cls(state.get('history_id'), state.get('scanned_ids', []), state.get('pending_ids'))
+        except (OSError, ValueError, AttributeError):
+            return cls()
+    
+    def save(self, path: str):
+        """Write the checkpoint atomically, so an interrupted run never corrupts it."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.gmail_sync.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'history_id': self.history_id,
+                    'scanned_ids': list(self.scanned_ids),
+                    'pending_ids': self.pending_ids
+                }, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def is_scanned(self, message_id: str) -> bool:
+        return message_id in self.scanned_ids
+    
+    def mark_scanned(self, message_ids: Iterable[str]):
+        for message_id in message_ids:
+            self.pending_ids.pop(message_id, None)
+            self.scanned_ids.pop(message_id, None)
+            self.scanned_ids[message_id] = None
+        while len(self.scanned_ids) > MAX_SCANNED_IDS:
+            del self.scanned_ids[next(iter(self.scanned_ids))]
+    
+    def mark_failed(self, message_ids: Iterable[str]):
+        """Keep messages whose fetch failed for the next scan, up to MAX_FETCH_ATTEMPTS scans."""
+        for message_id in message_ids:
+            attempts = self.pending_ids.get(message_id, 0) + 1
+            if attempts >= MAX_FETCH_ATTEMPTS:
+                print(f"Giving up on email {message_id} after {attempts} failed fetches")
+                self.pending_ids.pop(message_id, None)
+            else:
+                self.pending_ids[message_id] = attempts
+    
+    def discard_pending(self, message_ids: Iterable[str]):
+        """Stop retrying messages that no longer exist."""
+        for message_id in message_ids:
+            self.pending_ids.pop(message_id, None)
 
 class GmailReader:
     """Gmail API integration for reading and analyzing emails."""
     
-    def __init__(self):
-        """Initialize Gmail reader."""
-        self.service = None
+    def __init__(self, service=None, service_factory=None):
+        """
+        Initialize Gmail reader.
+        
+        Args:
+            service: Gmail API service to use instead of authenticating (e.g. a test fake)
+            service_factory: Callable creating the service of each fetch thread; by
+                default threads build their own from the credentials
+        """
+        self.service = service
+        self.service_factory = service_factory
         self.credentials = None
         
     def authenticate(self) -> bool:
@@ -84,65 +195,214 @@ class GmailReader:
         """
         try:
             # Get the full message
-            message = self.service.users().messages().get(
-                userId='me', 
-                id=message_id, 
-                format='full'
-            ).execute()
-            
-            # Extract headers
-            headers = message['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
-            
-            # Extract body
-            body = self._extract_body(message['payload'])
-            
-            return {
-                'id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'date': date,
-                'body': body,
-                'snippet': message.get('snippet', '')
-            }
+            message = self._get_request(message_id).execute()
+            return self._parse_message(message)
             
         except Exception as e:
             print(f"Error getting email content: {e}")
             return None
     
-    def _extract_body(self, payload: Dict) -> str:
+    def _new_service(self):
+        """A Gmail API service for one thread (the HTTP client is not thread-safe)."""
+        if self.service_factory is not None:
+            return self.service_factory()
+        if self.credentials is not None:
+            return build('gmail', 'v1', credentials=self.credentials)
+        return self.service
+    
+    def get_emails_content(self, message_ids: List[str], service=None,
+                           errors: Optional[Dict[str, Exception]] = None) -> List[Dict]:
+        """
+        Get the content of many emails through Gmail API batch requests.
+        
+        Messages are fetched BATCH_SIZE per HTTP round-trip. A message that
+        fails (to be fetched or parsed) is reported and left out; rate-limited
+        (429) and server (5xx) failures are fetched again in up to
+        BATCH_RETRIES later rounds.
+        
+        Args:
+            message_ids: Gmail message IDs
+            service: Gmail API service to fetch with (default: the reader's own)
+            errors: Filled with the error of every message that could not be fetched or parsed
+            
+        Returns:
+            List[Dict]: Email content of the messages that could be fetched, in the order of message_ids
+        """
+        messages = self._batch_get(message_ids, service or self.service, 'full', errors)
+        
+        emails = []
+        for message_id in message_ids:
+            if message_id not in messages:
+                continue
+            try:
+                emails.append(self._parse_message(messages[message_id]))
+            except Exception as e:
+                print(f"Error parsing email {message_id}: {e}")
+                if errors is not None:
+                    errors[message_id] = e
+        return emails
+    
+    def prescreen_emails(self, message_ids: List[str], service=None) -> Tuple[List[Dict], List[str]]:
+        """
+        Screen messages on their headers alone (format=metadata).
+        
+        Messages that screen_headers() clears get a scan result without their
+        bodies ever being downloaded; the others (and any whose headers could
+        not be fetched) still need a full fetch and content analysis.
+        
+        Args:
+            message_ids: Gmail message IDs
+            service: Gmail API service to fetch with (default: the reader's own)
+            
+        Returns:
+            Tuple[List[Dict], List[str]]: Scan results of the cleared messages, and
+            the IDs that need content analysis
+        """
+        messages = self._batch_get(message_ids, service or self.service, 'metadata')
+        
+        results, remaining = [], []
+        for message_id in dict.fromkeys(message_ids):
+            message = messages.get(message_id)
+            reason = screen_headers(message['payload'].get('headers', [])) if message else None
+            if reason is None:
+                remaining.append(message_id)
+                continue
+            email_data = self._parse_message(message)
+            results.append({
+                'email': email_data,
+                'analysis': prescreen_analysis(reason),
+                'timestamp': email_data['date']
+            })
+        return results, remaining
+    
+    def _batch_get(self, message_ids: List[str], service, format: str,
+                   errors: Optional[Dict[str, Exception]] = None) -> Dict[str, Dict]:
+        """Message resources by ID, fetched BATCH_SIZE per batch request, failed ones left out (and put in errors)."""
+        errors = {} if errors is None else errors
+        fetched = {}
+        pending = list(dict.fromkeys(message_ids))
+        
+        for attempt in range(BATCH_RETRIES + 1):
+            retry = []
+            
+            def handle(request_id, response, exception):
+                if exception is None:
+                    fetched[request_id] = response
+                elif self._is_retryable(exception) and attempt < BATCH_RETRIES:
+                    retry.append(request_id)
+                else:
+                    print(f"Error getting email {request_id}: {exception}")
+                    errors[request_id] = exception
+            
+            for start in range(0, len(pending), BATCH_SIZE):
+                chunk = pending[start:start + BATCH_SIZE]
+                batch = service.new_batch_http_request(callback=handle)
+                for message_id in chunk:
+                    batch.add(self._get_request(message_id, service, format), request_id=message_id)
+                try:
+                    batch.execute()
+                except Exception as e:
+                    # The whole round-trip failed; every message in it is retried or dropped
+                    if self._is_retryable(e) and attempt < BATCH_RETRIES:
+                        retry.extend(message_id for message_id in chunk if message_id not in fetched)
+                    else:
+                        print(f"Error getting batch of {len(chunk)} emails: {e}")
+                        errors.update((message_id, e) for message_id in chunk if message_id not in fetched)
+            
+            if not retry:
+                break
+            pending = retry
+        
+        return fetched
+    
+    def _get_request(self, message_id: str, service=None, format: str = 'full'):
+        """Request for one message: its full content, or just the screened headers."""
+        if format == 'metadata':
+            return (service or self.service).users().messages().get(
+                userId='me',
+                id=message_id,
+                format='metadata',
+                metadataHeaders=METADATA_HEADERS
+            )
+        return (service or self.service).users().messages().get(
+            userId='me',
+            id=message_id,
+            format=format
+        )
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Whether a failed request is worth repeating (rate limit or server error)."""
+        status = _http_status(error)
+        return status is not None and (status == 429 or status >= 500)
+    
+    def _parse_message(self, message: Dict) -> Dict:
+        """
+        Build the email content dictionary of a full- or metadata-format Gmail message.
+        
+        Args:
+            message: Gmail API message resource
+            
+        Returns:
+            Dict: Email content with subject, sender, body, etc.
+        """
+        # Extract headers
+        headers = message['payload'].get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown Sender')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown Date')
+        
+        # Extract body and the link targets of its HTML part
+        body, links = self._extract_body(message['payload'])
+        
+        return {
+            'id': message['id'],
+            'subject': subject,
+            'sender': sender,
+            'date': date,
+            'body': body,
+            'links': links,
+            'snippet': message.get('snippet', '')
+        }
+    
+    def _extract_body(self, payload: Dict) -> Tuple[str, List[str]]:
         """
         Extract email body from payload.
         
+        Parts are routed by MIME type at any nesting depth (e.g. multipart/mixed
+        holding multipart/alternative): HTML goes through the HTML extractor,
+        whether it is a part or the whole message.
+        
         Args:
             payload: Gmail message payload
             
         Returns:
-            str: Email body text
-        """
-        body = ""
-        
-        if 'parts' in payload:
-            # Multipart message
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    if 'data' in part['body']:
-                        body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                elif part['mimeType'] == 'text/html':
-                    if 'data' in part['body']:
-                        # For HTML, we'll just extract text (simplified)
-                        html_content = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                        # Simple HTML tag removal (in production, use BeautifulSoup)
-                        import re
-                        body += re.sub(r'<[^>]+>', '', html_content)
+            Tuple[str, List[str]]: Email body text and the href targets of its HTML parts
+        """
+        texts = []
+        links = []
+        self._collect_text(payload, texts, links, top_level=True)
+        return ''.join(texts), links
+    
+    def _collect_text(self, part: Dict, texts: List[str], links: List[str], top_level: bool = False):
+        """Append the text of a part (or of the parts nested in it) to texts, and its link targets to links."""
+        if part.get('parts'):
+            for child in part['parts']:
+                self._collect_text(child, texts, links)
+            return
+        data = part.get('body', {}).get('data')
+        mime_type = part.get('mimeType', '')
+        if not data:
+            return
+        if mime_type != 'text/html' and not (mime_type == 'text/plain' or top_level):
+            return
+        text = decode_text(base64.urlsafe_b64decode(data), _part_charset(part))
+        if mime_type == 'text/html':
+            extracted = html_to_text(text)
+            texts.append(extracted.text)
+            links.extend(extracted.links)
         else:
-            # Simple message
-            if 'data' in payload['body']:
-                body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-        
-        return body
+            texts.append(text)
     
     def get_recent_emails(self, max_results: int = 5) -> List[Dict]:
         """
@@ -155,26 +415,121 @@ class GmailReader:
             List[Dict]: List of email content dictionaries
         """
         try:
-            # Get recent messages
-            results = self.service.users().messages().list(
+            return list(self.iter_emails(self.iter_message_ids(max_results)))
+            
+        except Exception as e:
+            print(f"Error getting recent emails: {e}")
+            return []
+    
+    def iter_message_ids(self, max_results: Optional[int] = None) -> Iterator[str]:
+        """
+        IDs of INBOX messages, newest first, listed page by page.
+        
+        Args:
+            max_results: Maximum number of IDs, or None for the whole inbox
+            
+        Yields:
+            str: Message IDs
+        """
+        remaining = max_results
+        page_token = None
+        while remaining is None or remaining > 0:
+            response = self.service.users().messages().list(
                 userId='me',
                 labelIds=['INBOX'],
-                maxResults=max_results
+                maxResults=LIST_PAGE_SIZE if remaining is None else min(remaining, LIST_PAGE_SIZE),
+                pageToken=page_token
             ).execute()
-            
-            messages = results.get('messages', [])
-            emails = []
-            
+            messages = response.get('messages', [])
             for message in messages:
-                email_content = self.get_email_content(message['id'])
-                if email_content:
-                    emails.append(email_content)
+                yield message['id']
+            if remaining is not None:
+                remaining -= len(messages)
+            page_token = response.get('nextPageToken')
+            if not page_token or not messages:
+                return
+    
+    def iter_emails(self, message_ids: Iterable[str], chunk_size: int = BATCH_SIZE) -> Iterator[Dict]:
+        """
+        Email content of a stream of message IDs, fetched one batch request at a time.
+        
+        Args:
+            message_ids: Gmail message IDs (any iterable, consumed lazily)
+            chunk_size: Messages fetched per batch request
             
-            return emails
+        Yields:
+            Dict: Email content of each message that could be fetched
+        """
+        for chunk in chunked(message_ids, chunk_size):
+            yield from self.get_emails_content(chunk)
+    
+    def iter_new_message_ids(self, checkpoint: SyncCheckpoint,
+                             max_results: Optional[int] = 5) -> Generator[str, None, str]:
+        """
+        IDs of INBOX messages not scanned yet.
+        
+        With a historyId, only the mailbox changes since then are read
+        (users.history.list). Without one, or when Gmail no longer has the
+        history that far back (HTTP 404), this falls back to a full sync of
+        the max_results most recent messages. Messages whose fetch failed in
+        an earlier scan come first. The checkpoint is not changed:
+        the new historyId is the generator's return value, to be recorded
+        only once every yielded message has been scanned, so an interrupted
+        scan is resumed rather than skipped.
+        
+        Args:
+            checkpoint: Sync checkpoint of the previous scan
+            max_results: Messages considered by a full sync, or None for the whole inbox
             
-        except Exception as e:
-            print(f"Error getting recent emails: {e}")
-            return []
+        Yields:
+            str: Message IDs, oldest change first for incremental syncs
+            
+        Returns:
+            str: The mailbox historyId the listed changes go up to
+        """
+        pending = [message_id for message_id in checkpoint.pending_ids if not checkpoint.is_scanned(message_id)]
+        yield from pending
+        pending = set(pending)
+        
+        history_id = None
+        if checkpoint.history_id:
+            try:
+                history_id = yield from self._iter_history_message_ids(checkpoint, pending)
+            except HttpError as e:
+                if getattr(e.resp, 'status', None) != 404:
+                    raise
+                print("Sync checkpoint expired, rescanning recent emails...")
+        
+        if history_id is None:
+            # Read the historyId first: mail arriving during the listing is picked up next time
+            history_id = self.service.users().getProfile(userId='me').execute()['historyId']
+            for message_id in self.iter_message_ids(max_results):
+                if not checkpoint.is_scanned(message_id) and message_id not in pending:
+                    yield message_id
+        
+        return history_id
+    
+    def _iter_history_message_ids(self, checkpoint: SyncCheckpoint, skip: Set[str]):
+        """Yield IDs of unscanned messages added to the INBOX since the checkpoint; return the current historyId."""
+        history_id = checkpoint.history_id
+        page_token = None
+        while True:
+            response = self.service.users().history().list(
+                userId='me',
+                startHistoryId=checkpoint.history_id,
+                labelId='INBOX',
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            ).execute()
+            for record in response.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message_id = added['message']['id']
+                    if not checkpoint.is_scanned(message_id) and message_id not in skip:
+                        yield message_id
+            history_id = response.get('historyId', history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return history_id
     
     def analyze_emails(self, emails: List[Dict]) -> List[Dict]:
         """
@@ -186,44 +541,171 @@ class GmailReader:
         Returns:
             List[Dict]: List of analysis results
         """
-        results = []
+        if not emails:
+            return []
         
-        for email_data in emails:
-            # Analyze the email body
-            analysis = analyze_email(email_data['body'])
-            
-            # Combine email data with analysis
-            result = {
+        # Analyze the email bodies as one batch
+        analyses = classify_emails(
+            [email_data['body'] for email_data in emails],
+            links=[email_data.get('links') for email_data in emails]
+        )
+        
+        # Combine email data with analysis
+        return [
+            {
                 'email': email_data,
                 'analysis': analysis,
                 'timestamp': email_data['date']
             }
+            for email_data, analysis in zip(emails, analyses)
+        ]
+    
+    def iter_scan_inbox(self, max_emails: Optional[int] = 5, state_file: Optional[str] = SYNC_STATE_FILE,
+                        chunk_size: int = BATCH_SIZE, fetch_threads: int = FETCH_THREADS,
+                        queue_depth: int = QUEUE_DEPTH, prescreen: bool = PRESCREEN) -> Iterator[Dict]:
+        """
+        Scan inbox emails for threats, streaming the results.
+        
+        The scan is a pipeline: one thread lists message IDs page by page
+        and hands them out in chunks, fetch_threads threads download and
+        decode the chunks (each with its own API service), and the calling
+        thread analyzes every fetched chunk as one batch. Bounded queues
+        between the stages keep at most about queue_depth chunks waiting,
+        so memory use does not depend on how many emails are scanned while
+        network latency overlaps with model time. With several fetch threads
+        the results come in the order chunks finish, not the listing order.
+        The scanned IDs are saved to the sync checkpoint after every analyzed
+        chunk; the new historyId only after the last one.
+        
+        With prescreen, each chunk's headers are fetched first and only the
+        messages screen_headers() does not clear are fetched in full and
+        analyzed.
+        
+        Args:
+            max_emails: Maximum number of emails to scan on a full sync, or None for the whole inbox
+            state_file: Sync checkpoint path, or None to always scan the most recent emails
+            chunk_size: Emails fetched and analyzed together
+            fetch_threads: Threads fetching message bodies
+            queue_depth: Chunks buffered between the stages
+            prescreen: Screen headers (format=metadata) before fetching bodies
             
-            results.append(result)
+        Yields:
+            Dict: Scan result of each email
+        """
+        checkpoint = SyncCheckpoint.load(state_file) if state_file is not None else None
+        if checkpoint is None:
+            print(f"🔍 Scanning {max_emails or 'all'} recent emails...")
+            message_ids = self.iter_message_ids(max_emails)
+        else:
+            print("🔍 Scanning new emails..." if checkpoint.history_id
+                  else f"🔍 Scanning {max_emails or 'all'} recent emails...")
+            message_ids = self.iter_new_message_ids(checkpoint, max_emails)
         
-        return results
+        fetch_threads = max(fetch_threads, 1)
+        id_chunks = queue.Queue(maxsize=max(queue_depth, 1))
+        fetched = queue.Queue(maxsize=max(queue_depth, 1))
+        stop = threading.Event()
+        
+        def list_ids():
+            listing = {}
+            
+            def ids():
+                listing['history_id'] = yield from message_ids
+            
+            try:
+                for chunk in chunked(ids(), chunk_size):
+                    if not _put(id_chunks, chunk, stop):
+                        return
+                # Reaches the consumer before the fetch threads finish
+                _put(fetched, _Listed(listing.get('history_id')), stop)
+            except Exception as e:
+                _put(fetched, e, stop)
+            finally:
+                for _ in range(fetch_threads):
+                    _put(id_chunks, None, stop)
+        
+        def fetch():
+            try:
+                service = self._new_service()
+                while True:
+                    chunk = _get(id_chunks, stop)
+                    if chunk is None:
+                        return
+                    screened = []
+                    if prescreen:
+                        screened, chunk = self.prescreen_emails(chunk, service)
+                    errors = {}
+                    emails = self.get_emails_content(chunk, service, errors) if chunk else []
+                    if not _put(fetched, (emails, screened, errors), stop):
+                        return
+            except Exception as e:
+                _put(fetched, e, stop)
+            finally:
+                _put(fetched, _FETCH_DONE, stop)
+        
+        threads = [threading.Thread(target=list_ids, daemon=True)]
+        threads += [threading.Thread(target=fetch, daemon=True) for _ in range(fetch_threads)]
+        for thread in threads:
+            thread.start()
+        
+        history_id = None
+        try:
+            running = fetch_threads
+            while running:
+                item = fetched.get()
+                if item is _FETCH_DONE:
+                    running -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                if isinstance(item, _Listed):
+                    history_id = item.history_id
+                    continue
+                emails, screened, errors = item
+                results = self.analyze_emails(emails) + screened
+                yield from results
+                if checkpoint is not None:
+                    checkpoint.mark_scanned(result['email']['id'] for result in results)
+                    # Deleted messages are gone for good; anything else is fetched again next time
+                    checkpoint.discard_pending(i for i, e in errors.items() if _http_status(e) == 404)
+                    checkpoint.mark_failed(i for i, e in errors.items() if _http_status(e) != 404)
+                    checkpoint.save(state_file)
+        finally:
+            # Also reached when the consumer stops early: wind the threads down
+            stop.set()
+            for thread in threads:
+                thread.join()
+        
+        if checkpoint is not None:
+            # Every listed message has been analyzed: record the new historyId
+            if history_id:
+                checkpoint.history_id = history_id
+            checkpoint.save(state_file)
     
-    def scan_inbox(self, max_emails: int = 5) -> List[Dict]:
+    def scan_inbox(self, max_emails: Optional[int] = 5, state_file: Optional[str] = SYNC_STATE_FILE) -> List[Dict]:
         """
-        Scan recent emails in inbox for threats.
+        Scan inbox emails for threats.
+        
+        With a state file, only emails that arrived since the previous scan
+        are fetched and analyzed; the first scan (and any scan after the
+        checkpoint expired) covers the max_emails most recent ones. Use
+        iter_scan_inbox() to scan large mailboxes without holding every result.
         
         Args:
-            max_emails: Maximum number of emails to scan
+            max_emails: Maximum number of emails to scan on a full sync, or None for the whole inbox
+            state_file: Sync checkpoint path, or None to always scan the most recent emails
             
         Returns:
             List[Dict]: List of scan results
         """
-        print(f"🔍 Scanning {max_emails} recent emails...")
-        
-        # Get recent emails
-        emails = self.get_recent_emails(max_emails)
-        
-        if not emails:
-            print("No emails found in inbox.")
-            return []
+        results = []
+        try:
+            results.extend(self.iter_scan_inbox(max_emails, state_file))
+        except Exception as e:
+            print(f"Error scanning inbox: {e}")
         
-        # Analyze emails
-        results = self.analyze_emails(emails)
+        if not results:
+            print("No new emails found in inbox." if state_file else "No emails found in inbox.")
         
         return results
     
@@ -238,35 +720,189 @@ class GmailReader:
             print("No scan results to display.")
             return
         
-        print(f"\n📊 Scan Summary ({len(results)} emails analyzed)")
-        print("=" * 60)
-        
         # Count classifications
         classifications = {}
         for result in results:
             classification = result['analysis']['classification']
             classifications[classification] = classifications.get(classification, 0) + 1
         
-        # Print summary
-        for classification, count in classifications.items():
-            print(f"{classification.title()}: {count}")
+        self.print_classification_counts(classifications, len(results))
         
         print("\n📧 Detailed Results:")
         print("-" * 60)
         
         for i, result in enumerate(results, 1):
-            email_data = result['email']
-            analysis = result['analysis']
-            
-            print(f"\n{i}. {email_data['subject']}")
-            print(f"   From: {email_data['sender']}")
-            print(f"   Date: {email_data['date']}")
-            print(f"   Classification: {analysis['classification'].upper()}")
-            print(f"   Confidence: {analysis['confidence']:.1%}")
-            print(f"   Explanation: {analysis['explanation']}")
-            
-            if analysis['indicators']:
-                print(f"   Indicators: {', '.join(analysis['indicators'])}")
+            self.print_result(i, result)
+    
+    def print_classification_counts(self, classifications: Dict[str, int], total: int):
+        """
+        Print how many emails got each classification.
+        
+        Args:
+            classifications: Number of emails per classification
+            total: Number of emails analyzed
+        """
+        print(f"\n📊 Scan Summary ({total} emails analyzed)")
+        print("=" * 60)
+        
+        for classification, count in classifications.items():
+            print(f"{classification.title()}: {count}")
+    
+    def print_result(self, index: int, result: Dict):
+        """
+        Print the details of one scan result.
+        
+        Args:
+            index: Position of the result, starting at 1
+            result: Scan result
+        """
+        email_data = result['email']
+        analysis = result['analysis']
+        
+        print(f"\n{index}. {email_data['subject']}")
+        print(f"   From: {email_data['sender']}")
+        print(f"   Date: {email_data['date']}")
+        print(f"   Classification: {analysis['classification'].upper()}")
+        print(f"   Confidence: {analysis['confidence']:.1%}")
+        print(f"   Explanation: {analysis['explanation']}")
+        
+        if analysis['indicators']:
+            print(f"   Indicators: {', '.join(analysis['indicators'])}")
+
+_AUTH_RESULT = re.compile(r'\b(spf|dkim|dmarc)=([a-z]+)', re.IGNORECASE)
+_HEADER_FROM = re.compile(r'\bheader\.from=([^\s;]+)', re.IGNORECASE)
+
+def auth_results(headers: List[Dict]) -> Tuple[Dict[str, str], Optional[str]]:
+    """
+    Verdicts of the topmost Authentication-Results header.
+    
+    Gmail prepends its own header on receipt; any further down came with
+    the message and may be forged, so they are ignored. The topmost one
+    only counts when its authserv-id is in AUTHSERV_IDS.
+    
+    Args:
+        headers: Gmail message headers ({'name': ..., 'value': ...}), in message order
+        
+    Returns:
+        Tuple[Dict[str, str], Optional[str]]: Result per method (spf, dkim, dmarc;
+        any result other than pass wins) and the domain DMARC evaluated
+    """
+    value = next((h['value'] for h in headers if h['name'].lower() == 'authentication-results'), None)
+    if value is None:
+        return {}, None
+    authserv_id = value.split(';', 1)[0].split()
+    if not authserv_id or authserv_id[0].lower() not in AUTHSERV_IDS:
+        return {}, None
+    
+    results = {}
+    for method, result in _AUTH_RESULT.findall(value):
+        method = method.lower()
+        if results.get(method, 'pass') == 'pass':
+            results[method] = result.lower()
+    match = _HEADER_FROM.search(value)
+    return results, match.group(1).lower().lstrip('@') if match else None
+
+def screen_headers(headers: List[Dict], allowlist=None, skip_bulk: Optional[bool] = None) -> Optional[str]:
+    """
+    Header-only screen: why a message needs no content analysis, if it does not.
+    
+    Only mail that passed DMARC for its From domain, with no failing SPF or
+    DKIM result, can be cleared. It is cleared when the sender (or its
+    domain) is allowlisted, or, with skip_bulk, when it is mailing-list mail
+    carrying a List-Unsubscribe header.
+    
+    Args:
+        headers: Gmail message headers ({'name': ..., 'value': ...})
+        allowlist: Sender addresses and domains (default: SENDER_ALLOWLIST)
+        skip_bulk: Clear authenticated mailing-list mail (default: PRESCREEN_BULK)
+        
+    Returns:
+        Optional[str]: Reason the message was cleared, or None when it must be analyzed
+    """
+    allowlist = SENDER_ALLOWLIST if allowlist is None else allowlist
+    skip_bulk = PRESCREEN_BULK if skip_bulk is None else skip_bulk
+    
+    sender = parseaddr(next((h['value'] for h in headers if h['name'].lower() == 'from'), ''))[1].lower()
+    domain = sender.rpartition('@')[2]
+    if not domain:
+        return None
+    
+    # Never clear mail that failed, or lacks, authentication
+    results, dmarc_domain = auth_results(headers)
+    if results.get('dmarc') != 'pass' or any(result != 'pass' for result in results.values()):
+        return None
+    if dmarc_domain != domain:
+        return None
+    
+    if sender in allowlist or any(domain == entry or domain.endswith('.' + entry) for entry in allowlist):
+        return f"Allowlisted sender {sender} (DMARC pass)"
+    if skip_bulk and any(h['name'].lower() == 'list-unsubscribe' for h in headers):
+        return f"Authenticated mailing-list mail from {domain} (List-Unsubscribe, DMARC pass)"
+    return None
+
+def prescreen_analysis(reason: str) -> Dict:
+    """Analysis result of a message cleared by the header screen."""
+    return {
+        'classification': 'legitimate',
+        'confidence': 1.0,
+        'explanation': f"Skipped content analysis: {reason}",
+        'features': {},
+        'indicators': [],
+        'raw_text_length': 0,
+        'prescreened': True
+    }
+
+# Sent by each fetch thread when it has finished
+_FETCH_DONE = object()
+
+class _Listed(NamedTuple):
+    """Sent by the lister once every message ID has been handed out."""
+    history_id: Optional[str]
+
+def _part_charset(part: Dict) -> Optional[str]:
+    """Charset named by the Content-Type header of a message part, if any."""
+    content_type = next((h['value'] for h in part.get('headers', []) if h['name'].lower() == 'content-type'), None)
+    if not content_type:
+        return None
+    message = Message()
+    message['Content-Type'] = content_type
+    return message.get_content_charset()
+
+def _http_status(error: Exception) -> Optional[int]:
+    """HTTP status of a failed API request, if it has one."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put an item, waiting for room unless the pipeline is stopped; whether it was put."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q: queue.Queue, stop: threading.Event):
+    """Take an item, or None once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Lists of up to size consecutive items, read lazily."""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 def main():
     """Main function for Gmail scanning."""
@@ -285,23 +921,36 @@ def main():
     print("✅ Authentication successful!")
     
     # Get number of emails to scan
-    try:
-        max_emails = int(input("Enter number of recent emails to scan (default: 5): ") or "5")
-    except ValueError:
-        max_emails = 5
+    answer = input("Enter number of recent emails to scan (default: 5, 'all' for the whole inbox): ").strip()
+    if answer.lower() == 'all':
+        max_emails = None
+    else:
+        try:
+            max_emails = int(answer or "5")
+        except ValueError:
+            max_emails = 5
     
-    # Scan inbox
-    results = gmail_reader.scan_inbox(max_emails)
+    # Scan inbox, printing and saving each result as soon as it is ready
+    classifications = {}
+    total = 0
+    with open(OUTPUT_FILE, 'w') as f:
+        try:
+            for total, result in enumerate(gmail_reader.iter_scan_inbox(max_emails), 1):
+                gmail_reader.print_result(total, result)
+                f.write(json.dumps(result, default=str) + '\n')
+                classification = result['analysis']['classification']
+                classifications[classification] = classifications.get(classification, 0) + 1
+        except Exception as e:
+            print(f"Error scanning inbox: {e}")
     
-    # Print results
-    gmail_reader.print_scan_summary(results)
+    if not total:
+        print("No new emails found in inbox.")
+        return
     
-    # Save results to file
-    output_file = f"gmail_scan_{len(results)}_emails.json"
-    with open(output_file, 'w') as f:
-        json.dump(results, f, indent=2, default=str)
+    # Print results
+    gmail_reader.print_classification_counts(classifications, total)
     
-    print(f"\n💾 Results saved to {output_file}")
+    print(f"\n💾 Results saved to {OUTPUT_FILE}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+Unit tests for the Smart Email Guardian API endpoints and pre-fork server.
+"""
+
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory (which holds the app and services) to the path
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+import serve
+
+def fake_analyze_emails(texts, batch_size=None, links=None):
+    """Stand-in for the model: 'boom' fails its whole batch, 'win' is phishing."""
+    if "boom" in texts:
+        raise RuntimeError("model exploded")
+    return [{
+        "classification": "phishing" if "win" in text else "legitimate",
+        "confidence": 0.9,
+        "explanation": "stub",
+        "features": {},
+        "indicators": []
+    } for text in texts]
+
+@pytest.fixture
+def app_module(monkeypatch):
+    """The API module, with the model replaced by fake_analyze_emails."""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("uvicorn")
+    import app
+    monkeypatch.setattr(app, "analyze_emails", fake_analyze_emails)
+    return app
+
+@pytest.fixture
+def client(app_module):
+    """Authenticated API client."""
+    from fastapi.testclient import TestClient
+    return TestClient(app_module.app, base_url="http://localhost", headers={"x-api-key": app_module.API_KEY})
+
+def ndjson(response):
+    """Decoded lines of an NDJSON response."""
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+def test_scan_batch_json_array(client):
+    """Test that a JSON array batch streams one result per email, in order."""
+    body = [{"content": "hello there", "user_id": "u1"}, {"content": "you win a prize"}]
+    response = client.post("/scan/batch", json=body)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = ndjson(response)
+    assert [r["classification"] for r in results] == ["legitimate", "phishing"]
+    assert results[0]["user_id"] == "u1"
+    assert results[0]["id"] != results[1]["id"]
+
+def test_scan_batch_ndjson(client):
+    """Test that an NDJSON body is accepted, blank lines and a missing final newline included."""
+    body = '{"content": "first"}\n\n{"content": "you win"}'
+    response = client.post("/scan/batch", content=body, headers={"content-type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    assert [r["classification"] for r in ndjson(response)] == ["legitimate", "phishing"]
+
+def test_scan_batch_error_lines(client, app_module, monkeypatch):
+    """Test that a failed model call yields per-item error lines and the rest still streams."""
+    monkeypatch.setattr(app_module, "BATCH_MAX_SIZE", 2)
+    body = [{"content": "boom"}, {"content": "fine"}, {"content": "also fine"}]
+    results = ndjson(client.post("/scan/batch", json=body))
+
+    assert [r.get("index") for r in results[:2]] == [0, 1]
+    assert all("model exploded" in r["error"] for r in results[:2])
+    assert results[2]["classification"] == "legitimate"
+
+@pytest.mark.parametrize("body, content_type, status", [
+    (json.dumps([{"content": "a"}, {"content": "b"}, {"content": "c"}]), "application/json", 413),
+    ('{"content": "a"}\n{"content": "b"}\n{"content": "c"}\n', "application/x-ndjson", 413),
+    (json.dumps({"content": "not a list"}), "application/json", 422),
+    (json.dumps([{"content": ""}]), "application/json", 422),
+    ('{"content": "a"}\n{"user_id": "no content"}\n', "application/x-ndjson", 422),
+    ('[{"content": "a"', "application/json", 400),
+    ('{"content": "a"}\n{oops\n', "application/x-ndjson", 400),
+])
+def test_scan_batch_rejects_bad_bodies(client, app_module, monkeypatch, body, content_type, status):
+    """Test the status codes of oversized, invalid and malformed batches."""
+    monkeypatch.setattr(app_module, "MAX_BATCH_ITEMS", 2)
+    response = client.post("/scan/batch", content=body, headers={"content-type": content_type})
+
+    assert response.status_code == status
+
+def test_scan_batch_requires_api_key(client):
+    """Test that /scan/batch is authenticated."""
+    response = client.post("/scan/batch", json=[{"content": "a"}], headers={"x-api-key": "wrong"})
+
+    assert response.status_code == 401
+
+def test_memory_endpoint(client):
+    """Test that /memory reports this worker's memory without loading the model."""
+    response = client.get("/memory")
+
+    assert response.status_code == 200
+    report = response.json()
+    assert report["pid"] == os.getpid()
+    assert report["max_rss_kb"] > 0
+    assert report["model_loaded"] is False
+
+def test_serve_parse_args_and_bind(monkeypatch):
+    """Smoke test of the pre-fork server's options and shared listening socket."""
+    monkeypatch.setattr(sys, "argv", ["serve.py", "--workers", "3", "--threads", "2", "--port", "0"])
+    args = serve.parse_args()
+    assert (args.workers, args.threads, args.port) == (3, 2, 0)
+
+    sock = serve.bind_socket("127.0.0.1", args.port)
+    try:
+        assert sock.get_inheritable()
+        client = socket.create_connection(sock.getsockname(), timeout=5)
+        client.close()
+    finally:
+        sock.close()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork server needs fork()")
+def test_serve_spawn_worker_exit_codes(monkeypatch):
+    """Test that a forked worker exits instead of returning into the master's loop."""
+    def run_worker(index, sock, app, log_level):
+        if index:
+            raise RuntimeError("worker failed")
+    monkeypatch.setattr(serve, "run_worker", run_worker)
+
+    for index, expected in ((0, 0), (1, 1)):
+        pid = serve.spawn(index, None, None, "info")
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == expected
@@ -0,0 +1,123 @@
+"""
+Unit tests for the Smart Email Guardian CLI bulk mode.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# Add the project root (which holds the CLI) to the path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import email_guard
+from email_guard import format_record, iter_messages, read_message
+from ai.sidecar import SidecarServer
+
+CLI = Path(__file__).parent.parent / "email_guard.py"
+
+MBOX = (
+    "From alice@example.com Mon Jan  1 00:00:00 2024\n"
+    "Subject: first\n\nFirst body\n\n"
+    "From bob@example.com Mon Jan  1 00:00:00 2024\n"
+    "Subject: second\n\nSecond body\n"
+)
+
+@pytest.fixture
+def spool(tmp_path):
+    """A directory with a plain message, a nested message, an mbox and a Maildir."""
+    (tmp_path / "a.eml").write_text("Subject: a\n\nPlain message\n")
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "b.eml").write_text("Subject: b\n\nNested message\n")
+    (tmp_path / "archive.mbox").write_text(MBOX)
+    (tmp_path / "note.txt").write_text("From the IT department: your password expires\nClick here\n")
+    for name in ("cur", "new", "tmp"):
+        (tmp_path / "Maildir" / name).mkdir(parents=True)
+    (tmp_path / "Maildir" / "new" / "1700000000.1.host").write_text("Subject: m\n\nMaildir message\n")
+    return tmp_path
+
+def test_iter_messages_reads_every_format(spool):
+    """Test that directories are walked and mailboxes are split into messages."""
+    messages = list(iter_messages([str(spool)]))
+    bodies = [message.text.strip() for _, message in messages]
+
+    assert sorted(bodies) == sorted([
+        "Plain message", "Nested message", "First body", "Second body", "Maildir message",
+        "From the IT department: your password expires\nClick here"
+    ])
+    sources = [source for source, _ in messages]
+    assert f"{spool / 'archive.mbox'}:0" in sources
+    assert any(source.startswith(f"{spool / 'Maildir'}:") for source in sources)
+
+def test_iter_messages_skips_unparseable_messages(spool, monkeypatch, capsys):
+    """Test that a message failing to parse is reported and the rest of its mailbox still read."""
+    real_parse = email_guard.parse_message
+    def parse_message(f):
+        message = real_parse(f)
+        if message.text.strip() in ("First body", "Plain message"):
+            raise ValueError("broken")
+        return message
+    monkeypatch.setattr(email_guard, "parse_message", parse_message)
+    sources = [source for source, _ in iter_messages([str(spool)])]
+    
+    assert f"{spool / 'archive.mbox'}:1" in sources
+    assert f"{spool / 'archive.mbox'}:0" not in sources
+    assert str(spool / "a.eml") not in sources
+    assert len(sources) == 4
+    warnings = capsys.readouterr().err
+    assert f"skipping '{spool / 'archive.mbox'}:0': broken" in warnings
+    assert f"skipping '{spool / 'a.eml'}': broken" in warnings
+
+def test_read_message_falls_back_to_raw_text(tmp_path, monkeypatch):
+    """Test that -f analyzes the raw text of a file that does not parse."""
+    path = tmp_path / "mail.txt"
+    path.write_bytes(b"Subject: hi\n\nVerify your account\n")
+    def fail(f):
+        f.read()
+        raise ValueError("broken")
+    monkeypatch.setattr(email_guard, "parse_message", fail)
+    
+    assert read_message(str(path)).text == "Subject: hi\n\nVerify your account\n"
+
+def test_iter_messages_expands_globs(spool):
+    """Test that glob patterns are expanded recursively."""
+    sources = [source for source, _ in iter_messages([str(spool / "**" / "*.eml")])]
+
+    assert sources == [str(spool / "a.eml"), str(spool / "nested" / "b.eml")]
+
+def test_format_record_one_line_per_message():
+    """Test that bulk-mode records never span lines."""
+    result = {'classification': 'phishing', 'confidence': 0.9, 'explanation': "Line one\nline\ttwo"}
+
+    assert json.loads(format_record("a.eml", result)) == dict(result, source="a.eml")
+    assert format_record("a.eml", result, "tsv") == "a.eml\tphishing\t0.9000\tLine one line two"
+
+def test_bulk_mode_worker_pool(spool, tmp_path):
+    """Smoke test of --workers: spawned workers analyze every message, in input order."""
+    path = str(tmp_path / "guard.sock")
+    # Stand-in inference daemon, so the workers never load the model
+    server = SidecarServer(path, lambda texts, links: [{
+        'classification': 'phishing' if 'password' in text else 'legitimate',
+        'confidence': 0.9, 'explanation': 'stub'
+    } for text in texts])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        run = lambda workers: subprocess.run(
+            [sys.executable, str(CLI), str(spool), "--workers", str(workers), "--batch-size", "2"],
+            capture_output=True, text=True, timeout=120, env=dict(os.environ, EMAIL_GUARD_SOCKET=path)
+        )
+        pooled, single = run(2), run(1)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert pooled.returncode == 2, pooled.stderr
+    records = [json.loads(line) for line in pooled.stdout.splitlines()]
+    assert len(records) == 6
+    assert [r['classification'] for r in records].count('phishing') == 1
+    assert pooled.stdout == single.stdout
@@ -3,13 +3,28 @@ Unit tests for Smart Email Guardian AI module.
 """
 
 import pytest
+import base64
+import io
+import os
+import socket
+import subprocess
 import sys
+import threading
 from pathlib import Path
 
-# Add the ai directory to the path
-sys.path.append(str(Path(__file__).parent.parent / "ai"))
+# Add the backend directory (which holds the ai package) to the path
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+sys.path.append(str(BACKEND_DIR))
 
-from ai.email_guard import analyze_email, EmailGuardAI
+from ai.email_guard import analyze_email, analyze_emails, EmailGuardAI
+from ai.chunking import aggregate_scores, token_windows
+from ai.inference_backends import PARITY_SAMPLES, create_backend, parity_report
+from ai.html_text import html_to_text, web_links
+from ai.message_parser import message_text, parse_message
+from ai.near_duplicate import NearDuplicateIndex
+from ai.result_cache import ResultCache
+from ai import sidecar
+from ai.sidecar import SidecarClient, SidecarServer, SidecarUnavailable, recv_frame, send_frame
 
 class TestEmailGuardAI:
     """Test cases for EmailGuardAI class."""
@@ -197,6 +212,14 @@ class TestEmailGuardAI:
         assert ai.model_name == "distilbert-base-uncased-finetuned-sst-2-english"
         assert ai.classifier is not None
     
+    def test_model_loads_lazily(self):
+        """Test that creating EmailGuardAI does not load the model."""
+        ai = EmailGuardAI()
+        
+        assert not ai.is_loaded
+        ai.warmup()
+        assert ai.is_loaded
+    
     def test_feature_extraction(self):
         """Test feature extraction functionality."""
         ai = EmailGuardAI()
@@ -210,6 +233,24 @@ class TestEmailGuardAI:
         assert features['exclamation_count'] == 1  # One exclamation mark
         assert features['uppercase_ratio'] > 0     # Some uppercase letters
     
+    def test_rule_engine_overlapping_terms(self):
+        """Test that one scan counts words shared by several rules and inside URLs."""
+        ai = EmailGuardAI()
+        
+        text = "Dear Sir, your ACCOUNT SUSPENDED notice: login here http://bank-verify.com/login or pay $100 to kindly@help.com"
+        features = ai._extract_features(text)
+        indicators = ai._detect_phishing_indicators(text)
+        
+        # account, suspended, login, verify and login (both inside the URL)
+        assert features['urgent_words'] == 5
+        assert features['url_count'] == 1
+        assert features['email_count'] == 1
+        assert features['money_mentions'] == 1
+        assert indicators == [
+            'urgent_action', 'personal_info', 'financial',
+            'suspicious_links', 'grammar_errors', 'generic_greeting'
+        ]
+    
     def test_phishing_indicators_detection(self):
         """Test phishing indicators detection."""
         ai = EmailGuardAI()
@@ -228,6 +269,318 @@ class TestEmailGuardAI:
         # Should have fewer or no indicators
         assert len(indicators) == 0 or len(indicators) < 2
 
+def test_repeated_email_served_from_cache():
+    """Test that an identical email body skips the model the second time."""
+    ai = EmailGuardAI(cache_size=8)
+    email_text = "Your invoice for October is attached. Thanks for your business."
+    
+    first = ai.analyze_email(email_text)
+    second = ai.analyze_email("  " + email_text + "\n")
+    
+    assert first['cached'] is False
+    assert second['cached'] is True
+    assert second['classification'] == first['classification']
+    assert ai.cache.stats()['hits'] == 1
+
+def test_result_cache_eviction_and_ttl(monkeypatch):
+    """Test LRU eviction, TTL expiry and hit/miss counters of ResultCache."""
+    cache = ResultCache(max_size=2, ttl_seconds=10)
+    now = [100.0]
+    monkeypatch.setattr("ai.result_cache.time.monotonic", lambda: now[0])
+    
+    cache.put("a", {"classification": "spam"})
+    cache.put("b", {"classification": "legitimate"})
+    assert cache.get("a") == {"classification": "spam"}
+    cache.put("c", {"classification": "phishing"})  # evicts "b", the least recently used
+    
+    assert cache.get("b") is None
+    now[0] += 11
+    assert cache.get("a") is None  # expired
+    
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 1
+    assert stats['expirations'] == 1
+    assert ResultCache.key_for(" body \n") == ResultCache.key_for("body")
+
+def test_near_duplicate_index_matches_campaign_variants():
+    """Test that campaign variants reuse a verdict and unrelated mail does not."""
+    index = NearDuplicateIndex(max_entries=2)
+    template = (
+        "Dear {name}, your account has been suspended due to unusual sign-in activity. "
+        "To restore access please verify your identity within 24 hours using the secure link "
+        "below: https://secure-login.example.com/verify?token={token} Failure to do so will "
+        "result in permanent closure. Thank you, Security Team"
+    )
+    index.add(index.signature(template.format(name="Alice", token="a81f")), ('suspicious', 0.97))
+    
+    match = index.query(index.signature(template.format(name="Bob", token="77c2")))
+    assert match is not None
+    verdict, similarity = match
+    assert verdict == ('suspicious', 0.97)
+    assert similarity >= index.threshold
+    
+    unrelated = "Your order has shipped and will arrive on Tuesday. Track the package from your orders page. Thanks for shopping with us."
+    assert index.query(index.signature(unrelated)) is None
+    # Too short to match safely
+    assert index.signature("Hi Bob") is None
+
+def test_token_windows_cover_long_emails():
+    """Test overlapping token windows and the per-email window cap."""
+    ids = list(range(1000))
+    windows = token_windows(ids, window_size=510, overlap=64, max_windows=8)
+    
+    assert [len(window) for window in windows] == [510, 510, 108]
+    assert windows[1][0] == 446  # 64 tokens shared with the first window
+    assert windows[-1][-1] == 999  # the tail of the email is read
+    assert token_windows(list(range(10)), 510, 64, 8) == [list(range(10))]
+    
+    capped = token_windows(list(range(10000)), window_size=100, overlap=10, max_windows=4)
+    assert len(capped) == 4
+    assert capped[0][0] == 0
+    assert capped[-1][-1] == 9999
+
+def test_aggregate_scores_modes():
+    """Test max and mean aggregation of window probabilities."""
+    # [NEGATIVE, POSITIVE] probabilities of three windows
+    window_probs = [[0.1, 0.9], [0.2, 0.8], [0.7, 0.3]]
+    
+    classification, confidence = aggregate_scores(window_probs, positive_index=1, mode='max')
+    assert classification == 'suspicious'
+    assert confidence == pytest.approx(0.7)
+    
+    classification, confidence = aggregate_scores(window_probs, positive_index=1, mode='mean')
+    assert classification == 'legitimate'
+    assert confidence == pytest.approx(2.0 / 3.0)
+    
+    assert aggregate_scores([[0.1, 0.9]], 1, 'max') == aggregate_scores([[0.1, 0.9]], 1, 'mean')
+
+def test_unknown_backend_rejected():
+    """Test that an unknown inference backend name fails fast."""
+    with pytest.raises(ValueError):
+        EmailGuardAI(backend="tensorflow")
+    with pytest.raises(ValueError):
+        create_backend("tensorflow", "distilbert-base-uncased-finetuned-sst-2-english")
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_backend_parity(backend):
+    """Test that ONNX Runtime backends agree with the PyTorch reference."""
+    pytest.importorskip("onnxruntime")
+    candidate = create_backend(backend, "distilbert-base-uncased-finetuned-sst-2-english")
+    report = parity_report(candidate, PARITY_SAMPLES)
+    
+    assert report['agreement'] >= 0.875
+    if backend == "onnx":
+        assert report['max_abs_diff'] < 1e-3
+
+def test_import_does_not_load_torch():
+    """Test that importing the AI module leaves torch/transformers unimported."""
+    code = (
+        "import sys; import ai.email_guard; "
+        "assert 'torch' not in sys.modules; "
+        "assert 'transformers' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True)
+
+def test_sidecar_round_trip(tmp_path):
+    """Test that the daemon client gets the server's results in order over the socket."""
+    path = str(tmp_path / "guard.sock")
+    server = SidecarServer(path, lambda texts, links: [
+        {'text': text, 'length': len(text), 'links': email_links} for text, email_links in zip(texts, links)
+    ])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = SidecarClient(path, timeout=5)
+        assert client.available()
+        assert client.analyze(["h\u00e9llo", "", "x" * 100000]) == [
+            {'text': "h\u00e9llo", 'length': 5, 'links': []},
+            {'text': "", 'length': 0, 'links': []},
+            {'text': "x" * 100000, 'length': 100000, 'links': []},
+        ]
+        # The connection is reused for the next request
+        links = ["https://a.example/x", "mailto:b@example.com"]
+        assert client.analyze(["again"], [links])[0] == {'text': "again", 'length': 5, 'links': links}
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    
+    assert not client.available()
+    with pytest.raises(SidecarUnavailable):
+        SidecarClient(str(tmp_path / "missing.sock"), timeout=1).analyze(["x"])
+
+def test_sidecar_socket_checks(tmp_path, monkeypatch):
+    """Test that only the user's own live daemon is used, and malformed replies fall back."""
+    path = str(tmp_path / "guard.sock")
+    server = SidecarServer(path, lambda texts, links: [{} for _ in texts])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        # A live daemon is never replaced
+        with pytest.raises(RuntimeError):
+            SidecarServer(path, lambda texts, links: [])
+        
+        # A socket owned by another user is not trusted
+        real_uid = os.getuid()
+        monkeypatch.setattr(sidecar.os, "getuid", lambda: real_uid + 1)
+        client = SidecarClient(path, timeout=5)
+        assert not client.available()
+        with pytest.raises(SidecarUnavailable):
+            client.analyze(["x"])
+    finally:
+        monkeypatch.undo()
+        server.shutdown()
+        server.server_close()
+    
+    # A reply that is not a status byte and a JSON list
+    for reply in (b"", b"\x00not json", b"\x00{}"):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        
+        def answer():
+            conn, _ = listener.accept()
+            recv_frame(conn)
+            send_frame(conn, reply)
+            conn.close()
+        
+        responder = threading.Thread(target=answer, daemon=True)
+        responder.start()
+        with pytest.raises(SidecarUnavailable):
+            SidecarClient(path, timeout=5).analyze(["x"])
+        responder.join()
+        listener.close()
+        os.unlink(path)
+
+def test_parse_message_decodes_text_parts_and_skips_attachments():
+    """Test that text parts are transfer/charset-decoded and attachments are skipped."""
+    attachment = base64.encodebytes(b"%PDF" + b"\0" * 100000)
+    html = base64.encodebytes(
+        '<style>p {color: red}</style><p>Caf&eacute; <a href="https://pay.example/now">offer</a></p>'.encode("utf-8")
+    )
+    raw = (
+        b"Received: by mx.example.com\r\n"
+        b"Subject: =?utf-8?q?Invoice_=E2=82=AC?=\r\n"
+        b"Content-Type: multipart/mixed; boundary=\"OUTER\"\r\n\r\n"
+        b"--OUTER\r\nContent-Type: multipart/alternative; boundary=INNER\r\n\r\n"
+        b"--INNER\r\nContent-Type: text/plain; charset=iso-8859-1\r\n"
+        b"Content-Transfer-Encoding: quoted-printable\r\n\r\nPay the caf=E9 bi=\r\nll today\r\n"
+        b"--INNER\r\nContent-Type: text/html; charset=utf-8\r\n"
+        b"Content-Transfer-Encoding: base64\r\n\r\n" + html + b"--INNER--\r\n"
+        b"--OUTER\r\nContent-Type: application/pdf\r\nContent-Transfer-Encoding: base64\r\n"
+        b"Content-Disposition: attachment; filename=invoice.pdf\r\n\r\n" + attachment +
+        b"--OUTER--\r\n"
+    )
+    message = parse_message(io.BytesIO(raw))
+    
+    assert message.subject == "Invoice \u20ac"
+    assert message.text.strip() == "Pay the caf\u00e9 bill today"
+    assert message.html_text == "Caf\u00e9 offer"
+    assert message.links == ["https://pay.example/now"]
+    assert not message.truncated
+    assert message_text(message).startswith("Invoice \u20ac\n\nPay the caf\u00e9 bill today")
+
+def test_parse_message_bare_text_and_byte_cap():
+    """Test that header-less input is kept as text and extraction is capped."""
+    bare = parse_message(io.BytesIO(b"URGENT: verify your account\nClick here now\n"))
+    assert bare.text == "URGENT: verify your account\nClick here now\n"
+    
+    capped = parse_message(io.BytesIO(b"Subject: long\r\n\r\n" + b"spam " * 100000), max_bytes=1000)
+    assert len(capped.text) == 1000
+    assert capped.truncated
+
+def test_parse_message_from_line():
+    """Test that only a real mbox separator line is dropped, not text starting with "From "."""
+    text = b"From the IT department: your password expires today.\nClick here to keep it.\n"
+    assert parse_message(io.BytesIO(text)).text == text.decode()
+    
+    separated = parse_message(io.BytesIO(b"From alice@example.com Mon Jan  1 00:00:00 2024\nSubject: hi\n\nBody\n"))
+    assert (separated.subject, separated.text) == ("hi", "Body\n")
+    
+    # Separator shape but no header block after it: kept as text
+    no_headers = b"From alice@example.com Mon Jan  1 00:00:00 2024\nplain words\n"
+    assert parse_message(io.BytesIO(no_headers)).text == no_headers.decode()
+
+@pytest.mark.parametrize("charset, body, expected", [
+    ("utf-16", "Pay now".encode("utf-16-le"), "Pay now"),
+    ("utf-16", "Pay now".encode("utf-16"), "Pay now"),
+    ("utf-32", "Pay now".encode("utf-32-le"), "Pay now"),
+    ("rot13", b"Pay now", "Pay now"),
+    ("base64", b"Pay now", "Pay now"),
+    ("idna", b"Pay now", "Pay now"),
+    ("punycode", b"Pay \xff now", "Pay \ufffd now"),
+    ("no-such-charset", b"Pay now", "Pay now"),
+])
+def test_parse_message_bad_charsets(charset, body, expected):
+    """Test that a charset named by the message never makes parsing fail."""
+    raw = f"Subject: s\r\nContent-Type: text/plain; charset={charset}\r\n\r\n".encode() + body
+    
+    assert parse_message(io.BytesIO(raw)).text == expected
+
+def test_parse_message_deeply_nested_multipart():
+    """Test that absurdly nested multiparts are skipped instead of exhausting the stack."""
+    raw = b"Subject: deep\r\nContent-Type: multipart/mixed; boundary=b0\r\n\r\n"
+    for depth in range(1, 3000):
+        raw += b"--b%d\r\nContent-Type: multipart/mixed; boundary=b%d\r\n\r\n" % (depth - 1, depth)
+    raw += b"--b2999\r\nContent-Type: text/plain\r\n\r\nhidden\r\n--b0\r\nContent-Type: text/plain\r\n\r\nshown\r\n--b0--\r\n"
+    message = parse_message(io.BytesIO(raw))
+    
+    assert (message.subject, message.text.strip()) == ("deep", "shown")
+
+def test_html_to_text_drops_markup_and_collects_links():
+    """Test that style/script are dropped, entities decoded and hrefs collected."""
+    html = (
+        "<html><head><title>Account</title><style>.x { color: red }</style></head>"
+        "<body><p>Dear&nbsp;customer &amp; friend</p><script>var a = '<p>hidden</p>';</script>"
+        '<div>Verify <a href="https://verify.example/login">here</a> or '
+        '<a href="mailto:help@example.com">mail us</a></div>'
+        '<a href="https://verify.example/login">again</a></body></html>'
+    )
+    result = html_to_text(html)
+    
+    assert result.text == "Account\nDear customer & friend\nVerify here or mail us\nagain"
+    assert result.links == ["https://verify.example/login", "mailto:help@example.com", "https://verify.example/login"]
+    assert web_links(result.links) == ["https://verify.example/login"]
+    assert not result.truncated
+    
+    capped = html_to_text("<p>" + "word " * 100000 + "</p>", max_chars=500)
+    assert len(capped.text) <= 500
+    assert capped.truncated
+
+def test_links_feed_url_count():
+    """Test that href targets of an HTML body count as URLs."""
+    ai = EmailGuardAI()
+    links = ["https://a.example/1", "https://b.example/2", "https://c.example/3", "mailto:x@example.com"]
+    features = ai._extract_features("Click the buttons below", links=links)
+    
+    assert features['url_count'] == 3
+    assert ai._extract_features("Click the buttons below")['url_count'] == 0
+
+def test_analyze_emails_function():
+    """Test that batched analysis matches single-email analysis."""
+    email_texts = [
+        "Hello, this is a test email.",
+        "",
+        "URGENT: verify your password now at http://secure-verify-now.com/restore",
+        "Hi team, the meeting moved to Thursday at 10am.",
+    ]
+    assert len(analyze_emails(email_texts, batch_size=2)) == len(email_texts)
+    
+    # No result or near-duplicate cache, so both paths really run the model
+    ai = EmailGuardAI(cache_size=0, near_dup_size=0)
+    results = ai.analyze_emails(email_texts, batch_size=2)
+    
+    assert len(results) == len(email_texts)
+    assert results[1]['classification'] == 'invalid'
+    for text, result in zip(email_texts, results):
+        expected = ai.analyze_email(text)
+        assert result['classification'] == expected['classification']
+        assert result['confidence'] == pytest.approx(expected['confidence'], abs=1e-4)
+        assert result['features'] == expected['features']
+        assert result['indicators'] == expected['indicators']
+
 def test_analyze_email_function():
     """Test the convenience analyze_email function."""
     email_text = "Hello, this is a test email."
@@ -0,0 +1,375 @@
+"""
+Unit tests for the Gmail reader, run against a local fake of the Gmail API service.
+"""
+
+import base64
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("googleapiclient")
+pytest.importorskip("google_auth_oauthlib")
+
+# Add the gmail_integration directory to the path
+sys.path.append(str(Path(__file__).parent.parent / "gmail_integration"))
+
+from googleapiclient.errors import HttpError
+
+import gmail_reader
+from gmail_reader import GmailReader, SyncCheckpoint, screen_headers
+
+class FakeHttpError(HttpError):
+    """HttpError with just a status."""
+
+    def __init__(self, status):
+        resp = type("Response", (), {"status": status, "reason": f"HTTP {status}"})()
+        super().__init__(resp, b"")
+        self.resp = resp
+
+class FakeRequest:
+    def __init__(self, service, method, **kwargs):
+        self.service = service
+        self.method = method
+        self.kwargs = kwargs
+
+    def execute(self):
+        self.service.round_trips += 1
+        return self.service.respond(self.method, self.kwargs)
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        assert len(self.requests) < 100, "Gmail batches hold at most 100 requests"
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.round_trips += 1
+        self.service.batch_sizes.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                response = self.service.respond(request.method, request.kwargs)
+            except Exception as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+class FakeHistory:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        return FakeRequest(self.service, "history", **kwargs)
+
+class FakeGmailService:
+    """The subset of the Gmail discovery service used by GmailReader."""
+
+    def __init__(self, count, failures=None):
+        # Newest first, like messages.list
+        self.ids = [f"m{i}" for i in range(count)]
+        # historyId of the mailbox; history older than oldest_history_id has expired
+        self.history_id = 100
+        self.oldest_history_id = 1
+        self.added = []  # (historyId, message id)
+        # message id -> statuses returned by its next requests
+        self.failures = failures or {}
+        # message id -> extra headers
+        self.headers = {}
+        self.formats = []
+        self.round_trips = 0
+        self.batch_sizes = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, **kwargs):
+        return FakeRequest(self, "list", **kwargs)
+
+    def get(self, **kwargs):
+        return FakeRequest(self, "get", **kwargs)
+
+    def history(self):
+        return FakeHistory(self)
+
+    def getProfile(self, **kwargs):
+        return FakeRequest(self, "profile", **kwargs)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def deliver(self, message_id):
+        self.history_id += 1
+        self.ids.insert(0, message_id)
+        self.added.append((self.history_id, message_id))
+
+    def respond(self, method, kwargs):
+        if method == "profile":
+            return {"historyId": str(self.history_id)}
+        if method == "history":
+            start = int(kwargs["startHistoryId"])
+            if start < self.oldest_history_id:
+                raise FakeHttpError(404)
+            # One record per page to exercise nextPageToken
+            records = [(h, i) for h, i in self.added if h > start]
+            offset = int(kwargs.get("pageToken") or 0)
+            response = {"historyId": str(self.history_id), "history": [
+                {"id": str(h), "messagesAdded": [{"message": {"id": i}}]} for h, i in records[offset:offset + 1]
+            ]}
+            if offset + 1 < len(records):
+                response["nextPageToken"] = str(offset + 1)
+            return response
+        if method == "list":
+            assert kwargs["maxResults"] <= 500, "messages.list pages hold at most 500 IDs"
+            offset = int(kwargs.get("pageToken") or 0)
+            end = offset + kwargs["maxResults"]
+            response = {"messages": [{"id": i} for i in self.ids[offset:end]]}
+            if end < len(self.ids):
+                response["nextPageToken"] = str(end)
+            return response
+        message_id = kwargs["id"]
+        statuses = self.failures.get(message_id)
+        if statuses:
+            raise FakeHttpError(statuses.pop(0))
+        self.formats.append(kwargs["format"])
+        headers = [{"name": "Subject", "value": f"Subject {message_id}"}] + self.headers.get(message_id, [])
+        if kwargs["format"] == "metadata":
+            wanted = {name.lower() for name in kwargs["metadataHeaders"]}
+            return {"id": message_id, "snippet": "",
+                    "payload": {"headers": [h for h in headers if h["name"].lower() in wanted]}}
+        data = base64.urlsafe_b64encode(f"Body of {message_id}".encode()).decode()
+        return {
+            "id": message_id,
+            "snippet": "",
+            "payload": {"headers": headers, "body": {"data": data}},
+        }
+
+def test_recent_emails_fetched_in_batches():
+    """Test that message bodies are fetched up to 100 per round-trip, in list order."""
+    service = FakeGmailService(250)
+    emails = GmailReader(service=service).get_recent_emails(250)
+
+    assert [email["id"] for email in emails] == service.ids
+    assert emails[0]["body"] == "Body of m0"
+    assert service.batch_sizes == [100, 100, 50]
+    assert service.round_trips == 4  # one list plus three batches
+
+def test_batch_item_errors(monkeypatch):
+    """Test that rate-limited messages are retried and permanently failing ones are skipped."""
+    monkeypatch.setattr(gmail_reader, "BATCH_RETRIES", 1)
+    service = FakeGmailService(5, failures={"m1": [429], "m3": [404], "m4": [500, 500]})
+    emails = GmailReader(service=service).get_emails_content(service.ids)
+
+    assert [email["id"] for email in emails] == ["m0", "m1", "m2"]
+    assert service.batch_sizes == [5, 2]
+
+def test_incremental_sync(tmp_path, monkeypatch):
+    """Test that later scans only fetch new mail and expired checkpoints trigger a full sync."""
+    monkeypatch.setattr(GmailReader, "analyze_emails",
+                        lambda self, emails: [{"email": email, "analysis": {}} for email in emails])
+    state_file = str(tmp_path / "sync.json")
+    service = FakeGmailService(20)
+    reader = GmailReader(service=service)
+
+    first = reader.scan_inbox(5, state_file)
+    assert [r["email"]["id"] for r in first] == ["m0", "m1", "m2", "m3", "m4"]
+    assert reader.scan_inbox(5, state_file) == []
+
+    service.deliver("new1")
+    service.deliver("new2")
+    second = reader.scan_inbox(5, state_file)
+    assert [r["email"]["id"] for r in second] == ["new1", "new2"]
+    assert SyncCheckpoint.load(state_file).history_id == "102"
+
+    # History expired: full sync of the recent messages, skipping the scanned ones
+    service.deliver("new3")
+    service.oldest_history_id = 200
+    third = reader.scan_inbox(5, state_file)
+    assert [r["email"]["id"] for r in third] == ["new3"]
+
+def test_failed_fetches_retried_next_scan(tmp_path, monkeypatch):
+    """Test that messages failing every retry are fetched again by the next scan, deleted ones are not."""
+    monkeypatch.setattr(gmail_reader, "BATCH_RETRIES", 0)
+    monkeypatch.setattr(GmailReader, "analyze_emails",
+                        lambda self, emails: [{"email": email, "analysis": {}} for email in emails])
+    state_file = str(tmp_path / "sync.json")
+    service = FakeGmailService(0, failures={"new1": [503], "new3": [404]})
+    reader = GmailReader(service=service)
+    reader.scan_inbox(5, state_file)
+    for i in range(4):
+        service.deliver(f"new{i}")
+
+    assert [r["email"]["id"] for r in reader.scan_inbox(5, state_file)] == ["new0", "new2"]
+    checkpoint = SyncCheckpoint.load(state_file)
+    assert checkpoint.history_id == "104"
+    assert checkpoint.pending_ids == {"new1": 1}
+
+    assert [r["email"]["id"] for r in reader.scan_inbox(5, state_file)] == ["new1"]
+    assert SyncCheckpoint.load(state_file).pending_ids == {}
+
+def test_unparseable_messages_retried_next_scan(tmp_path, monkeypatch):
+    """Test that a message fetched but failing to parse is kept pending, not skipped for good."""
+    monkeypatch.setattr(GmailReader, "analyze_emails",
+                        lambda self, emails: [{"email": email, "analysis": {}} for email in emails])
+    state_file = str(tmp_path / "sync.json")
+    service = FakeGmailService(0)
+    reader = GmailReader(service=service)
+    reader.scan_inbox(5, state_file)
+    for i in range(3):
+        service.deliver(f"new{i}")
+    parse = GmailReader._parse_message
+    monkeypatch.setattr(GmailReader, "_parse_message", lambda self, message: (
+        1 / 0 if message["id"] == "new1" else parse(self, message)))
+
+    assert [r["email"]["id"] for r in reader.scan_inbox(5, state_file)] == ["new0", "new2"]
+    checkpoint = SyncCheckpoint.load(state_file)
+    assert checkpoint.history_id == "103"
+    assert checkpoint.pending_ids == {"new1": 1}
+
+def test_interrupted_scan_keeps_history_id(tmp_path, monkeypatch):
+    """Test that stopping a scan midway leaves the historyId so the rest is scanned next time."""
+    monkeypatch.setattr(GmailReader, "analyze_emails",
+                        lambda self, emails: [{"email": email, "analysis": {}} for email in emails])
+    state_file = str(tmp_path / "sync.json")
+    service = FakeGmailService(0)
+    reader = GmailReader(service=service)
+    reader.scan_inbox(5, state_file)
+    for i in range(150):
+        service.deliver(f"new{i}")
+
+    results = reader.iter_scan_inbox(5, state_file, chunk_size=50, fetch_threads=1)
+    seen = [next(results)["email"]["id"] for _ in range(60)]
+    results.close()
+
+    checkpoint = SyncCheckpoint.load(state_file)
+    assert checkpoint.history_id == "100"
+    assert all(checkpoint.is_scanned(f"new{i}") for i in range(50))
+
+    rest = [r["email"]["id"] for r in reader.scan_inbox(5, state_file)]
+    assert rest == [f"new{i}" for i in range(50, 150)]
+    assert seen[:50] == [f"new{i}" for i in range(50)]
+    assert SyncCheckpoint.load(state_file).history_id == "250"
+
+def test_scan_streams_whole_inbox(monkeypatch):
+    """Test that a whole-inbox scan follows nextPageToken and buffers a bounded number of chunks."""
+    monkeypatch.setattr(GmailReader, "analyze_emails",
+                        lambda self, emails: [{"email": email, "analysis": {}} for email in emails])
+    service = FakeGmailService(1234)
+    services = []
+    reader = GmailReader(service=service, service_factory=lambda: services.append(service) or service)
+    results = reader.iter_scan_inbox(None, state_file=None, fetch_threads=2, queue_depth=1)
+
+    next(results)
+    time.sleep(0.3)
+    # One chunk being analyzed, one queued, one held by each blocked fetch thread
+    assert len(service.batch_sizes) <= 4
+
+    assert sum(1 for _ in results) + 1 == 1234
+    assert max(service.batch_sizes) == 100
+    assert len(services) == 2  # one API service per fetch thread
+
+def test_scan_stops_on_fetch_error(monkeypatch):
+    """Test that a failing fetch thread ends the scan with its error."""
+    def fail(self, message_ids, service=None, errors=None):
+        raise RuntimeError("network down")
+    monkeypatch.setattr(GmailReader, "get_emails_content", fail)
+
+    with pytest.raises(RuntimeError, match="network down"):
+        list(GmailReader(service=FakeGmailService(10)).iter_scan_inbox(None, state_file=None))
+
+def mail_headers(sender, auth=None, list_unsubscribe=False):
+    headers = [{"name": "From", "value": sender}]
+    if auth is not None:
+        headers.append({"name": "Authentication-Results", "value": auth})
+    if list_unsubscribe:
+        headers.append({"name": "List-Unsubscribe", "value": "<https://news.example.com/unsub>"})
+    return headers
+
+PASS = "mx.google.com; dkim=pass header.i=@bank.example; spf=pass smtp.mailfrom=bank.example; dmarc=pass header.from=bank.example"
+
+@pytest.mark.parametrize("headers,cleared", [
+    (mail_headers("Bank <alerts@bank.example>", PASS), True),
+    (mail_headers("alerts@mail.bank.example", PASS.replace("header.from=bank", "header.from=mail.bank")), True),
+    (mail_headers("alerts@bank.example"), False),  # no authentication results
+    (mail_headers("alerts@bank.example", PASS.replace("dkim=pass", "dkim=fail")), False),
+    (mail_headers("alerts@bank.example", PASS.replace("mx.google.com", "attacker.example")), False),
+    (mail_headers("alerts@bank.example.evil", PASS.replace("bank.example", "bank.example.evil")), False),
+    # A forged header below Gmail's own one is ignored
+    (mail_headers("alerts@bank.example", "mx.google.com; spf=pass smtp.mailfrom=attacker.example")
+     + [{"name": "Authentication-Results", "value": "mx.google.com; dmarc=pass header.from=bank.example"}], False),
+    (mail_headers("news@shop.example", PASS.replace("bank.example", "shop.example"), True), True),
+    (mail_headers("news@shop.example", PASS.replace("bank.example", "shop.example")), False),
+])
+def test_screen_headers(headers, cleared):
+    """Test that only authenticated mail from allowlisted senders or mailing lists is cleared."""
+    assert (screen_headers(headers, allowlist={"bank.example"}, skip_bulk=True) is not None) == cleared
+
+def test_prescreen_fetches_bodies_only_when_needed(monkeypatch):
+    """Test that cleared messages are never fetched in full nor analyzed."""
+    analyzed = []
+    monkeypatch.setattr(GmailReader, "analyze_emails",
+                        lambda self, emails: analyzed.extend(e["id"] for e in emails) or
+                        [{"email": email, "analysis": {"classification": "spam"}} for email in emails])
+    monkeypatch.setattr(gmail_reader, "SENDER_ALLOWLIST", frozenset({"bank.example"}))
+    service = FakeGmailService(3)
+    service.headers = {
+        "m0": mail_headers("alerts@bank.example", PASS),
+        "m1": mail_headers("alerts@bank.example", PASS.replace("spf=pass", "spf=softfail")),
+    }
+    results = GmailReader(service=service).iter_scan_inbox(3, state_file=None, prescreen=True)
+    classifications = {r["email"]["id"]: r["analysis"]["classification"] for r in results}
+
+    assert classifications == {"m0": "legitimate", "m1": "spam", "m2": "spam"}
+    assert sorted(analyzed) == ["m1", "m2"]
+    assert service.formats.count("metadata") == 3 and service.formats.count("full") == 2
+
+def encoded(text):
+    """Gmail API body data of a text."""
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode()
+
+HTML = '<style>p { color: red }</style><p>Pay&nbsp;now <a href="https://pay.example/x">here</a></p>'
+
+@pytest.mark.parametrize("payload", [
+    {"mimeType": "text/html", "body": {"data": encoded(HTML)}},
+    {"mimeType": "multipart/mixed", "parts": [
+        {"mimeType": "multipart/alternative", "parts": [
+            {"mimeType": "text/html", "body": {"data": encoded(HTML)}},
+        ]},
+        {"mimeType": "application/pdf", "filename": "a.pdf", "body": {"attachmentId": "a1"}},
+    ]},
+])
+def test_html_bodies_extracted_at_any_depth(payload):
+    """Test that single-part and nested HTML bodies go through the HTML extractor."""
+    body, links = GmailReader(FakeGmailService(0))._extract_body(payload)
+    
+    assert body == "Pay now here"
+    assert links == ["https://pay.example/x"]
+
+def test_nested_plain_text_body():
+    """Test that text/plain nested in multipart/mixed -> multipart/alternative is found."""
+    payload = {"mimeType": "multipart/mixed", "parts": [
+        {"mimeType": "multipart/alternative", "parts": [
+            {"mimeType": "text/plain", "body": {"data": encoded("Plain words")}},
+        ]},
+    ]}
+    
+    assert GmailReader(FakeGmailService(0))._extract_body(payload) == ("Plain words", [])
+
+def test_body_decoded_with_part_charset():
+    """Test that bodies are decoded in their declared charset, and bad bytes never fail the parse."""
+    def part(mime_type, data, charset):
+        return {"mimeType": mime_type, "headers": [{"name": "Content-Type", "value": f"{mime_type}; charset={charset}"}],
+                "body": {"data": base64.urlsafe_b64encode(data).decode()}}
+    payload = {"mimeType": "multipart/alternative", "parts": [
+        part("text/plain", "Caf\u00e9 ".encode("latin-1"), "iso-8859-1"),
+        part("text/html", b"<p>bad \xff byte</p>", "utf-8"),
+    ]}
+    
+    assert GmailReader(FakeGmailService(0))._extract_body(payload) == ("Caf\u00e9 bad \ufffd byte", [])
@@ -0,0 +1,311 @@
+"""
+Unit tests for Smart Email Guardian backend services.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+# Add the backend directory (which holds the services package) to the path
+sys.path.append(str(Path(__file__).parent.parent / "backend"))
+
+from services import scan_ids
+from services.history_store import InMemoryHistoryStore, SQLiteHistoryStore, UnknownCursor
+from services.inference_pool import InferencePool, InferenceQueueFull
+from services.memory_report import SMAPS_ROLLUP, memory_report
+from services.micro_batcher import MicroBatcher
+from services.scan_ids import (ScanIdGenerator, claim_worker_id, generate_scan_id, release_worker_id,
+                               scan_id_millis, scan_id_worker)
+from services.scan_stats import ScanStats
+
+def test_inference_pool_rejects_when_queue_full():
+    """Test that calls beyond workers + queue are rejected instead of waiting."""
+    release = threading.Event()
+    
+    def blocking_inference(value):
+        release.wait(timeout=5)
+        return value * 2
+    
+    async def scenario():
+        pool = InferencePool(max_workers=1, max_queue=1)
+        running = [asyncio.ensure_future(pool.run(blocking_inference, i)) for i in range(2)]
+        await asyncio.sleep(0.05)
+        
+        with pytest.raises(InferenceQueueFull):
+            await pool.run(blocking_inference, 99)
+        
+        release.set()
+        results = await asyncio.gather(*running)
+        pool.shutdown()
+        return results, pool.stats()
+    
+    results, stats = asyncio.run(scenario())
+    
+    assert results == [0, 2]
+    assert stats['rejected'] == 1
+    assert stats['completed'] == 2
+    assert stats['in_flight'] == 0
+
+def test_micro_batcher_groups_concurrent_requests():
+    """Test that concurrent submissions share one batched call, in order."""
+    calls = []
+    
+    def batch_inference(items):
+        calls.append(list(items))
+        return [item.upper() for item in items]
+    
+    async def scenario():
+        pool = InferencePool(max_workers=1, max_queue=4)
+        batcher = MicroBatcher(batch_inference, pool, max_batch_size=8, max_wait_ms=50)
+        results = await asyncio.gather(*(batcher.submit(word) for word in ["a", "b", "c"]))
+        await batcher.stop()
+        pool.shutdown()
+        return results, batcher.stats()
+    
+    results, stats = asyncio.run(scenario())
+    
+    assert results == ["A", "B", "C"]
+    assert calls == [["a", "b", "c"]]
+    assert stats['batches'] == 1
+    assert stats['average_batch_size'] == 3
+
+def test_micro_batcher_respects_max_batch_size():
+    """Test that a burst larger than max_batch_size is split into batches."""
+    calls = []
+    
+    def batch_inference(items):
+        calls.append(len(items))
+        return items
+    
+    async def scenario():
+        pool = InferencePool(max_workers=1, max_queue=4)
+        batcher = MicroBatcher(batch_inference, pool, max_batch_size=2, max_wait_ms=20)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        await batcher.stop()
+        pool.shutdown()
+        return results
+    
+    assert asyncio.run(scenario()) == [0, 1, 2, 3, 4]
+    assert calls == [2, 2, 1]
+
+def make_scan(index, user_id=None):
+    """Minimal scan record as stored by the backend."""
+    return {
+        "id": f"scan_{index}",
+        "timestamp": f"2024-01-01T00:00:{index:02d}",
+        "classification": "legitimate",
+        "confidence": 0.9,
+        "user_id": user_id,
+    }
+
+def test_micro_batcher_stop_flushes_pending_items():
+    """Test that stopping resolves the batch being formed and every queued item."""
+    def batch_inference(items):
+        return [item * 10 for item in items]
+    
+    async def scenario():
+        pool = InferencePool(max_workers=1, max_queue=4)
+        batcher = MicroBatcher(batch_inference, pool, max_batch_size=2, max_wait_ms=10000)
+        futures = [asyncio.ensure_future(batcher.submit(i)) for i in range(5)]
+        await asyncio.sleep(0.05)
+        await batcher.stop()
+        results = await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+        pool.shutdown()
+        return results
+    
+    assert asyncio.run(scenario()) == [0, 10, 20, 30, 40]
+
+def test_in_memory_history_store_is_bounded():
+    """Test that the ring buffer drops the oldest scans and keeps per-user counts."""
+    store = InMemoryHistoryStore(max_size=3)
+    for i in range(5):
+        store.add(make_scan(i, user_id="alice" if i % 2 else "bob"))
+    
+    assert len(store) == 3
+    assert [scan["id"] for scan in store.query(limit=0).scans] == ["scan_2", "scan_3", "scan_4"]
+    assert [scan["id"] for scan in store.query(user_id="bob", limit=1).scans] == ["scan_4"]
+    assert store.count("alice") == 1
+    assert store.count("bob") == 2
+
+def test_sqlite_history_store_persists(tmp_path):
+    """Test that the SQLite store filters, limits and survives a reopen."""
+    path = str(tmp_path / "history.db")
+    store = SQLiteHistoryStore(path)
+    for i in range(5):
+        store.add(make_scan(i, user_id="alice" if i % 2 else "bob"))
+    store.close()
+    
+    store = SQLiteHistoryStore(path)
+    assert len(store) == 5
+    assert [scan["id"] for scan in store.query(user_id="bob", limit=2).scans] == ["scan_2", "scan_4"]
+    assert store.count("alice") == 2
+    assert store.query(limit=1).scans[0] == make_scan(4, user_id="bob")
+    store.close()
+
+def test_sqlite_history_store_running_counts(tmp_path):
+    """Test that counts come from the running counts table, backfilled for an existing database."""
+    path = str(tmp_path / "history.db")
+    store = SQLiteHistoryStore(path)
+    for i in range(6):
+        store.add(make_scan(i, user_id="alice" if i % 3 else None))
+    # A database created before the counts table existed
+    for statement in ("DROP TRIGGER scans_counted_insert", "DROP TRIGGER scans_counted_delete",
+                      "DROP TABLE scan_counts"):
+        store._conn.execute(statement)
+    store._conn.commit()
+    store.close()
+    
+    store = SQLiteHistoryStore(path)
+    assert (store.count(), store.count("alice"), store.count("bob")) == (6, 4, 0)
+    store.add(make_scan(6, user_id="bob"))
+    store._conn.execute("DELETE FROM scans WHERE id = 'scan_1'")
+    assert (store.count(), store.count("alice"), store.count("bob")) == (6, 3, 1)
+    store.close()
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_history_store_cursor_pagination(backend, tmp_path):
+    """Test that following next_cursor walks a user's history back to the start."""
+    if backend == "memory":
+        store = InMemoryHistoryStore(max_size=100)
+    else:
+        store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    for i in range(10):
+        store.add(make_scan(i, user_id="alice" if i % 3 else "bob"))
+    
+    pages, cursor = [], None
+    while True:
+        page = store.query(user_id="alice", limit=2, after=cursor)
+        pages.append([scan["id"] for scan in page.scans])
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    
+    assert pages == [["scan_7", "scan_8"], ["scan_4", "scan_5"], ["scan_1", "scan_2"]]
+    assert store.query(limit=3, after="scan_3").scans[0]["id"] == "scan_0"
+    with pytest.raises(UnknownCursor):
+        store.query(after="scan_missing")
+    store.close()
+
+def test_scan_stats_running_aggregates():
+    """Test that stats are kept per class, per user and within the recent window."""
+    stats = ScanStats(window_seconds=3600, bucket_seconds=60)
+    now = datetime.now()
+    scans = [
+        dict(make_scan(0, "alice"), timestamp=now.isoformat(), classification="phishing", confidence=0.8),
+        dict(make_scan(1, "bob"), timestamp=(now - timedelta(minutes=5)).isoformat(), confidence=0.6),
+        dict(make_scan(2, "alice"), timestamp=(now - timedelta(hours=3)).isoformat(), confidence=0.7),
+    ]
+    for scan in scans:
+        stats.record(scan)
+    
+    snapshot = stats.snapshot()
+    assert snapshot["total_scans"] == 3
+    assert snapshot["classifications"] == {"phishing": 1, "legitimate": 2}
+    assert snapshot["recent_activity"]["last_24_hours"] == 2
+    assert snapshot["recent_activity"]["classifications"] == {"phishing": 1, "legitimate": 1}
+    assert snapshot["recent_activity"]["average_confidence"] == pytest.approx(0.7)
+    
+    alice = stats.snapshot("alice")
+    assert alice["total_scans"] == 2
+    assert alice["recent_activity"]["last_24_hours"] == 1
+    assert stats.snapshot("carol")["total_scans"] == 0
+
+def test_scan_stats_seeded_from_sqlite_aggregates(tmp_path):
+    """Test that seeding from the store's aggregates matches recording every scan."""
+    now = datetime.now()
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    recorded = ScanStats(window_seconds=3600, bucket_seconds=60)
+    for i in range(20):
+        scan = dict(make_scan(i, "alice" if i % 2 else None),
+                    timestamp=(now - timedelta(minutes=7 * i)).isoformat(),
+                    classification="phishing" if i % 3 else "legitimate", confidence=i / 20)
+        store.add(scan)
+        recorded.record(scan)
+    
+    def no_full_scan():
+        raise AssertionError("seeding must not load every stored scan")
+    store.scans = no_full_scan
+    seeded = ScanStats(window_seconds=3600, bucket_seconds=60)
+    seeded.load(store)
+    
+    for user_id in (None, "alice"):
+        expected, actual = recorded.snapshot(user_id), seeded.snapshot(user_id)
+        assert actual["recent_activity"].pop("average_confidence") == pytest.approx(
+            expected["recent_activity"].pop("average_confidence"))
+        assert actual == expected
+    store.close()
+
+def test_scan_ids_are_unique_and_time_ordered():
+    """Test that scan IDs never repeat, sort by creation order and encode their time."""
+    generator = ScanIdGenerator(worker_id=7)
+    before = int(time.time() * 1000)
+    ids = [generator.generate() for _ in range(3000)]
+    
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert all(len(scan_id) == len(ids[0]) and scan_id.startswith("scan_") for scan_id in ids)
+    assert before <= scan_id_millis(ids[0]) <= int(time.time() * 1000)
+    assert ScanIdGenerator(worker_id=8).generate() not in ids
+    assert {scan_id_worker(scan_id) for scan_id in ids} == {7}
+
+def test_scan_id_sequence_waits_for_next_millisecond(monkeypatch):
+    """Test that the sequence restarts every millisecond and never wraps within one."""
+    clock = iter([5_000_000] * 4200 + [6_000_000] * 10)
+    monkeypatch.setattr(scan_ids.time, "time_ns", lambda: next(clock))
+    generator = ScanIdGenerator(worker_id=1)
+    ids = [generator.generate() for _ in range(4097)]
+    
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert [scan_id_millis(scan_id) for scan_id in ids[-2:]] == [5, 6]
+    assert generator.generate() == ids[-1][:-1] + "1"
+
+def test_worker_ids_are_claimed_exclusively(tmp_path):
+    """Test that a worker id held by another lock holder is refused or skipped."""
+    lock_dir = str(tmp_path)
+    other = scan_ids._try_lock(5, lock_dir)
+    try:
+        with pytest.raises(RuntimeError):
+            claim_worker_id(5, lock_dir)
+        claimed = claim_worker_id(lock_dir=lock_dir)
+        assert claimed != 5
+        assert claim_worker_id(claimed, lock_dir) == claimed
+        release_worker_id(claimed, lock_dir)
+    finally:
+        os.close(other)
+    assert claim_worker_id(5, lock_dir) == 5
+    release_worker_id(5, lock_dir)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_forked_worker_claims_its_own_worker_id():
+    """Test that a forked process does not keep generating with its parent's worker id."""
+    parent_id = generate_scan_id()
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_end, generate_scan_id().encode())
+        os._exit(0)
+    os.close(write_end)
+    child_id = os.read(read_end, 64).decode()
+    os.waitpid(pid, 0)
+    os.close(read_end)
+    
+    assert scan_id_worker(parent_id) != scan_id_worker(child_id)
+
+def test_memory_report_fields():
+    """Test that the memory report covers this process, with PSS where smaps_rollup exists."""
+    report = memory_report()
+
+    assert report['pid'] == os.getpid()
+    assert report['max_rss_kb'] > 0
+    if os.path.exists(SMAPS_ROLLUP):
+        assert 0 < report['pss_kb'] <= report['rss_kb']
+        assert report['rss_kb'] == pytest.approx(
+            report['shared_clean_kb'] + report['shared_dirty_kb']
+            + report['private_clean_kb'] + report['private_dirty_kb'], abs=4)